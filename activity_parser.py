@@ -0,0 +1,149 @@
+"""
+Leitura rápida do corpo de /api/messages.
+
+O caminho padrão do SDK (`Activity().deserialize(body)`) percorre, por reflexão, todos os ~40
+campos da Activity e monta objetos para anexos, entidades, ações sugeridas etc. que o Tralhobot
+não lê. Aqui o JSON é decodificado com orjson (se instalado) e vira uma SlimActivity: só os campos
+usados em todo turno são preenchidos, direto do dicionário; qualquer outro campo lido dispara,
+uma única vez, a desserialização completa do SDK.
+
+Benchmark por requisição com as atividades de exemplo em data/sample_activities.json:
+python activity_parser.py
+"""
+import json
+from typing import Any, Dict
+
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+from metrics import ACTIVITY_FULL_DESERIALIZATIONS
+
+try:
+    import orjson
+
+    def loads(body: bytes) -> Any:
+        return orjson.loads(body)
+
+    JSON_DECODER = "orjson"
+except ImportError:  # pragma: no cover - orjson é opcional
+    def loads(body: bytes) -> Any:
+        return json.loads(body)
+
+    JSON_DECODER = "json"
+
+# Campos lidos em todo turno pelo adaptador, pelo TurnContext/ActivityHandler e pelo Tralhobot.
+# Os de tipo simples (str, bool ou "object") vêm do JSON sem conversão.
+_HOT_FIELDS = (
+    ("type", "type"), ("id", "id"), ("text", "text"), ("channel_id", "channelId"),
+    ("service_url", "serviceUrl"), ("locale", "locale"), ("delivery_mode", "deliveryMode"),
+    ("reply_to_id", "replyToId"), ("channel_data", "channelData"), ("value", "value"),
+    ("name", "name"), ("caller_id", "callerId"),
+)
+_ACCOUNT_FIELDS = (
+    ("from_property", "from", ChannelAccount),
+    ("recipient", "recipient", ChannelAccount),
+    ("conversation", "conversation", ConversationAccount),
+)
+_ACCOUNT_LIST_FIELDS = (
+    ("members_added", "membersAdded"),
+    ("members_removed", "membersRemoved"),
+)
+
+
+# (atributo, chave no JSON) de cada modelo de conta, e as chaves conhecidas: as desconhecidas vão
+# para additional_properties, como no msrest
+_ACCOUNT_KEYS = {
+    model_class: (
+        tuple((attr, spec["key"]) for attr, spec in model_class._attribute_map.items()),  # pylint: disable=protected-access
+        frozenset(spec["key"] for spec in model_class._attribute_map.values()),  # pylint: disable=protected-access
+    )
+    for model_class in (ChannelAccount, ConversationAccount)
+}
+
+
+def _account(model_class, data):
+    """ChannelAccount/ConversationAccount montado direto do dicionário (todos os campos são simples)."""
+    if data is None:
+        return None
+    account = model_class.__new__(model_class)
+    values = account.__dict__
+    keys, known = _ACCOUNT_KEYS[model_class]
+    values["additional_properties"] = {key: value for key, value in data.items() if key not in known}
+    for attr, key in keys:
+        values[attr] = data.get(key)
+    return account
+
+
+class SlimActivity(Activity):
+    """
+    Activity com só os campos do caminho quente preenchidos. Os demais não existem no objeto
+    até serem lidos: o primeiro acesso (ou um serialize()) desserializa o corpo completo pelo
+    SDK e preenche o que falta, sem sobrescrever o que já foi alterado no turno.
+    """
+
+    def __init__(self, data: Dict):  # pylint: disable=super-init-not-called
+        values = self.__dict__
+        values["_raw"] = data
+        for attr, key in _HOT_FIELDS:
+            values[attr] = data.get(key)
+        for attr, key, model_class in _ACCOUNT_FIELDS:
+            values[attr] = _account(model_class, data.get(key))
+        for attr, key in _ACCOUNT_LIST_FIELDS:
+            members = data.get(key)
+            values[attr] = [_account(ChannelAccount, member) for member in members] if members is not None else None
+
+    def __getattr__(self, name: str):
+        # Só é chamado para atributos que ainda não estão no objeto
+        values = self.__dict__
+        if name.startswith("__") or "_raw" not in values:
+            raise AttributeError(name)
+        self._materialize()
+        try:
+            return values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def _materialize(self):
+        ACTIVITY_FULL_DESERIALIZATIONS.inc()
+        full = Activity().deserialize(self.__dict__.pop("_raw"))
+        for attr, value in full.__dict__.items():
+            self.__dict__.setdefault(attr, value)
+
+
+def parse_activity(body: bytes, fast: bool = True) -> Activity:
+    """Decodifica o corpo da requisição. Lança ValueError se não for um objeto JSON."""
+    data = loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("O corpo deve ser um objeto JSON.")
+    if fast:
+        return SlimActivity(data)
+    return Activity().deserialize(data)
+
+
+if __name__ == "__main__":
+    import timeit
+
+    with open("data/sample_activities.json", encoding="utf-8") as samples_file:
+        samples = [json.dumps(sample, ensure_ascii=False).encode("utf-8") for sample in json.load(samples_file)]
+
+    # A SlimActivity precisa mostrar nos campos do caminho quente o mesmo que a desserialização completa,
+    # e, depois de um acesso a outro campo, ser igual a ela por inteiro
+    hot_attrs = [attr for attr, _ in _HOT_FIELDS] + [attr for attr, _, _ in _ACCOUNT_FIELDS] + [attr for attr, _ in _ACCOUNT_LIST_FIELDS]
+    for body in samples:
+        full, slim = parse_activity(body, fast=False), parse_activity(body)
+        for attr in hot_attrs:
+            assert getattr(slim, attr) == getattr(full, attr), attr
+        assert "_raw" in slim.__dict__, "Nenhum campo fora do caminho quente deveria ter sido lido"
+        assert slim.serialize() == full.serialize()
+        assert "_raw" not in slim.__dict__ and all(getattr(slim, attr) == getattr(full, attr) for attr in Activity._attribute_map)  # pylint: disable=protected-access
+    print(f"{len(samples)} atividades: campos do caminho quente e serialize() iguais à desserialização completa.")
+
+    runs = 5000
+    print(f"decodificador JSON: {JSON_DECODER}")
+    print(f"{'atividade':<32} {'bytes':>6} {'json + deserialize us':>22} {'json + slim us':>15} {'rápido us':>10} {'ganho':>6}")
+    for body in samples:
+        data = json.loads(body)
+        name = f"{data['channelId']}/{data['type']}"
+        before = timeit.timeit(lambda: Activity().deserialize(json.loads(body)), number=runs) / runs * 1e6
+        slim_only = timeit.timeit(lambda: SlimActivity(json.loads(body)), number=runs) / runs * 1e6
+        after = timeit.timeit(lambda: parse_activity(body), number=runs) / runs * 1e6
+        print(f"{name:<32} {len(body):>6} {before:>22.1f} {slim_only:>15.1f} {after:>10.1f} {before / after:>5.1f}x")
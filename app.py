@@ -1,83 +1,37 @@
 # Copyright (c) Microsoft Corporation. Todos os direitos reservados.
 # Licenciado sob a Licença MIT.
 
-# Bibliotecas padrão
-import sys
-import traceback
-from datetime import datetime
-
 # Bibliotecas web/aiohttp
+import asyncio
+
 from aiohttp import web
 from aiohttp.web import Request, Response, json_response
 
-# Componentes do Bot Framework
-from botbuilder.core import (
-    BotFrameworkAdapterSettings,
-    TurnContext,
-    BotFrameworkAdapter,
-    ConversationState,  # Estado da conversa
-    UserState,          # Estado do usuário
-    MemoryStorage       # Armazenamento volátil (memória)
-)
-from botbuilder.schema import Activity, ActivityTypes
-
-# Módulos locais
-from bots.tralhobot import Tralhobot  # Classe principal do bot
+# Módulos locais (leves: o SDK do Bot Framework/Azure só é importado pelo BotRuntime)
+from startup import BotRuntime  # Montagem do bot em segundo plano + aquecimento das conexões
 from config import DefaultConfig      # Configurações
+from log_utils import get_logger, setup_logging  # Logs estruturados sem bloquear o loop
+from metrics import CONTENT_TYPE, REGISTRY  # Métricas no formato Prometheus
+from rate_limit import RateLimited  # Limites por remetente, por conversa e de turnos simultâneos
+from tracing import PROFILER, admin_authorized, profile_request, setup_tracing  # Spans por fase + perfil sob demanda
 
 # Carrega configurações (App ID, Password, Porta, etc.)
 CONFIG = DefaultConfig()
 
-# --------------------------------------------------
-# 1. CONFIGURAÇÃO DO ADAPTADOR
-# --------------------------------------------------
-# Define credenciais e cria adaptador (conector com o Bot Framework)
-SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
-ADAPTER = BotFrameworkAdapter(SETTINGS)
-
-# --------------------------------------------------
-# 2. TRATAMENTO DE ERROS GLOBAL
-# --------------------------------------------------
-async def on_error(context: TurnContext, error: Exception):
-    """Captura exceções não tratadas durante a execução do bot."""
-    
-    # Log no console (em produção, usar Application Insights)
-    print(f"\n [on_turn_error] ERRO: {error}", file=sys.stderr)
-    traceback.print_exc()  # Stack trace completo
-
-    # Notifica o usuário
-    await context.send_activity("Desculpe, algo deu errado no Tralhobot.")
-    
-    # Se no Emulator, envia detalhes técnicos
-    if context.activity.channel_id == "emulator":
-        trace_activity = Activity(
-            label="ErroDetalhado",
-            name="on_turn_error Trace",
-            timestamp=datetime.utcnow(),
-            type=ActivityTypes.trace,
-            value=f"{error}",
-            value_type="https://www.botframework.com/schemas/error",
-        )
-        await context.send_activity(trace_activity)
-
-# Registra o handler de erros
-ADAPTER.on_turn_error = on_error
-
-# --------------------------------------------------
-# 3. CONFIGURAÇÃO DE ESTADO (MEMÓRIA)
-# --------------------------------------------------
-# Armazenamento temporário (não persistente)
-MEMORY = MemoryStorage()
-
-# Estados para gerenciar dados do usuário e da conversa
-USER_STATE = UserState(MEMORY)           # Ex: preferências do usuário
-CONVERSATION_STATE = ConversationState(MEMORY)  # Ex: histórico da conversa
+# Antes de tudo: os módulos abaixo já registram eventos durante a inicialização
+setup_logging(CONFIG)
+setup_tracing(CONFIG)
+LOGGER = get_logger("app")
 
 # --------------------------------------------------
-# 4. INICIALIZAÇÃO DO BOT
+# 1-4. ADAPTADOR, CLIENTE CLU, ESTADO E BOT
 # --------------------------------------------------
-# Cria a instância do bot com os estados configurados
-BOT = Tralhobot(CONVERSATION_STATE, USER_STATE)
+# Mesmo adaptador customizado do app_flask.py (reescrita do serviceUrl no Render), cliente CLU
+# assíncrono, storage conforme CONFIG.STATE_STORAGE, Tralhobot e fila de turnos: ver startup.py.
+# Com STARTUP_LAZY=true tudo isso é montado em uma thread depois que o servidor sobe.
+RUNTIME = BotRuntime(CONFIG)
+if not CONFIG.STARTUP_LAZY:
+    RUNTIME.build()
 
 # --------------------------------------------------
 # 5. ENDPOINT PRINCIPAL (/api/messages)
@@ -90,21 +44,37 @@ async def messages(req: Request) -> Response:
         return Response(status=415)  # Código 415 - Tipo de mídia não suportado
     
     try:
-        body = await req.json()  # Extrai os dados da requisição
+        runtime = await RUNTIME.wait_ready()  # Na partida a frio, espera a montagem em segundo plano
+    except Exception as e:
+        LOGGER.error("Bot indisponível: %s", e)
+        return Response(status=503, headers={"Retry-After": "1"})
+
+    try:
+        # Só os campos usados no turno; o resto é desserializado se alguém ler (ver activity_parser.py)
+        activity = runtime.parse(await req.read())
     except Exception as e:
         return Response(status=400, text=f"Erro ao parsear JSON: {e}")
 
-    activity = Activity().deserialize(body)
     auth_header = req.headers.get("Authorization", "")
 
+    # Confirmação imediata: autentica, enfileira o turno e responde 202 sem esperar o bot
+    if runtime.can_defer(activity):
+        try:
+            accepted = await runtime.submit(activity, auth_header)
+        except PermissionError:
+            return Response(status=401)
+        except RateLimited as e:
+            return Response(status=429, headers={"Retry-After": e.retry_after_header})  # Sem CLU nem estado
+        if not accepted:
+            return Response(status=503, headers={"Retry-After": "1"})  # Fila cheia: o canal tenta de novo
+        return Response(status=202)  # 202 - Aceito (retentativas duplicadas também recebem 202)
+
     try:
-        response = await ADAPTER.process_activity(
-            activity, 
-            auth_header, 
-            BOT.on_turn  # Método que processa a mensagem
-        )
+        response = await runtime.process(activity, auth_header)  # Tralhobot.on_turn processa a mensagem
+    except RateLimited as e:
+        return Response(status=429, headers={"Retry-After": e.retry_after_header})  # Sem CLU nem estado
     except Exception as e:
-        traceback.print_exc() # Imprime o traceback
+        LOGGER.exception("Erro no adaptador ao processar a atividade: %s", e)
         return Response(status=500, text=f"Erro interno do adaptador: {e}")
 
     if response:
@@ -114,14 +84,78 @@ async def messages(req: Request) -> Response:
 # --------------------------------------------------
 # 6. SERVIDOR WEB
 # --------------------------------------------------
+async def start_runtime(app: web.Application):
+    """Agenda o aquecimento das conexões e, com STARTUP_LAZY, monta o bot em uma thread."""
+    RUNTIME.start(asyncio.get_running_loop())
+
+async def close_turn_queue(app: web.Application):
+    """Antes de desligar, conclui os turnos que já foram confirmados com 202."""
+    await RUNTIME.drain()
+
+async def queue_stats(req: Request) -> Response:
+    """Profundidade e tempos de espera da fila de turnos."""
+    if RUNTIME.turn_queue is None:
+        return json_response(data={"enabled": False})
+    return json_response(data={"enabled": True, **RUNTIME.turn_queue.stats()})
+
+async def metrics(req: Request) -> Response:
+    """Histogramas e contadores do bot no formato de texto do Prometheus."""
+    return Response(body=REGISTRY.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+async def healthz(req: Request) -> Response:
+    """Health check do Render: 200 com o bot montado, 503 enquanto ele sobe."""
+    status, body = RUNTIME.health()
+    return json_response(data=body, status=status)
+
+async def warmup(req: Request) -> Response:
+    """Conclui a montagem e o aquecimento (conexões, token, chaves de assinatura, classificador)."""
+    try:
+        return json_response(data=await RUNTIME.warmup())
+    except Exception as e:
+        LOGGER.error("Falha no aquecimento: %s", e)
+        return json_response(data={"error": str(e)}, status=503)
+
+async def admin_profile(req: Request) -> Response:
+    """Perfil dos próximos N turnos (cProfile ou amostragem de pilha), protegido por ADMIN_TOKEN."""
+    if not CONFIG.ADMIN_TOKEN:
+        return Response(status=404)
+    if not admin_authorized(CONFIG, req.headers.get("Authorization", "")):
+        return Response(status=401)
+    try:
+        turns, mode, timeout = profile_request(req.query, CONFIG)
+    except ValueError as e:
+        return Response(status=400, text=str(e))
+    try:
+        report = await PROFILER.run(turns, mode, timeout)
+    except RuntimeError as e:
+        return Response(status=409, text=str(e))  # Já existe um perfil em andamento
+    return Response(text=report, content_type="text/plain")
+
+async def close_runtime(app: web.Application):
+    """Fecha as conexões do CLU, do Bot Connector e das chaves de assinatura, e o storage de estado."""
+    await RUNTIME.close()
+
 APP = web.Application()
 APP.router.add_post("/api/messages", messages)  # Registra o endpoint
+APP.router.add_get("/api/queue", queue_stats)  # Métricas da fila de turnos
+APP.router.add_get("/metrics", metrics)  # Coleta do Prometheus
+APP.router.add_get("/healthz", healthz)  # Health check (Render)
+APP.router.add_get("/warmup", warmup)  # Aquecimento sob demanda
+APP.router.add_post("/admin/profile", admin_profile)  # Perfil sob demanda (ADMIN_TOKEN)
+APP.on_startup.append(start_runtime)
+APP.on_shutdown.append(close_turn_queue)
+APP.on_cleanup.append(close_runtime)
 
 if __name__ == "__main__":
     try:
-        # Inicia o servidor na porta configurada
-        print(f"\n======== Servidor web rodando em http://127.0.0.1:{CONFIG.PORT} ========")
-        web.run_app(APP, host="127.0.0.1", port=CONFIG.PORT) # host="127.0.0.1" forçado para IPv4
+        if CONFIG.SHARD_SOCKET:
+            # Worker do sharded_server.py: recebe só as conversas da sua fatia, pelo socket unix
+            LOGGER.info("Worker escutando em %s", CONFIG.SHARD_SOCKET)
+            web.run_app(APP, path=CONFIG.SHARD_SOCKET, print=None)
+        else:
+            # Inicia o servidor na porta configurada
+            LOGGER.info("Servidor web rodando em http://%s:%s", CONFIG.HOST, CONFIG.PORT)
+            web.run_app(APP, host=CONFIG.HOST, port=CONFIG.PORT, print=None) # HOST padrão "127.0.0.1" forçado para IPv4
     except Exception as error:
-        traceback.print_exc()
+        LOGGER.exception("Falha ao iniciar o servidor web: %s", error)
         raise error
\ No newline at end of file
@@ -1,73 +1,35 @@
-from flask import Flask, request, jsonify
-from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext, ConversationState, UserState, MemoryStorage
-from botbuilder.schema import Activity
-from bots.tralhobot import Tralhobot
+from flask import Flask, Response, request, jsonify
+from startup import BotRuntime
 from config import DefaultConfig
+from log_utils import get_logger, setup_logging
+from metrics import CONTENT_TYPE, REGISTRY
+from rate_limit import RateLimited
+from tracing import PROFILER, admin_authorized, profile_request, setup_tracing
 import asyncio
-import traceback
-import os # Garante que 'os' está importado
-
-from azure.ai.language.conversations import ConversationAnalysisClient
-from azure.core.credentials import AzureKeyCredential
+import threading
 
 app = Flask(__name__)
 
 CONFIG = DefaultConfig()
-
-SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
-
-# === CORREÇÃO AQUI: CLASSE ADAPTER CUSTOMIZADA PARA RESOLVER 'os' NÃO DEFINIDO ===
-class CustomBotFrameworkAdapter(BotFrameworkAdapter):
-    def __init__(self, settings: BotFrameworkAdapterSettings):
-        super().__init__(settings)
-        # O RENDER_HOSTNAME agora é inicializado dentro do construtor
-        # onde 'os' está no escopo correto.
-        self._prod_service_url = "https://" + (os.environ.get("RENDER_EXTERNAL_HOSTNAME") or "")
-        if not os.environ.get("RENDER_EXTERNAL_HOSTNAME"):
-             print("AVISO: Variável de ambiente RENDER_EXTERNAL_HOSTNAME não encontrada. Pode afetar respostas em produção.")
-        print(f"ADAPTER: _prod_service_url inicializado como: {self._prod_service_url}")
-
-    async def get_service_url(self, turn_context: TurnContext) -> str:
-        service_url = turn_context.activity.service_url
-
-        if self._prod_service_url and ("localhost" in service_url or not service_url):
-            print(f"ADAPTER: serviceUrl '{service_url}' da atividade substituído por '{self._prod_service_url}'")
-            return self._prod_service_url
-        
-        print(f"ADAPTER: Usando serviceUrl da atividade: '{service_url}'")
-        return service_url
-
-# Inicialize o adaptador customizado
-ADAPTER = CustomBotFrameworkAdapter(SETTINGS) # Não precisa passar prod_service_url aqui, pois é inicializado internamente
-# === FIM DA CORREÇÃO AQUI ===
-
-
-MEMORY = MemoryStorage()
-CONVERSATION_STATE = ConversationState(MEMORY)
-USER_STATE = UserState(MEMORY)
-
-# --- INICIALIZAÇÃO DO CLIENTE CLU ---
-CLU_CLIENT = None
-if CONFIG.CLU_ENDPOINT and CONFIG.CLU_API_KEY:
-    try:
-        CLU_CLIENT = ConversationAnalysisClient(
-            endpoint=CONFIG.CLU_ENDPOINT,
-            credential=AzureKeyCredential(CONFIG.CLU_API_KEY)
-        )
-        print("CLU Client inicializado com sucesso.")
-    except Exception as e:
-        print(f"ERRO: Falha ao inicializar CLU Client: {e}")
-        traceback.print_exc()
-else:
-    print("AVISO: Credenciais CLU (ENDPOINT/API_KEY) não configuradas. O bot não usará o CLU para NLU.")
-
-BOT = Tralhobot(
-    CONVERSATION_STATE,
-    USER_STATE,
-    CLU_CLIENT,
-    CONFIG.CLU_PROJECT_NAME,
-    CONFIG.CLU_DEPLOYMENT_NAME
-)
+setup_logging(CONFIG)
+setup_tracing(CONFIG)
+LOGGER = get_logger("app")
+
+# --- LOOP DE EVENTOS PERSISTENTE ---
+# Um único loop por worker, rodando em uma thread dedicada. Todas as requisições
+# agendam o processamento nele, então as conexões HTTP mantidas pelo conector do
+# Bot Framework e pelo cliente CLU sobrevivem entre os turnos.
+LOOP = asyncio.new_event_loop()
+threading.Thread(target=LOOP.run_forever, name="bot-event-loop", daemon=True).start()
+
+# Adaptador customizado (ver bot_adapter.py), cliente CLU assíncrono (seguro aqui porque todas as
+# chamadas acontecem no LOOP acima), storage conforme CONFIG.STATE_STORAGE, Tralhobot e fila de
+# turnos, usada apenas dentro do LOOP: ver startup.py. Com STARTUP_LAZY=true o gunicorn recebe o
+# app sem esperar o SDK ser importado, e a montagem termina em uma thread.
+RUNTIME = BotRuntime(CONFIG)
+if not CONFIG.STARTUP_LAZY:
+    RUNTIME.build()
+RUNTIME.start(LOOP)
 
 @app.route("/api/messages", methods=["POST"])
 def messages():
@@ -75,37 +37,94 @@ def messages():
         return jsonify({"error": "Tipo de conteúdo não suportado"}), 415
 
     try:
-        body = request.json
+        runtime = RUNTIME.wait_ready_sync()  # Na partida a frio, espera a montagem em segundo plano
     except Exception as e:
-        print(f"Erro ao parsear JSON: {e}")
-        traceback.print_exc()
+        LOGGER.error("Bot indisponível: %s", e)
+        return jsonify({"error": "Bot iniciando"}), 503, {"Retry-After": "1"}
+
+    try:
+        activity = runtime.parse(request.get_data())
+    except Exception as e:
+        LOGGER.warning("Erro ao parsear JSON: %s", e)
         return jsonify({"error": "Bad Request - JSON Inválido"}), 400
 
-    activity = Activity().deserialize(body)
     auth_header = request.headers.get("Authorization", "")
 
+    # Confirmação imediata: autentica e enfileira no LOOP, respondendo 202 sem esperar o bot
+    if runtime.can_defer(activity):
+        future = asyncio.run_coroutine_threadsafe(runtime.submit(activity, auth_header), LOOP)
+        try:
+            accepted = future.result()
+        except PermissionError:
+            return jsonify({"error": "Não autorizado"}), 401
+        except RateLimited as e:
+            return jsonify({"error": "Muitas mensagens"}), 429, {"Retry-After": e.retry_after_header}
+        if not accepted:
+            return jsonify({"error": "Fila de processamento cheia"}), 503, {"Retry-After": "1"}
+        return jsonify({"status": "Solicitação aceita para processamento."}), 202
+
     async def _process_activity_async():
         try:
-            await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
+            await runtime.process(activity, auth_header)
+        except RateLimited:
+            raise  # Vira 429 na thread da requisição
         except Exception as e:
-            print(f"Erro ao processar atividade assíncrona: {e}")
-            traceback.print_exc()
+            LOGGER.exception("Erro ao processar atividade assíncrona: %s", e)
 
     try:
-        asyncio.run(_process_activity_async())
-    except RuntimeError as e:
-        print(f"RuntimeError ao executar asyncio.run(): {e}. Tentando outra abordagem...")
-        traceback.print_exc()
-        try:
-            loop = asyncio.get_running_loop()
-            loop.create_task(_process_activity_async())
-            print("Tarefa agendada com sucesso.")
-        except RuntimeError:
-            print("Não foi possível agendar a tarefa assíncrona: nenhum loop de eventos rodando.")
-            return jsonify({"error": "Erro interno no servidor ao agendar processamento do bot."}), 500
+        # Agenda no loop persistente e aguarda o fim do turno nesta thread da requisição
+        asyncio.run_coroutine_threadsafe(_process_activity_async(), LOOP).result()
+    except RateLimited as e:
+        return jsonify({"error": "Muitas mensagens"}), 429, {"Retry-After": e.retry_after_header}
+    except Exception as e:
+        LOGGER.exception("Erro ao agendar a tarefa assíncrona no loop do worker: %s", e)
+        return jsonify({"error": "Erro interno no servidor ao agendar processamento do bot."}), 500
 
     return jsonify({"status": "Solicitação recebida, processamento iniciado."}), 201
 
+@app.route("/api/queue", methods=["GET"])
+def queue_stats():
+    if RUNTIME.turn_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **RUNTIME.turn_queue.stats()})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # As métricas são gravadas só pelo LOOP; aqui apenas lemos uma cópia de cada série
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Health check do Render: 200 com o bot montado, 503 enquanto ele sobe
+    status, body = RUNTIME.health()
+    return jsonify(body), status
+
+@app.route("/warmup", methods=["GET"])
+def warmup():
+    # Conclui a montagem e o aquecimento (conexões, token, chaves de assinatura, classificador) no LOOP
+    try:
+        return jsonify(asyncio.run_coroutine_threadsafe(RUNTIME.warmup(), LOOP).result())
+    except Exception as e:
+        LOGGER.error("Falha no aquecimento: %s", e)
+        return jsonify({"error": str(e)}), 503
+
+@app.route("/admin/profile", methods=["POST"])
+def admin_profile():
+    # Perfil dos próximos N turnos, coletado no LOOP (a thread que roda os turnos); protegido por ADMIN_TOKEN
+    if not CONFIG.ADMIN_TOKEN:
+        return jsonify({"error": "Não encontrado"}), 404
+    if not admin_authorized(CONFIG, request.headers.get("Authorization", "")):
+        return jsonify({"error": "Não autorizado"}), 401
+    try:
+        turns, mode, timeout = profile_request(request.args, CONFIG)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        report = asyncio.run_coroutine_threadsafe(PROFILER.run(turns, mode, timeout), LOOP).result()
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return Response(report, content_type="text/plain")
+
 if __name__ == '__main__':
-    print("Iniciando servidor de desenvolvimento Flask (apenas para testes locais)...")
-    app.run(host="0.0.0.0", port=3979, debug=True)
\ No newline at end of file
+    LOGGER.info("Iniciando servidor de desenvolvimento Flask (apenas para testes locais)...")
+    app.run(host="0.0.0.0", port=CONFIG.PORT, debug=True)
@@ -0,0 +1,339 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from botbuilder.schema import Activity
+from botframework.connector.auth import (
+    AuthenticationConfiguration, AuthenticationConstants, ChannelValidation, ClaimsIdentity,
+    CredentialProvider, EndorsementsValidator, JwtTokenValidation, SimpleCredentialProvider,
+)
+
+from log_utils import get_logger
+from metrics import AUTH_TOKEN_CACHE
+
+LOGGER = get_logger("auth")
+
+# Tokens do Bot Connector têm ~1 KB; acima disso nem vale decodificar
+_MAX_TOKEN_LENGTH = 8192
+
+
+class SigningKeyCache:
+    """
+    Chaves de assinatura do Bot Connector (metadados OpenID -> JWKS), já convertidas em chaves
+    públicas RSA uma única vez por atualização. A atualização roda em segundo plano a cada
+    `refresh_seconds`; um `kid` desconhecido força uma atualização (no máximo uma a cada
+    `missing_key_refresh_seconds`). Várias requisições esperando a mesma atualização geram uma só busca.
+    Se a busca falhar, as chaves anteriores continuam valendo.
+    """
+
+    def __init__(self, metadata_url: str, refresh_seconds: float = 6 * 3600,
+                 missing_key_refresh_seconds: float = 300, timeout_seconds: float = 10):
+        self.metadata_url = metadata_url
+        self.refresh_seconds = refresh_seconds
+        self.missing_key_refresh_seconds = missing_key_refresh_seconds
+        self.timeout_seconds = timeout_seconds
+        self._keys: Dict[str, Tuple[object, Tuple[str, ...]]] = {}  # kid -> (chave pública, endorsements)
+        self._loaded_at = float("-inf")
+        self._refreshing: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self.version = 0  # Muda quando o conjunto de kids muda (invalida os tokens memorizados)
+        self.fetches = 0
+
+    async def load(self):
+        """Primeira carga: inicia a atualização periódica e busca as chaves se ainda não houver nenhuma."""
+        self._ensure_refresher()
+        if not self._keys:
+            await self.refresh()
+
+    async def get(self, key_id: str) -> Optional[Tuple[object, Tuple[str, ...]]]:
+        await self.load()
+        key = self._keys.get(key_id)
+        if key is None and time.monotonic() - self._loaded_at > self.missing_key_refresh_seconds:
+            await self.refresh()
+            key = self._keys.get(key_id)
+        return key
+
+    async def refresh(self):
+        if self._refreshing is not None:
+            return await asyncio.shield(self._refreshing)
+        self._refreshing = asyncio.get_running_loop().create_future()
+        try:
+            await self._fetch()
+            self._refreshing.set_result(None)
+        except BaseException as e:
+            self._refreshing.set_exception(e)
+            self._refreshing.exception()  # Marca como lida se ninguém mais estiver aguardando
+            raise
+        finally:
+            self._refreshing = None
+
+    async def _fetch(self):
+        self.fetches += 1
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)) as session:
+            async with session.get(self.metadata_url) as response:
+                response.raise_for_status()
+                jwks_uri = (await response.json(content_type=None))["jwks_uri"]
+            async with session.get(jwks_uri) as response:
+                response.raise_for_status()
+                jwks = (await response.json(content_type=None))["keys"]
+
+        keys = {}
+        for jwk in jwks:
+            if jwk.get("kty") == "RSA" and jwk.get("kid"):
+                keys[jwk["kid"]] = (RSAAlgorithm.from_jwk(jwk), tuple(jwk.get("endorsements", ())))
+        if keys.keys() != self._keys.keys():
+            self.version += 1
+        self._keys = keys
+        self._loaded_at = time.monotonic()
+        LOGGER.info("Chaves de assinatura do Bot Connector atualizadas (%d chaves).", len(keys))
+
+    def _ensure_refresher(self):
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_forever())
+
+    async def _refresh_forever(self):
+        delay = self.refresh_seconds
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh()
+                delay = self.refresh_seconds
+            except Exception as e:
+                # Mantém as chaves atuais e tenta de novo mais cedo
+                LOGGER.warning("Falha ao atualizar as chaves de assinatura: %s", e)
+                delay = min(self.refresh_seconds, 60)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class ChannelTokenValidator:
+    """
+    Validação dos tokens que o Bot Connector envia no header Authorization, com as mesmas regras
+    do ChannelValidation do SDK (emissor, assinatura RS256, expiração com 5 min de tolerância,
+    endorsements do canal, aud = App ID, claim serviceurl), mas:
+
+    - headers malformados são recusados antes de qualquer decodificação ou criptografia;
+    - as chaves vêm do SigningKeyCache, sem requisição bloqueante no loop de eventos;
+    - um token já validado para o mesmo canal e serviceUrl é aceito direto até o seu `exp`.
+
+    authenticate() retorna None para o que não é token do Bot Connector (sem header, Emulator,
+    skills): o adaptador segue então pelo caminho do SDK.
+    """
+
+    def __init__(self, credentials: CredentialProvider, keys: SigningKeyCache,
+                 auth_configuration: AuthenticationConfiguration = None, max_tokens: int = 10000,
+                 clock_tolerance: int = 5 * 60):
+        self.credentials = credentials
+        self.keys = keys
+        self.auth_configuration = auth_configuration or AuthenticationConfiguration()
+        self.max_tokens = max_tokens
+        self.clock_tolerance = clock_tolerance
+        # (token, channel_id, service_url) -> (claims, exp, versão das chaves); em ordem LRU
+        self._validated: "OrderedDict[Tuple[str, str, str], Tuple[Dict, float, int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def authenticate(self, activity: Activity, auth_header: str) -> Optional[ClaimsIdentity]:
+        if not auth_header:
+            return None
+        scheme, _, token = auth_header.partition(" ")
+        if scheme != "Bearer" or not token or len(token) > _MAX_TOKEN_LENGTH or token.count(".") != 2:
+            raise PermissionError("Unauthorized. Malformed Authorization header.")
+
+        cache_key = (token, activity.channel_id, activity.service_url)
+        cached = self._validated.get(cache_key)
+        if cached is not None:
+            claims, expires_at, keys_version = cached
+            # Chaves trocadas desde a validação: o token é validado de novo com as atuais
+            if expires_at > time.time() and keys_version == self.keys.version:
+                self._validated.move_to_end(cache_key)
+                self.hits += 1
+                AUTH_TOKEN_CACHE.inc("hit")
+                return ClaimsIdentity(claims, True)
+            del self._validated[cache_key]
+
+        try:
+            header = jwt.get_unverified_header(token)
+            unverified = jwt.decode(token, options={"verify_signature": False})
+        except jwt.InvalidTokenError as e:
+            raise PermissionError(f"Unauthorized. Malformed token: {e}") from e
+        if unverified.get(AuthenticationConstants.ISSUER_CLAIM) != AuthenticationConstants.TO_BOT_FROM_CHANNEL_TOKEN_ISSUER:
+            return None
+
+        self.misses += 1
+        AUTH_TOKEN_CACHE.inc("miss")
+        claims = await self._validate(token, header, activity.channel_id)
+        identity = await ChannelValidation.validate_identity(ClaimsIdentity(claims, True), self.credentials)
+        if identity.get_claim_value(ChannelValidation.SERVICE_URL_CLAIM) != activity.service_url:
+            raise PermissionError("Unauthorized. service_url claim do not match.")
+        await JwtTokenValidation.validate_claims(self.auth_configuration, claims)
+
+        self._validated[cache_key] = (claims, float(claims["exp"]), self.keys.version)
+        while len(self._validated) > self.max_tokens:
+            self._validated.popitem(last=False)
+        return identity
+
+    async def _validate(self, token: str, header: Dict, channel_id: str) -> Dict:
+        if header.get("alg") not in AuthenticationConstants.ALLOWED_SIGNING_ALGORITHMS:
+            raise PermissionError("Unauthorized. Token signing algorithm not in allowed list.")
+        key = await self.keys.get(header.get("kid"))
+        if key is None:
+            raise PermissionError("Unauthorized. Signing key not found.")
+        public_key, endorsements = key
+        if endorsements:
+            required: List[str] = [channel_id, *(self.auth_configuration.required_endorsements or [])]
+            if not all(EndorsementsValidator.validate(item, endorsements) for item in required):
+                raise PermissionError("Unauthorized. Could not validate endorsement key.")
+        try:
+            return jwt.decode(token, public_key, algorithms=["RS256"], leeway=self.clock_tolerance,
+                              options={"verify_aud": False, "require": ["exp"]})
+        except jwt.InvalidTokenError as e:
+            raise PermissionError(f"Unauthorized. {e}") from e
+
+    async def warmup(self):
+        """Busca as chaves de assinatura antes da primeira requisição (ver startup.py)."""
+        if not await self.credentials.is_authentication_disabled():
+            await self.keys.load()
+
+    async def close(self):
+        await self.keys.close()
+
+
+def create_channel_authenticator(config) -> Optional[ChannelTokenValidator]:
+    """Validador com cache conforme o DefaultConfig (None se AUTH_CACHE_ENABLED estiver desligado)."""
+    if not config.AUTH_CACHE_ENABLED:
+        return None
+    keys = SigningKeyCache(config.AUTH_OPENID_METADATA_URL, config.AUTH_KEYS_REFRESH_SECONDS)
+    return ChannelTokenValidator(SimpleCredentialProvider(config.APP_ID, config.APP_PASSWORD), keys,
+                                 max_tokens=config.AUTH_CACHE_MAX_TOKENS)
+
+
+# Verificação contra metadados OpenID e JWKS falsos, locais (rodando em outra thread, como o serviço
+# real estaria), e benchmark de validações por segundo: SDK (ChannelValidation) versus este módulo
+# sem a memória de tokens e com ela. Uso: python auth_cache.py [validacoes]
+if __name__ == "__main__":
+    import sys
+    import threading
+
+    from aiohttp import web
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    validations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app_id, service_url = "00000000-0000-0000-0000-000000000001", "https://smba.trafficmanager.net/br/"
+    private_keys = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048) for kid in ("k1", "k2", "intruso")}
+    published = {"kids": ["k1"], "jwks_requests": 0}
+
+    def _jwk(kid):
+        jwk = RSAAlgorithm.to_jwk(private_keys[kid].public_key(), as_dict=True)
+        return {**jwk, "kid": kid, "use": "sig", "endorsements": ["msteams", "webchat"]}
+
+    def _start_stand_in() -> str:
+        ready, holder = threading.Event(), {}
+
+        async def metadata(request):
+            return web.json_response({"issuer": AuthenticationConstants.TO_BOT_FROM_CHANNEL_TOKEN_ISSUER,
+                                      "jwks_uri": f"{holder['url']}/keys"})
+
+        async def keys(request):
+            published["jwks_requests"] += 1
+            return web.json_response({"keys": [_jwk(kid) for kid in published["kids"]]})
+
+        async def serve():
+            app = web.Application()
+            app.router.add_get("/.well-known/openidconfiguration", metadata)
+            app.router.add_get("/keys", keys)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            holder["url"] = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"  # pylint: disable=protected-access
+            ready.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+        ready.wait()
+        return holder["url"] + "/.well-known/openidconfiguration"
+
+    def _token(kid="k1", signer=None, **claims) -> str:
+        payload = {"iss": AuthenticationConstants.TO_BOT_FROM_CHANNEL_TOKEN_ISSUER, "aud": app_id,
+                   "serviceurl": service_url, "nbf": int(time.time()) - 10, "exp": int(time.time()) + 3600, **claims}
+        return "Bearer " + jwt.encode(payload, private_keys[signer or kid], algorithm="RS256", headers={"kid": kid})
+
+    def _activity(channel_id="msteams", url=service_url) -> Activity:
+        return Activity(type="message", channel_id=channel_id, service_url=url)
+
+    async def _expect_denied(validator, activity, header, reason):
+        try:
+            await validator.authenticate(activity, header)
+        except PermissionError:
+            return
+        raise AssertionError(f"Deveria recusar: {reason}")
+
+    async def _rate(authenticate, header) -> float:
+        activity = _activity()
+        start = time.perf_counter()
+        for _ in range(validations):
+            await authenticate(activity, header)
+        return validations / (time.perf_counter() - start)
+
+    async def _main():
+        metadata_url = _start_stand_in()
+        credentials = SimpleCredentialProvider(app_id, "senha")
+        validator = ChannelTokenValidator(credentials, SigningKeyCache(metadata_url))
+        header = _token()
+
+        identity = await validator.authenticate(_activity(), header)
+        assert identity.get_claim_value("aud") == app_id
+        await validator.authenticate(_activity(), header)
+        assert validator.hits == 1 and validator.misses == 1
+
+        fetches = validator.keys.fetches
+        for malformed in ("Bearer abc", "Basic dXNlcjpzZW5oYQ==", "Bearer " + "a." * 5000, "Bearer a.b.c"):
+            await _expect_denied(validator, _activity(), malformed, malformed[:20])
+        assert validator.keys.fetches == fetches, "Header malformado não deveria buscar chaves"
+
+        await _expect_denied(validator, _activity(url="https://outro.example/"), header, "serviceUrl diferente (mesmo token em cache)")
+        await _expect_denied(validator, _activity(channel_id="slack"), _token(), "canal sem endorsement")
+        await _expect_denied(validator, _activity(), _token(exp=int(time.time()) - 600), "token expirado")
+        await _expect_denied(validator, _activity(), _token(signer="intruso"), "assinatura de outra chave")
+        await _expect_denied(validator, _activity(), _token(aud="outro-bot"), "aud de outro bot")
+        assert await validator.authenticate(_activity(), _token(iss="https://sts.windows.net/x/")) is None
+
+        # Rotação: kid novo força a atualização; tokens memorizados com as chaves antigas deixam de valer
+        published["kids"] = ["k1", "k2"]
+        validator.keys.missing_key_refresh_seconds = 0
+        assert (await validator.authenticate(_activity(), _token(kid="k2"))).get_claim_value("aud") == app_id
+        hits = validator.hits
+        await validator.authenticate(_activity(), header)
+        assert validator.hits == hits, "Token validado com as chaves antigas não deveria vir da memória"
+        print("Validações verificadas (malformado, serviceUrl, endorsement, expiração, assinatura, aud, rotação).")
+
+        # Benchmark
+        ChannelValidation.open_id_metadata_endpoint = metadata_url
+
+        async def sdk(activity, auth_header):
+            return await JwtTokenValidation.authenticate_request(activity, auth_header, credentials)
+
+        uncached = ChannelTokenValidator(credentials, SigningKeyCache(metadata_url), max_tokens=0)
+        cached = ChannelTokenValidator(credentials, SigningKeyCache(metadata_url))
+        results = [
+            ("SDK (ChannelValidation)", await _rate(sdk, header)),
+            ("chaves em cache, sem memória", await _rate(uncached.authenticate, header)),
+            ("chaves em cache + memória", await _rate(cached.authenticate, header)),
+            ("header malformado", await _rate(lambda a, h: _expect_denied(cached, a, h, ""), "Bearer abc")),
+        ]
+        print(f"{validations} validações do mesmo token do Bot Connector")
+        print(f"{'validação':<30} {'validações/s':>13}")
+        for name, rate in results:
+            print(f"{name:<30} {rate:>13.0f}")
+        for validator_ in (validator, uncached, cached):
+            await validator_.close()
+
+    asyncio.run(_main())
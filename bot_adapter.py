@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Callable, List
+
+from botbuilder.core import BotAdapter, BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
+from botbuilder.schema import Activity, ActivityTypes, ResourceResponse
+from botframework.connector.auth import ClaimsIdentity, SkillValidation
+
+from auth_cache import ChannelTokenValidator, create_channel_authenticator
+from connector_client import OutboundConnector, create_outbound_connector
+
+from log_utils import get_logger, log_event
+from metrics import AUTH_DURATION, SEND_DURATION
+from tracing import SPAN_KIND_SERVER, span
+
+LOGGER = get_logger("adapter")
+
+# === CLASSE ADAPTER CUSTOMIZADA (compartilhada por app.py e app_flask.py) ===
+class CustomBotFrameworkAdapter(BotFrameworkAdapter):
+    def __init__(self, settings: BotFrameworkAdapterSettings, outbound: OutboundConnector = None,
+                 authenticator: ChannelTokenValidator = None):
+        super().__init__(settings)
+        # Envio das respostas por sessão HTTP reaproveitada e token em cache (None = cliente do SDK)
+        self.outbound = outbound
+        # Validação dos tokens do Bot Connector com chaves e resultados em cache (None = SDK a cada requisição)
+        self.authenticator = authenticator
+        # O RENDER_HOSTNAME é inicializado dentro do construtor
+        # onde 'os' está no escopo correto. Sem a variável, o serviceUrl nunca é reescrito.
+        render_hostname = os.environ.get("RENDER_EXTERNAL_HOSTNAME") or ""
+        self._prod_service_url = "https://" + render_hostname if render_hostname else ""
+        if not render_hostname:
+             LOGGER.warning("Variável de ambiente RENDER_EXTERNAL_HOSTNAME não encontrada. Pode afetar respostas em produção.")
+        LOGGER.info("_prod_service_url inicializado como: %s", self._prod_service_url)
+
+    async def process_activity(self, req, auth_header: str, logic: Callable, admit: Callable = None):
+        # Raiz do trace do turno síncrono: autenticação + turno (ver tracing.py)
+        with span("adapter.process_activity", SPAN_KIND_SERVER, activity_type=req.type, channel_id=req.channel_id):
+            if admit is None:
+                return await super().process_activity(req, auth_header, logic)
+            # Limites de uso (ver rate_limit.py): só depois da autenticação, e podem trocar a lógica do turno
+            identity = await self._authenticate_request(req, auth_header or "")
+            return await self.process_activity_with_identity(req, identity, admit(req, logic))
+
+    async def process_activity_with_identity(self, activity: Activity, identity: ClaimsIdentity, logic: Callable):
+        # Com a fila de turnos (202), este é o início do trace: a autenticação ficou na requisição
+        with span("adapter.turn", activity_type=activity.type, channel_id=activity.channel_id):
+            return await super().process_activity_with_identity(activity, identity, logic)
+
+    async def get_service_url(self, turn_context: TurnContext) -> str:
+        service_url = turn_context.activity.service_url
+
+        if self._prod_service_url and (not service_url or "localhost" in service_url):
+            log_event(LOGGER, logging.DEBUG, "service_url_rewritten", original=service_url, service_url=self._prod_service_url)
+            return self._prod_service_url
+
+        log_event(LOGGER, logging.DEBUG, "service_url", service_url=service_url)
+        return service_url
+
+    async def send_activities(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("adapter.send_activities", count=len(activities)):
+                if self._use_outbound(context):
+                    responses = await self._send_with_outbound(context, activities)
+                else:
+                    responses = await super().send_activities(context, activities)
+            outcome = "ok"
+            return responses
+        finally:
+            SEND_DURATION.observe(time.perf_counter() - started, outcome)
+
+    def _use_outbound(self, context: TurnContext) -> bool:
+        if self.outbound is None:
+            return False
+        # Respostas a skills usam outro escopo de token: ficam com o cliente do SDK
+        identity = context.turn_state.get(BotAdapter.BOT_IDENTITY_KEY)
+        return not (identity and SkillValidation.is_skill_claim(identity.claims))
+
+    async def _send_with_outbound(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        """Mesmas regras do BotFrameworkAdapter.send_activities, com o envio feito pelo OutboundConnector."""
+        # Como no SDK: a resposta vai para o serviceUrl da atividade recebida (Emulator e localhost incluídos)
+        service_url = context.activity.service_url
+        responses = []
+        for activity in activities:
+            response = None
+            if activity.type == "delay":
+                await asyncio.sleep(float(activity.value) / 1000)
+            elif activity.type == ActivityTypes.invoke_response:
+                context.turn_state[self._INVOKE_RESPONSE_KEY] = activity
+            elif activity.type == ActivityTypes.trace and activity.channel_id != "emulator":
+                pass
+            else:
+                if not activity.conversation or not activity.conversation.id:
+                    raise TypeError("CustomBotFrameworkAdapter.send_activities(): conversation.id can not be None.")
+                response = await self.outbound.send(service_url, activity)
+            responses.append(response or ResourceResponse(id=activity.id or ""))
+        return responses
+
+    async def _authenticate_request(self, request: Activity, auth_header: str) -> ClaimsIdentity:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("adapter.authenticate"):
+                identity = None
+                if self.authenticator is not None:
+                    identity = await self.authenticator.authenticate(request, auth_header)
+                if identity is None:  # Sem header, Emulator ou skill: validação do SDK
+                    identity = await super()._authenticate_request(request, auth_header)
+            outcome = "ok"
+            return identity
+        except PermissionError:
+            outcome = "denied"
+            raise
+        finally:
+            AUTH_DURATION.observe(time.perf_counter() - started, outcome)
+
+
+# --------------------------------------------------
+# TRATAMENTO DE ERROS GLOBAL
+# --------------------------------------------------
+async def on_error(context: TurnContext, error: Exception):
+    """Captura exceções não tratadas durante a execução do bot."""
+
+    # Log estruturado com o stack trace completo
+    LOGGER.error("on_turn_error: %s", error, exc_info=error, extra={"fields": {
+        "conversation_id": context.activity.conversation.id if context.activity.conversation else None,
+        "activity_type": context.activity.type,
+    }})
+
+    # Notifica o usuário
+    await context.send_activity("Desculpe, algo deu errado no Tralhobot.")
+
+    # Se no Emulator, envia detalhes técnicos
+    if context.activity.channel_id == "emulator":
+        trace_activity = Activity(
+            label="ErroDetalhado",
+            name="on_turn_error Trace",
+            timestamp=datetime.utcnow(),
+            type=ActivityTypes.trace,
+            value=f"{error}",
+            value_type="https://www.botframework.com/schemas/error",
+        )
+        await context.send_activity(trace_activity)
+
+
+def create_adapter(config, outbound: OutboundConnector = None,
+                   authenticator: ChannelTokenValidator = None) -> CustomBotFrameworkAdapter:
+    """
+    Cria o adaptador customizado com as credenciais do DefaultConfig e o handler de erros.
+    `outbound` e `authenticator` já criados (e aquecendo, ver startup.py) são usados no lugar de novos.
+    """
+    settings = BotFrameworkAdapterSettings(config.APP_ID, config.APP_PASSWORD)
+    if outbound is None:
+        outbound = create_outbound_connector(config)
+    if authenticator is None:
+        authenticator = create_channel_authenticator(config)
+    adapter = CustomBotFrameworkAdapter(settings, outbound, authenticator)
+    adapter.on_turn_error = on_error
+    return adapter
@@ -0,0 +1,157 @@
+import string
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from botbuilder.core import CardFactory
+from botbuilder.schema import (
+    ActionTypes, Activity, ActivityTypes, Attachment, CardAction, HeroCard, InputHints
+)
+
+# Um validador recebe o texto do usuário e retorna None/False (não casou), True (casou)
+# ou um dicionário com variáveis extras para o template da resposta.
+Validator = Callable[[str], Any]
+
+
+class ReplyTemplate:
+    """
+    Resposta pré-montada na compilação do fluxo. Textos sem variáveis e cartões são montados
+    uma única vez; build() só cria a Activity (que o adaptador altera ao enviar, então não é reutilizada).
+    """
+
+    __slots__ = ("text", "fields", "attachments")
+
+    def __init__(self, text: str, attachments: Tuple[Attachment, ...] = ()):
+        self.text = text
+        self.fields = tuple(name for _, name, _, _ in string.Formatter().parse(text) if name)
+        self.attachments = attachments
+
+    def render_text(self, variables: Mapping[str, Any]) -> str:
+        return self.text.format_map(variables) if self.fields else self.text
+
+    def build(self, variables: Mapping[str, Any]) -> Activity:
+        if self.attachments:
+            return Activity(type=ActivityTypes.message, attachments=list(self.attachments),
+                            input_hint=InputHints.accepting_input)
+        return Activity(type=ActivityTypes.message, text=self.render_text(variables),
+                        input_hint=InputHints.accepting_input)
+
+
+def yes_no_card(text: str, yes_value: str, no_value: str) -> Attachment:
+    return CardFactory.hero_card(HeroCard(
+        text=text,
+        buttons=[
+            CardAction(title="Sim", type=ActionTypes.im_back, value=yes_value),
+            CardAction(title="Não", type=ActionTypes.im_back, value=no_value),
+        ],
+    ))
+
+
+class Branch(NamedTuple):
+    when: Optional[Validator]       # None = sempre casa (ramo padrão)
+    save: Optional[str]             # Campo do estado que recebe o texto do usuário
+    assign: Tuple[Tuple[str, Any], ...]
+    reply: ReplyTemplate
+    next_state: str
+    lead: Optional[str] = None      # Resultado do lead emitido ao passar por este ramo (ver lead_sink.py)
+
+
+class Step(NamedTuple):
+    reply: Activity
+    from_state: str
+    to_state: str
+    lead: Optional[str] = None
+
+
+class CompiledFlow:
+    """
+    Fluxo compilado: tabela estado -> ramos. step() é uma consulta de dicionário mais a
+    avaliação dos validadores daquele estado, sem percorrer os demais estados.
+    """
+
+    def __init__(self, name: str, states: Dict[str, Tuple[Branch, ...]], final_state: str):
+        self.name = name
+        self.states = states
+        self.final_state = final_state
+
+    def __contains__(self, state_name: str) -> bool:
+        return state_name in self.states
+
+    def step(self, state, text: str, **variables) -> Optional[Step]:
+        """
+        Aplica o texto do usuário ao registro de estado do fluxo (ver bots/state_records.py), alterando-o no lugar.
+        Retorna None se o estado não pertencer ao fluxo (o bot segue para o reconhecimento de intenção).
+        """
+        current = state.state
+        branches = self.states.get(current)
+        if branches is None:
+            return None
+        text = text or ""
+        for branch in branches:
+            extra = True if branch.when is None else branch.when(text)
+            if not extra:
+                continue
+            if branch.save:
+                setattr(state, branch.save, text)
+            for field, value in branch.assign:
+                setattr(state, field, value)
+            state.state = branch.next_state
+            if branch.reply.fields:
+                variables = {**{name: getattr(state, name) for name in state.__slots__}, **variables, "text": text}
+                if isinstance(extra, dict):
+                    variables.update(extra)
+            return Step(branch.reply.build(variables), current, branch.next_state, branch.lead)
+        return None
+
+
+def _compile_reply(reply) -> ReplyTemplate:
+    if isinstance(reply, str):
+        return ReplyTemplate(reply)
+    card = reply["card"]
+    return ReplyTemplate(card["text"], (yes_no_card(card["text"], card["yes"], card["no"]),))
+
+
+def compile_flow(definition: Mapping, validators: Mapping[str, Validator], record_type=None) -> CompiledFlow:
+    """
+    Compila a definição declarativa de um fluxo:
+
+        {"name": "sdr", "final_state": "none", "states": {
+            "awaiting_company": {"save": "company", "reply": "...", "next": "awaiting_needs"},
+            "awaiting_size": {"save": "size", "branches": [
+                {"when": "qualified_size", "set": {"qualified": True}, "reply": {"card": {...}}, "next": "..."},
+                {"set": {"qualified": False}, "reply": "...", "next": "..."}]}}}
+
+    Estados sem "branches" têm um único ramo. Validadores são referenciados pelo nome.
+    "lead": "<resultado>" (no estado ou no ramo) faz o passo pedir a emissão de um lead.
+    Com `record_type`, os campos de "save" e "set" precisam existir no registro de estado.
+    Erros na definição (validador inexistente, destino desconhecido, sem ramo padrão, campo
+    inexistente) falham aqui, na inicialização, e não no meio de uma conversa.
+    """
+    name = definition["name"]
+    final_state = definition.get("final_state", "none")
+    states: Dict[str, Tuple[Branch, ...]] = {}
+    for state_name, spec in definition["states"].items():
+        branches: List[Branch] = []
+        for branch_spec in spec.get("branches", [spec]):
+            when = branch_spec.get("when")
+            if when is not None and when not in validators:
+                raise ValueError(f"Fluxo '{name}', estado '{state_name}': validador desconhecido '{when}'.")
+            branches.append(Branch(
+                validators[when] if when else None,
+                branch_spec.get("save", spec.get("save")),
+                tuple(branch_spec.get("set", {}).items()),
+                _compile_reply(branch_spec["reply"]),
+                branch_spec["next"],
+                branch_spec.get("lead", spec.get("lead")),
+            ))
+        if branches[-1].when is not None:
+            raise ValueError(f"Fluxo '{name}', estado '{state_name}': o último ramo precisa ser o padrão (sem 'when').")
+        states[state_name] = tuple(branches)
+
+    known_fields = set(record_type.__slots__) if record_type is not None else None
+    for state_name, branches in states.items():
+        for branch in branches:
+            for field in ([branch.save] if branch.save else []) + [field for field, _ in branch.assign]:
+                if known_fields is not None and field not in known_fields:
+                    raise ValueError(f"Fluxo '{name}', estado '{state_name}': campo desconhecido '{field}'.")
+            if branch.next_state != final_state and branch.next_state not in states:
+                raise ValueError(f"Fluxo '{name}', estado '{state_name}': destino desconhecido '{branch.next_state}'.")
+    return CompiledFlow(name, states, final_state)
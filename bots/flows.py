@@ -0,0 +1,149 @@
+"""
+Definição dos fluxos de suporte e SDR do Tralhobot, compilados uma única vez na importação.
+Para mudar o funil, edite os dicionários abaixo: cada estado diz onde o texto do usuário é
+guardado, qual resposta enviar e para qual estado ir.
+
+Verificação de todas as transições e benchmark do despacho: python -m bots.flows
+"""
+from keyword_matcher import KeywordMatcher
+
+from bots.flow_engine import compile_flow, yes_no_card
+from bots.state_records import SDRState, SupportState
+
+SUPPORT_SUGGESTIONS = {
+    "acesso": "Verifique se está usando as credenciais corretas ou tente redefinir sua senha: [link]",
+    "não consigo": "Poderia detalhar um pouco mais o que você não está conseguindo fazer? Qual sistema ou funcionalidade?",
+    "problema": "Para problemas gerais, reiniciar o aplicativo ou o computador pode ajudar. Se persistir, por favor, me dê mais detalhes."
+}
+
+SUPPORT_MATCHER = KeywordMatcher(SUPPORT_SUGGESTIONS)
+
+
+def _support_suggestion(text: str):
+    match = SUPPORT_MATCHER.first(text)
+    return {"suggestion": match.value} if match else None
+
+
+VALIDATORS = {
+    "support_suggestion": _support_suggestion,
+    "said_yes": lambda text: "sim" in text.lower(),
+    "qualified_size": lambda text: any(term in text.lower() for term in ("10", "50", "grande")),
+    "schedule_meeting_yes": lambda text: text.lower() == "schedule_meeting_yes",
+    "send_materials_yes": lambda text: text.lower() == "send_materials_yes",
+}
+
+SUPPORT_FLOW_DEFINITION = {
+    "name": "support",
+    "final_state": "none",
+    "states": {
+        "awaiting_problem_description": {"branches": [
+            {"when": "support_suggestion", "reply": "Sugestão: {suggestion} Isso resolveu? (Sim/Não)",
+             "next": "awaiting_resolution_confirmation"},
+            {"reply": "Ainda precisa de ajuda? (Sim/Não)", "next": "awaiting_resolution_confirmation"},
+        ]},
+        "awaiting_resolution_confirmation": {"branches": [
+            {"when": "said_yes", "reply": "Ótimo! Posso ajudar em algo mais?", "next": "none"},
+            {"reply": "Por favor, informe seu nome, e-mail e empresa para escalarmos.", "next": "awaiting_escalation_details"},
+        ]},
+        "awaiting_escalation_details": {
+            "reply": "Seu ticket foi criado (TRALHO-{activity_id:.5}). Nossa equipe entrará em contato."
+                     "Detalhes: {text}. Posso ajudar em algo mais agora?",
+            "next": "none",
+        },
+    },
+}
+
+SDR_FLOW_DEFINITION = {
+    "name": "sdr",
+    "final_state": "none",
+    "states": {
+        "awaiting_name_role": {"save": "name", "reply": "Obrigado, {name}. Qual o nome da sua empresa?", "next": "awaiting_company"},
+        "awaiting_company": {"save": "company", "reply": "Quais são seus principais desafios atuais?", "next": "awaiting_needs"},
+        "awaiting_needs": {"save": "needs", "reply": "Qual o tamanho da sua empresa? (Ex: até 10, 11-50, 50+)", "next": "awaiting_size"},
+        "awaiting_size": {"save": "size", "branches": [
+            {"when": "qualified_size", "set": {"qualified": True}, "next": "proposing_meeting", "reply": {"card": {
+                "text": "Com base no que conversamos, acredito que nossas soluções podem realmente agregar valor à sua empresa. "
+                        "Gostaria de agendar uma conversa com um de nossos especialistas? Ele(a) poderá apresentar demonstrações personalizadas e discutir como podemos atender às suas necessidades específicas.",
+                "yes": "schedule_meeting_yes", "no": "schedule_meeting_no"}}},
+            {"set": {"qualified": False}, "next": "handling_unqualified", "reply": {"card": {
+                "text": "Obrigado pelas informações. No momento, parece que nossas soluções podem não ser o encaixe ideal para as suas necessidades atuais / perfil da sua empresa. "
+                        "Gostaria de receber alguns materiais informativos sobre [Tópico Relevante] por e-mail para referência futura? (Sim/Não)",
+                "yes": "send_materials_yes", "no": "send_materials_no"}}},
+        ]},
+        "proposing_meeting": {"branches": [
+            {"when": "schedule_meeting_yes", "reply": "Excelente! Para qual e-mail posso enviar o convite da reunião?",
+             "next": "awaiting_email_for_schedule"},
+            {"reply": "Entendido. Se mudar de ideia ou precisar de algo mais, é só chamar!", "next": "none"},
+        ]},
+        "awaiting_email_for_schedule": {
+            "save": "email",
+            "lead": "meeting",
+            "reply": "Perfeito! Agendamento confirmado. O convite foi enviado para {email}. Há mais algo em que posso ajudar agora?",
+            "next": "none",
+        },
+        "handling_unqualified": {"branches": [
+            {"when": "send_materials_yes", "reply": "Ótimo! Para qual e-mail posso enviar os materiais?",
+             "next": "awaiting_email_for_materials"},
+            {"reply": "Entendido. Agradeço seu tempo e interesse na Tralhotec. Tenha um ótimo dia!", "next": "none"},
+        ]},
+        "awaiting_email_for_materials": {
+            "save": "email",
+            "lead": "materials",
+            "reply": "Materiais enviados para {email}. Agradeço seu tempo e interesse na Tralhotec. Tenha um ótimo dia!",
+            "next": "none",
+        },
+    },
+}
+
+SUPPORT_FLOW = compile_flow(SUPPORT_FLOW_DEFINITION, VALIDATORS, SupportState)
+SDR_FLOW = compile_flow(SDR_FLOW_DEFINITION, VALIDATORS, SDRState)
+
+
+if __name__ == "__main__":
+    import timeit
+
+    # Roteiros que passam por todos os ramos: (fluxo, estado inicial, [(texto, estado esperado)])
+    scripts = [
+        (SUPPORT_FLOW, "awaiting_problem_description", [
+            ("Não consigo acessar", "awaiting_resolution_confirmation"), ("sim, resolveu", "none")]),
+        (SUPPORT_FLOW, "awaiting_problem_description", [
+            ("o sistema está lento", "awaiting_resolution_confirmation"), ("Não", "awaiting_escalation_details"),
+            ("Ana, ana@acme.com, Acme", "none")]),
+        (SDR_FLOW, "awaiting_name_role", [
+            ("Ana, diretora", "awaiting_company"), ("Acme", "awaiting_needs"), ("Contratos", "awaiting_size"),
+            ("11-50", "proposing_meeting"), ("schedule_meeting_yes", "awaiting_email_for_schedule"),
+            ("ana@acme.com", "none")]),
+        (SDR_FLOW, "proposing_meeting", [("schedule_meeting_no", "none")]),
+        (SDR_FLOW, "awaiting_size", [("só eu", "handling_unqualified"), ("send_materials_yes", "awaiting_email_for_materials"),
+                                     ("ana@acme.com", "none")]),
+        (SDR_FLOW, "handling_unqualified", [("send_materials_no", "none")]),
+    ]
+    covered = set()
+    for flow, initial, steps in scripts:
+        state = (SupportState if flow is SUPPORT_FLOW else SDRState)(initial)
+        for text, expected in steps:
+            step = flow.step(state, text, activity_id="abcdef123")
+            assert step is not None and step.to_state == expected, (flow.name, step, expected)
+            assert step.reply.text or step.reply.attachments
+            covered.add((flow.name, step.from_state, step.to_state))
+            # Só a captura do e-mail no funil SDR gera lead
+            expected_lead = {"awaiting_email_for_schedule": "meeting", "awaiting_email_for_materials": "materials"}.get(step.from_state)
+            assert step.lead == expected_lead, (step.from_state, step.lead)
+    assert SDR_FLOW.step(SDRState(), "oi") is None
+    all_transitions = {
+        (flow.name, state_name, branch.next_state)
+        for flow in (SUPPORT_FLOW, SDR_FLOW) for state_name, branches in flow.states.items() for branch in branches
+    }
+    missing = all_transitions - covered
+    assert not missing, f"Transições sem cobertura: {missing}"
+    print(f"{len(covered)} transições verificadas.")
+
+    runs = 100000
+    text_state = timeit.timeit(lambda: SDR_FLOW.step(SDRState("awaiting_company"), "Acme"), number=runs) / runs * 1e6
+    formatted = timeit.timeit(lambda: SDR_FLOW.step(SDRState("awaiting_name_role"), "Ana"), number=runs) / runs * 1e6
+    card = timeit.timeit(lambda: SDR_FLOW.step(SDRState("awaiting_size"), "11-50"), number=runs) / runs * 1e6
+    card_rebuilt = timeit.timeit(
+        lambda: yes_no_card("texto", "schedule_meeting_yes", "schedule_meeting_no"), number=runs) / runs * 1e6
+    print(f"step() resposta fixa:        {text_state:5.2f} us")
+    print(f"step() resposta com {{nome}}:  {formatted:5.2f} us")
+    print(f"step() cartão pré-montado:   {card:5.2f} us (montar o cartão a cada turno custaria +{card_rebuilt:.2f} us)")
@@ -0,0 +1,169 @@
+"""
+Registros tipados do estado dos fluxos (SupportState e SDRState), guardados no ConversationState
+em um formato posicional e versionado: [versão, campo1, campo2, ...], sem os nomes dos campos e
+sem os None do final. A lista é JSON puro, então vale para todos os backends de state_storage.py.
+
+Para mudar um registro: acrescente campos sempre no fim, ou incremente VERSION e registre em
+MIGRATIONS a função que converte a lista da versão anterior (chave = versão de origem).
+
+Memória e bytes por gravação, antes e depois, com 100 mil conversas: python -m bots.state_records
+"""
+from dataclasses import dataclass, fields
+from typing import Callable, ClassVar, Dict, List, Optional
+
+from botbuilder.core import BotState, TurnContext
+
+from log_utils import get_logger
+
+LOGGER = get_logger("state")
+
+# Versão 0 = formato antigo: dicionário com os nomes dos campos ({"state": ..., "name": ...})
+LEGACY_VERSION = 0
+
+
+@dataclass(slots=True)
+class SupportState:
+    VERSION: ClassVar[int] = 1
+    MIGRATIONS: ClassVar[Dict[int, Callable[[List], List]]] = {}
+
+    state: str = "none"
+
+
+@dataclass(slots=True)
+class SDRState:
+    VERSION: ClassVar[int] = 1
+    MIGRATIONS: ClassVar[Dict[int, Callable[[List], List]]] = {}
+
+    state: str = "none"
+    name: Optional[str] = None
+    role: Optional[str] = None
+    company: Optional[str] = None
+    needs: Optional[str] = None
+    size: Optional[str] = None
+    qualified: Optional[bool] = None
+    email: Optional[str] = None
+
+
+def record_fields(record_type) -> tuple:
+    """Nomes dos campos na ordem do formato gravado."""
+    return tuple(field.name for field in fields(record_type))
+
+
+def encode(record) -> List:
+    values = [getattr(record, name) for name in record.__slots__]
+    while values and values[-1] is None:
+        values.pop()
+    return [record.VERSION, *values]
+
+
+def decode(record_type, value):
+    """
+    Converte o valor gravado em um registro, aplicando as migrações pendentes. Valores de uma
+    versão mais nova que a deste código (rollback de deploy) recomeçam o fluxo em vez de falhar o turno;
+    campos a mais na mesma versão (acrescentados no fim por um deploy mais novo) são descartados.
+    """
+    if value is None:
+        return record_type()
+    if isinstance(value, dict):
+        names = record_fields(record_type)
+        value = [LEGACY_VERSION, *(value.get(name) for name in names)]
+    version, values = value[0], list(value[1:])
+    if version > record_type.VERSION:
+        LOGGER.warning("%s gravado na versão %s, mais nova que a suportada (%s). Estado reiniciado.",
+                       record_type.__name__, version, record_type.VERSION)
+        return record_type()
+    while version < record_type.VERSION:
+        if version != LEGACY_VERSION:
+            values = record_type.MIGRATIONS[version](values)
+        version += 1
+    size = len(record_fields(record_type))
+    if len(values) > size:
+        # Gravado por um deploy que acrescentou campos (rollback): os campos extras são descartados
+        LOGGER.warning("%s gravado com %d campos, mais que os %d conhecidos. Descartados: %r",
+                       record_type.__name__, len(values), size, values[size:])
+        values = values[:size]
+    return record_type(*values)
+
+
+class RecordAccessor:
+    """
+    Acesso a um registro tipado guardado em uma propriedade do BotState.
+
+    get() decodifica uma vez por turno e guarda o registro no turn_state. set() só altera a
+    propriedade se o formato gravado mudou (dirty tracking): um registro lido e devolvido sem
+    mudanças não marca o BotState como alterado e, se nada mais mudou, o turno não grava no storage.
+    """
+
+    def __init__(self, bot_state: BotState, name: str, record_type):
+        self.name = name
+        self.record_type = record_type
+        self._property = bot_state.create_property(name)
+        self._cache_key = f"StateRecord.{name}"
+
+    async def get(self, turn_context: TurnContext):
+        cached = turn_context.turn_state.get(self._cache_key)
+        if cached is None:
+            stored = await self._property.get(turn_context)
+            cached = turn_context.turn_state[self._cache_key] = [decode(self.record_type, stored), stored]
+        return cached[0]
+
+    async def set(self, turn_context: TurnContext, record):
+        cached = turn_context.turn_state.get(self._cache_key)
+        if cached is None:
+            await self.get(turn_context)
+            cached = turn_context.turn_state[self._cache_key]
+        cached[0] = record
+        value = encode(record)
+        if value != cached[1]:
+            await self._property.set(turn_context, value)
+            cached[1] = value
+
+
+# Uso: python -m bots.state_records [conversas]
+if __name__ == "__main__":
+    import json
+    import sys
+    import tracemalloc
+    from copy import deepcopy
+
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    # Migração do formato antigo e de uma versão anterior fictícia, e ida e volta do formato
+    legacy = {"state": "awaiting_size", "name": "Ana", "role": None, "company": "Acme", "needs": "Contratos",
+              "size": None, "qualified": None, "email": None, "e_tag": "*"}
+    migrated = decode(SDRState, legacy)
+    assert migrated == SDRState("awaiting_size", "Ana", None, "Acme", "Contratos")
+    assert decode(SDRState, encode(migrated)) == migrated
+    assert encode(SDRState()) == [1, "none"]
+    assert decode(SupportState, [99, "x"]) == SupportState()
+    assert decode(SupportState, [1, "in_progress", "campo_novo"]) == SupportState("in_progress")
+
+    @dataclass(slots=True)
+    class _SDRStateV2(SDRState):
+        VERSION: ClassVar[int] = 2
+        MIGRATIONS: ClassVar[Dict[int, Callable[[List], List]]] = {1: lambda values: [values[0].upper(), *values[1:]]}
+
+    assert decode(_SDRStateV2, [1, "awaiting_company", "Ana"]).state == "AWAITING_COMPANY"
+    print("Migrações verificadas.")
+
+    # Estados de uma conversa no meio do funil SDR, como ficam no documento da conversa
+    sdr = SDRState("awaiting_size", "Ana Souza, diretora financeira", None, "Acme Ltda", "Gestão de contratos")
+    support = SupportState()
+    before = {"SupportState": {"state": support.state},
+              "SDRState": {name: getattr(sdr, name) for name in record_fields(SDRState)}}
+    after = {"SupportState": encode(support), "SDRState": encode(sdr)}
+
+    def measure(document) -> float:
+        # O MemoryStorage guarda uma cópia profunda de cada documento gravado
+        tracemalloc.start()
+        store = {f"msteams/conversations/{i}/": deepcopy(document) for i in range(conversations)}
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del store
+        return used / conversations
+
+    print(f"{conversations} conversas, estado de suporte e SDR (sem a transcrição)")
+    print(f"{'formato':<24} {'bytes/conversa em memória':>26} {'bytes/gravação (JSON)':>22}")
+    for name, document in (("dicionário (antes)", before), ("registro v1 (depois)", after)):
+        saved = len(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+        print(f"{name:<24} {measure(document):>26.0f} {saved:>22}")
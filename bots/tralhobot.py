@@ -1,48 +1,57 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import sys
-import traceback
+import asyncio
+import logging
+import time
 from datetime import datetime
 from typing import Any, Dict
 
 from botbuilder.core import (
     ActivityHandler, TurnContext, MessageFactory, UserState,
-    ConversationState, CardFactory
+    ConversationState
 )
-from botbuilder.schema import ChannelAccount, ActivityTypes, Attachment, ActionTypes, CardAction
+from botbuilder.schema import ChannelAccount, ActivityTypes
 
 from config import DefaultConfig
-
-# Importações do Azure AI Language
-from azure.ai.language.conversations import ConversationAnalysisClient
-from azure.core.credentials import AzureKeyCredential
-# REMOVIDAS AS IMPORTAÇÕES DE 'models' OU '_models' para evitar o ModuleNotFoundError anterior,
-# como você havia feito inicialmente. Vamos manter a abordagem de tratar a resposta como um dict.
-# Se o TypeError persistir, a investigação precisará ser mais profunda sobre a versão da biblioteca
-# e como ela se comporta sem os modelos importados.
+from clu_utils import AsyncCLUClient, CircuitOpenError, CLUBudgetExceeded, create_resilience, is_service_failure
+from state_storage import save_all_changes
+from keyword_matcher import KeywordMatcher
+from knowledge_base import KnowledgeBase
+from nlu_cache import NLUCache
+from intent_classifier import IntentClassifier
+from lead_sink import LeadSink, lead_from_state
+from bots.flows import SDR_FLOW, SUPPORT_FLOW
+from bots.state_records import RecordAccessor, SDRState, SupportState
+from transcript_utils import ROLE_BOT, ROLE_USER, append_entry, migrate_transcript, new_transcript
+from log_utils import CONVERSATION_ID, get_logger, log_event, redact
+from metrics import INTENTS, STATE_TRANSITIONS, TURN_DURATION, TURNS, TURNS_IN_FLIGHT
+from tracing import PROFILER, span
+
+# O SDK do Azure AI Language é importado só em clu_utils.create_clu_client (e só se o CLU estiver
+# configurado); a resposta do CLU é tratada como dict, sem os modelos da biblioteca.
 
 CONFIG = DefaultConfig()
 
-FAQ_DATA = {
-    "preço": "Nossos preços variam dependendo da solução e do escopo do projeto. Para obter um orçamento personalizado, por favor, agende uma conversa com um de nossos especialistas.",
-    "implementação": "Nosso processo de implementação para pequenas empresas geralmente inclui: 1. Análise de requisitos, 2. Configuração da plataforma, 3. Migração de dados (se aplicável), 4. Treinamento, 5. Suporte pós-implementação. Podemos detalhar isso em uma reunião.",
-    "microsoft teams": "Sim, somos especialistas em soluções Microsoft, incluindo a implementação e otimização do Microsoft Teams para colaboração.",
-    "documentação": "Oferecemos soluções para gestão de documentação em nuvem utilizando ferramentas como SharePoint Online, garantindo segurança e acesso facilitado.",
-    "contratos": "Podemos ajudar a otimizar seus processos de criação e gestão de contratos com soluções digitais integradas ao Microsoft 365.",
-    "suporte": "Oferecemos diferentes níveis de suporte técnico para nossas soluções. Se precisar de ajuda, pode descrever seu problema aqui ou abrir um chamado em nosso portal."
-}
-
-SUPPORT_SUGGESTIONS = {
-    "acesso": "Verifique se está usando as credenciais corretas ou tente redefinir sua senha: [link]",
-    "não consigo": "Poderia detalhar um pouco mais o que você não está conseguindo fazer? Qual sistema ou funcionalidade?",
-    "problema": "Para problemas gerais, reiniciar o aplicativo ou o computador pode ajudar. Se persistir, por favor, me dê mais detalhes."
-}
+TURN_LOGGER = get_logger("turn")
+CLU_LOGGER = get_logger("clu")
+FLOW_LOGGER = get_logger("flow")
+# Campos do registro "turn" (um por turno, em INFO), preenchidos ao longo do processamento
+TURN_LOG_FIELDS = "TralhobotTurnLogFields"
 
 SDR_KEYWORDS = ["vendas", "comercial", "interesse", "solução", "consultor", "especialista", "orçamento", "proposta"]
 
+# Casador compilado uma única vez na importação (sem acento/maiúsculas, com fronteira de palavra).
+# As perguntas frequentes ficam na base de conhecimento (KB_PATH, ver knowledge_base.py).
+SDR_MATCHER = KeywordMatcher({keyword: keyword for keyword in SDR_KEYWORDS})
+
+SDR_START_TEXT = ("Claro! Posso direcionar você para um de nossos especialistas. "
+                  "Para começarmos, poderia me dizer seu nome completo e sua função/cargo atual na empresa, por favor?")
+
 class Tralhobot(ActivityHandler):
-    def __init__(self, conversation_state: ConversationState, user_state: UserState, clu_client: ConversationAnalysisClient, clu_project_name: str, clu_deployment_name: str):
+    def __init__(self, conversation_state: ConversationState, user_state: UserState, clu_client: AsyncCLUClient, clu_project_name: str, clu_deployment_name: str, clu_cache: NLUCache = None,
+                 intent_classifier: IntentClassifier = None, lead_sink: LeadSink = None,
+                 knowledge_base: KnowledgeBase = None):
         if conversation_state is None:
             raise TypeError(
                 "[DialogBot]: Missing parameter. conversation_state is required"
@@ -52,294 +61,296 @@ class Tralhobot(ActivityHandler):
 
         self.conversation_state = conversation_state
         self.user_state = user_state
-        self.support_state_accessor = self.conversation_state.create_property("SupportState")
-        self.sdr_state_accessor = self.conversation_state.create_property("SDRState")
+        # Registros tipados em formato compacto e versionado (ver bots/state_records.py)
+        self.support_state_accessor = RecordAccessor(self.conversation_state, "SupportState", SupportState)
+        self.sdr_state_accessor = RecordAccessor(self.conversation_state, "SDRState", SDRState)
         self.log_accessor = self.conversation_state.create_property("ConversationLog")
 
+        # O cliente CLU é sempre envolvido para não bloquear o loop de eventos durante a chamada
+        if clu_client is not None and not isinstance(clu_client, AsyncCLUClient):
+            clu_client = AsyncCLUClient(clu_client, CONFIG.CLU_TIMEOUT_SECONDS, CONFIG.CLU_MAX_CONCURRENCY, *create_resilience(CONFIG))
         self.clu_client = clu_client
         self.clu_project_name = clu_project_name
         self.clu_deployment_name = clu_deployment_name
+        self.clu_cache = clu_cache
+        self.intent_classifier = intent_classifier
+        self.lead_sink = lead_sink
+        self.knowledge_base = knowledge_base
 
     async def on_turn(self, turn_context: TurnContext):
-        print(f"ON_TURN: Activity Type: {turn_context.activity.type}, User ID: {turn_context.activity.from_property.id}")
-        log = await self.log_accessor.get(turn_context, lambda: "")
+        started = time.perf_counter()
+        conversation_token = CONVERSATION_ID.set(turn_context.activity.conversation.id if turn_context.activity.conversation else None)
+        fields = turn_context.turn_state[TURN_LOG_FIELDS] = {"activity_type": turn_context.activity.type}
+        TURNS_IN_FLIGHT.inc()
+        PROFILER.turn_started()
+        try:
+            with span("bot.on_turn", activity_type=turn_context.activity.type):
+                await self._process_turn(turn_context)
+        except Exception as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            PROFILER.turn_finished()
+            TURNS_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - started
+            self._record_turn_metrics(fields, elapsed)
+            fields["latency_ms"] = round(elapsed * 1000, 2)
+            log_event(TURN_LOGGER, logging.WARNING if "error" in fields else logging.INFO, "turn", **fields)
+            CONVERSATION_ID.reset(conversation_token)
+
+    @staticmethod
+    def _record_turn_metrics(fields: Dict, elapsed: float):
+        activity_type = fields["activity_type"] or "unknown"
+        TURN_DURATION.observe(elapsed, activity_type)
+        TURNS.inc(activity_type, "error" if "error" in fields else "ok")
+        if "intent" in fields:
+            INTENTS.inc(fields["intent"] or "None", fields["intent_source"])
+        for flow in ("support", "sdr"):
+            before, after = fields.get(f"{flow}_state"), fields.get(f"{flow}_state_next")
+            if after is not None and after != before:
+                STATE_TRANSITIONS.inc(flow, before, after)
+
+    async def _process_turn(self, turn_context: TurnContext):
         if turn_context.activity.type == ActivityTypes.message:
-            prefix = "User:" if turn_context.activity.from_property.role == "user" else "Tralhobot:"
-            log += f"{prefix} {turn_context.activity.text}\n"
+            # Transcrição estruturada e limitada (ver transcript_utils.py), em vez de uma string que só cresce.
+            # A primeira leitura carrega o ConversationState do storage.
+            with span("state.load"):
+                log = migrate_transcript(await self.log_accessor.get(turn_context, new_transcript))
+            role = ROLE_USER if turn_context.activity.from_property.role == "user" else ROLE_BOT
+            self._append_to_log(turn_context, log, role, turn_context.activity.text)
             await self.log_accessor.set(turn_context, log)
 
-        await super().on_turn(turn_context)
+        with span("bot.activity_handler"):
+            await super().on_turn(turn_context)
 
-        await self.conversation_state.save_changes(turn_context, False)
-        await self.user_state.save_changes(turn_context, False)
+        # Uma única escrita por turno para os dois estados (com verificação de eTag no storage)
+        with span("state.save"):
+            await save_all_changes(turn_context, self.conversation_state, self.user_state)
 
     async def on_members_added_activity(
         self, members_added: list[ChannelAccount], turn_context: TurnContext
     ):
-        print("ON_MEMBERS_ADDED_ACTIVITY: Novo membro adicionado.")
+        log_event(TURN_LOGGER, logging.DEBUG, "members_added", count=len(members_added))
         for member in members_added:
             if member.id != turn_context.activity.recipient.id:
                 welcome_text = ("Olá! Bem-vindo(a) à Tralhotec. Sou Tralhobot, seu assistente virtual. "
                                 "Como posso ajudar você hoje? Você pode me perguntar sobre nossos produtos, "
                                 "solicitar suporte ou tirar dúvidas gerais.")
                 await turn_context.send_activity(MessageFactory.text(welcome_text))
-                await self.support_state_accessor.set(turn_context, {"state": "none"})
-                await self.sdr_state_accessor.set(turn_context, {"state": "none", "name": None, "role": None, "company": None, "needs": None, "size": None, "qualified": None, "email": None})
-                await self.log_accessor.set(turn_context, f"Tralhobot: {welcome_text}\n")
+                await self.support_state_accessor.set(turn_context, SupportState())
+                await self.sdr_state_accessor.set(turn_context, SDRState())
+                log = new_transcript()
+                self._append_to_log(turn_context, log, ROLE_BOT, welcome_text)
+                await self.log_accessor.set(turn_context, log)
 
     async def on_message_activity(self, turn_context: TurnContext):
-        user_message_lower = turn_context.activity.text.lower()
         user_message_original = turn_context.activity.text
-        print(f"ON_MESSAGE_ACTIVITY: Mensagem do usuário: '{user_message_original}'")
+        log_event(TURN_LOGGER, logging.DEBUG, "message_received", text=redact(user_message_original))
 
-        support_state_info = await self.support_state_accessor.get(turn_context, lambda: {"state": "none"})
-        sdr_state_info = await self.sdr_state_accessor.get(turn_context, lambda: {"state": "none"})
-        current_support_state = support_state_info.get("state", "none")
-        current_sdr_state = sdr_state_info.get("state", "none")
-        print(f"ON_MESSAGE_ACTIVITY: Estados atuais - Suporte: '{current_support_state}', SDR: '{current_sdr_state}'")
+        support_state_info = await self.support_state_accessor.get(turn_context)
+        sdr_state_info = await self.sdr_state_accessor.get(turn_context)
+        current_support_state = support_state_info.state
+        current_sdr_state = sdr_state_info.state
+        turn_fields = turn_context.turn_state.get(TURN_LOG_FIELDS, {})
+        turn_fields.update(support_state=current_support_state, sdr_state=current_sdr_state)
 
         default_response_text = "Desculpe, não entendi sua pergunta. Pode tentar reformular? Você pode perguntar sobre preços, implementação, Microsoft Teams, documentação, contratos ou suporte."
         handled = False # Flag para rastrear se uma resposta foi enviada dentro de um fluxo
 
         # === ALTERAÇÃO: FLUXOS AGORA ENVIAM SUAS PRÓPRIAS MENSAGENS E RETORNAM UM BOOLEANO ===
         if current_support_state != "none":
-            print(f"ON_MESSAGE_ACTIVITY: Entrando em fluxo de suporte.")
+            turn_fields["handled_by"] = "support_flow"
             handled = await self._handle_support_flow(turn_context, support_state_info)
         elif current_sdr_state != "none":
-            print(f"ON_MESSAGE_ACTIVITY: Entrando em fluxo SDR.")
+            turn_fields["handled_by"] = "sdr_flow"
             handled = await self._handle_sdr_flow(turn_context, sdr_state_info)
 
         # Se a mensagem ainda não foi tratada por um fluxo específico (SDR ou Suporte),
-        # prossiga com CLU/FAQ/Resposta Padrão.
-        if not handled and self.clu_client and self.clu_project_name and self.clu_deployment_name:
-            print(f"ON_MESSAGE_ACTIVITY: CLU ativado. Chamando analyze_conversation.")
-            try:
-                task_payload: Dict[str, Any] = {
-                    "kind": "Conversation",
-                    "analysisInput": {
-                        "conversationItem": {
-                            "participantId": turn_context.activity.from_property.id,
-                            "id": turn_context.activity.id,
-                            "text": user_message_original,
-                            "modality": "text",
-                            "language": "pt-br"
-                        }
-                    },
-                    "parameters": {
-                        "projectName": self.clu_project_name,
-                        "deploymentName": self.clu_deployment_name,
-                        "verbose": True,
-                    }
-                }
-
-                clu_raw_response = self.clu_client.analyze_conversation(task_payload)
-
-                prediction = {}
-                if isinstance(clu_raw_response, dict) and 'result' in clu_raw_response:
-                    prediction = clu_raw_response.get('result', {}).get('prediction', {})
-                    print(f"ON_MESSAGE_ACTIVITY: Resposta CLU processada (como dicionário direto): {prediction}")
+        # prossiga com classificador local/CLU, depois FAQ/Resposta Padrão.
+        if not handled:
+            prediction = await self._recognize_intent(turn_context)
+            if prediction:
+                top_intent = prediction.get("topIntent")
+                confidence_score = 0.0
+
+                if "intents" in prediction and top_intent:
+                    for intent_info in prediction["intents"]:
+                        if intent_info.get("category") == top_intent:
+                            confidence_score = intent_info.get("confidenceScore", 0.0)
+                            break
+
+                entities = prediction.get("entities", [])
+
+                turn_fields.update(handled_by="intent", intent=top_intent, confidence=round(confidence_score, 3),
+                                   intent_source=prediction.get("source", "clu"))
+                if entities:
+                    log_event(CLU_LOGGER, logging.DEBUG, "entities", categories=[entity.get("category") for entity in entities])
+
+                response_text_to_send = default_response_text # Padrão se nenhuma intenção específica for correspondida
+                if top_intent == "Saudacao":
+                    response_text_to_send = "Olá! Como posso ajudar você hoje?"
+                elif top_intent == "PerguntarPreco":
+                    response_text_to_send = "Nossos preços variam de acordo com o serviço. Você gostaria de informações sobre algum plano específico?"
+                elif top_intent == "SolicitarSuporte":
+                    response_text_to_send = "Entendo que você precisa de suporte. Para que eu possa ajudar melhor, poderia descrever o problema que está enfrentando?"
+                    await self.support_state_accessor.set(turn_context, SupportState("awaiting_problem_description"))
+                elif top_intent == "QualificarSDR":
+                    sdr_state_info.state = "awaiting_name_role"
+                    await self.sdr_state_accessor.set(turn_context, sdr_state_info)
+                    response_text_to_send = SDR_START_TEXT
+                elif top_intent == "Despedida":
+                    response_text_to_send = "Até logo! Foi um prazer ajudar. Tenha um ótimo dia!"
+                elif top_intent == "None":
+                    response_text_to_send = default_response_text
                 else:
-                    print(f"ON_MESSAGE_ACTIVITY: Tipo de resposta CLU inesperado ou vazio: {type(clu_raw_response)} - Conteúdo: {clu_raw_response}")
-                    prediction = {}
+                    response_text_to_send = default_response_text
                 
-                if prediction:
-                    top_intent = prediction.get("topIntent")
-                    confidence_score = 0.0
-
-                    if "intents" in prediction and top_intent:
-                        for intent_info in prediction["intents"]:
-                            if intent_info.get("category") == top_intent:
-                                confidence_score = intent_info.get("confidenceScore", 0.0)
-                                break
-
-                    entities = prediction.get("entities", [])
-
-                    print(f"CLU: Intenção detectada: '{top_intent}' com confiança: {confidence_score:.2f}")
-                    if entities:
-                        print(f"CLU: Entidades detectadas: {entities}")
-
-                    response_text_to_send = default_response_text # Padrão se nenhuma intenção CLU específica for correspondida
-                    if top_intent == "Saudacao":
-                        response_text_to_send = "Olá! Como posso ajudar você hoje?"
-                    elif top_intent == "PerguntarPreco":
-                        response_text_to_send = "Nossos preços variam de acordo com o serviço. Você gostaria de informações sobre algum plano específico?"
-                    elif top_intent == "SolicitarSuporte":
-                        response_text_to_send = "Entendo que você precisa de suporte. Para que eu possa ajudar melhor, poderia descrever o problema que está enfrentando?"
-                        await self.support_state_accessor.set(turn_context, {"state": "awaiting_problem_description"})
-                    elif top_intent == "QualificarSDR":
-                        sdr_state_info["state"] = "awaiting_name_role"
-                        await self.sdr_state_accessor.set(turn_context, sdr_state_info)
-                        response_text_to_send = ("Claro! Posso direcionar você para um de nossos especialistas. "
-                                        "Para começarmos, poderia me dizer seu nome completo e sua função/cargo atual na empresa, por favor?")
-                    elif top_intent == "Despedida":
-                        response_text_to_send = "Até logo! Foi um prazer ajudar. Tenha um ótimo dia!"
-                    elif top_intent == "None":
-                        response_text_to_send = default_response_text
-                    else:
-                        response_text_to_send = default_response_text
-                    
-                    await turn_context.send_activity(MessageFactory.text(response_text_to_send))
-                    handled = True # Marca como tratado após enviar uma resposta
-                else:
-                    print("ON_MESSAGE_ACTIVITY: Nenhuma predição CLU válida encontrada ou erro no parsing da resposta.")
-
-            except Exception as e:
-                print(f"ON_MESSAGE_ACTIVITY: ERRO ao chamar o CLU (após tentativa de ajuste): {e}")
-                traceback.print_exc(file=sys.stdout)
+                await turn_context.send_activity(MessageFactory.text(response_text_to_send))
+                handled = True # Marca como tratado após enviar uma resposta
         
         # Se ainda não foi tratado, prossiga com FAQ/Resposta Padrão
         if not handled:
-            print("ON_MESSAGE_ACTIVITY: Entrando em fluxo de fallback (FAQ/padrão).")
+            turn_fields["handled_by"] = "fallback"
             response_text_to_send = default_response_text # Padrão para fallback geral
-            for keyword, answer in FAQ_DATA.items():
-                if keyword in user_message_lower:
-                    response_text_to_send = answer
-                    response_text_to_send += "\n\nEssa informação foi útil? Posso ajudar com mais alguma pergunta?"
-                    break
+            faq_match = None
+            if self.knowledge_base is not None:
+                with span("kb.search") as kb_span:
+                    faq_match = self.knowledge_base.answer(user_message_original)
+                    kb_span.set_attribute("found", faq_match is not None)
+            if faq_match:
+                response_text_to_send = faq_match.entry.answer
+                response_text_to_send += "\n\nEssa informação foi útil? Posso ajudar com mais alguma pergunta?"
+                turn_fields.update(faq_id=faq_match.entry.id, faq_confidence=round(faq_match.confidence, 3))
+            elif SDR_MATCHER.first(user_message_original):
+                # Interesse comercial sem pergunta do FAQ: inicia a qualificação SDR
+                turn_fields["handled_by"] = "sdr_keyword"
+                sdr_state_info.state = "awaiting_name_role"
+                await self.sdr_state_accessor.set(turn_context, sdr_state_info)
+                response_text_to_send = SDR_START_TEXT
             await turn_context.send_activity(MessageFactory.text(response_text_to_send))
 
-
-        print(f"ON_MESSAGE_ACTIVITY: Turn finished for activity type {turn_context.activity.type}.")
-
-
-    async def _handle_support_flow(self, turn_context: TurnContext, state: Dict) -> bool: # Agora retorna um booleano
-        current_state = state.get("state", "none") 
-        response_text = ""
-        handled = False
-        print(f"HANDLE_SUPPORT_FLOW: Estado atual: '{current_state}', Mensagem: '{turn_context.activity.text}'")
+        # Estados ao fim do turno, para a métrica de transições (os registros já estão em cache no turn_state)
+        support_state_info = await self.support_state_accessor.get(turn_context)
+        sdr_state_info = await self.sdr_state_accessor.get(turn_context)
+        turn_fields.update(support_state_next=support_state_info.state,
+                           sdr_state_next=sdr_state_info.state)
 
 
-        if current_state == "awaiting_problem_description":
-            suggestion_found = False
-            for keyword, suggestion in SUPPORT_SUGGESTIONS.items():
-                if keyword in turn_context.activity.text.lower():
-                    response_text = f"Sugestão: {suggestion} Isso resolveu? (Sim/Não)"
-                    state["state"] = "awaiting_resolution_confirmation"
-                    suggestion_found = True
-                    break
-            if not suggestion_found:
-                response_text = "Ainda precisa de ajuda? (Sim/Não)"
-                state["state"] = "awaiting_resolution_confirmation"
-            handled = True # Marcou que o fluxo está sendo tratado e gerará uma resposta
+    async def _recognize_intent(self, turn_context: TurnContext) -> Dict:
+        """
+        Reconhece a intenção da mensagem. O classificador local responde primeiro; o CLU só é
+        chamado quando a confiança local fica abaixo de INTENT_LOCAL_THRESHOLD.
+        Se o CLU falhar, estiver com o disjuntor aberto ou sem cota, responde na hora com a intenção local (ver
+        _local_fallback). Retorna a predição no formato do CLU, ou {} se nenhuma fonte responder.
+        """
+        user_message_original = turn_context.activity.text
+        local_prediction = None
+
+        if self.intent_classifier is not None:
+            with span("nlu.classifier") as classifier_span:
+                local_prediction = self.intent_classifier.predict(user_message_original)
+                local_confidence = local_prediction["intents"][0]["confidenceScore"]
+                classifier_span.set_attribute("confidence", round(local_confidence, 3))
+            if local_confidence >= CONFIG.INTENT_LOCAL_THRESHOLD:
+                return local_prediction
+
+        if not (self.clu_client and self.clu_project_name and self.clu_deployment_name):
+            return {}
+
+        log_event(CLU_LOGGER, logging.DEBUG, "clu_call", local_confidence=round(local_confidence, 3) if self.intent_classifier else None)
+        clu_started = time.perf_counter()
+        try:
+            task_payload: Dict[str, Any] = {
+                "kind": "Conversation",
+                "analysisInput": {
+                    "conversationItem": {
+                        "participantId": turn_context.activity.from_property.id,
+                        "id": turn_context.activity.id,
+                        "text": user_message_original,
+                        "modality": "text",
+                        "language": "pt-br"
+                    }
+                },
+                "parameters": {
+                    "projectName": self.clu_project_name,
+                    "deploymentName": self.clu_deployment_name,
+                    "verbose": True,
+                }
+            }
+
+            with span("nlu.clu", cached=self.clu_cache is not None):
+                if self.clu_cache is not None:
+                    # Frases repetidas ("olá", "preço"...) reaproveitam a resposta anterior do CLU
+                    cache_key = self.clu_cache.make_key(user_message_original, self.clu_project_name, self.clu_deployment_name)
+                    clu_raw_response = await self.clu_cache.get_or_compute(
+                        cache_key, lambda: self.clu_client.analyze_conversation(task_payload)
+                    )
+                else:
+                    clu_raw_response = await self.clu_client.analyze_conversation(task_payload)
 
-        elif current_state == "awaiting_resolution_confirmation":
-            if "sim" in turn_context.activity.text.lower():
-                response_text = "Ótimo! Posso ajudar em algo mais?"
-                state["state"] = "none"
-            else:
-                response_text = "Por favor, informe seu nome, e-mail e empresa para escalarmos."
-                state["state"] = "awaiting_escalation_details"
-            handled = True
-
-        elif current_state == "awaiting_escalation_details":
-            user_details = turn_context.activity.text
-            response_text = (f"Seu ticket foi criado (TRALHO-{turn_context.activity.id[:5]}). Nossa equipe entrará em contato."
-                        f"Detalhes: {user_details}. Posso ajudar em algo mais agora?")
-            state["state"] = "none"
-            handled = True
-        
-        # === ALTERAÇÃO: ENVIA A ATIVIDADE DIRETAMENTE AQUI ===
-        if handled and response_text: # Só envia se um fluxo gerou texto para resposta
-            await turn_context.send_activity(MessageFactory.text(response_text))
-            await self.support_state_accessor.set(turn_context, state)
-        
-        return handled # Retorna se o fluxo foi tratado e a resposta enviada
-
-
-    async def _handle_sdr_flow(self, turn_context: TurnContext, state: Dict) -> bool: # Agora retorna um booleano
-        current_state = state.get("state", "none")
-        response_activity_to_send = None # Atividade a ser enviada
-        handled = False
-        print(f"HANDLE_SDR_FLOW: Estado atual: '{current_state}', Mensagem: '{turn_context.activity.text}'")
-
-
-        if current_state == "awaiting_name_role":
-            state.update({"name": turn_context.activity.text, "state": "awaiting_company"})
-            response_activity_to_send = MessageFactory.text(f"Obrigado, {state.get('name')}. Qual o nome da sua empresa?")
-            handled = True
-
-        elif current_state == "awaiting_company":
-            state.update({"company": turn_context.activity.text, "state": "awaiting_needs"})
-            response_activity_to_send = MessageFactory.text("Quais são seus principais desafios atuais?")
-            handled = True
-
-        elif current_state == "awaiting_needs":
-            state.update({"needs": turn_context.activity.text, "state": "awaiting_size"})
-            response_activity_to_send = MessageFactory.text("Qual o tamanho da sua empresa? (Ex: até 10, 11-50, 50+)")
-            handled = True
-
-        elif current_state == "awaiting_size":
-            state["size"] = turn_context.activity.text
-            is_qualified = False
-            
-            size_lower = turn_context.activity.text.lower()
-            if "10" in size_lower or "50" in size_lower or "grande" in size_lower:
-                is_qualified = True
-            
-            state["qualified"] = is_qualified
-            
-            if is_qualified:
-                state["state"] = "proposing_meeting"
-                response_activity_to_send = self._create_yes_no_card( #
-                    text="Com base no que conversamos, acredito que nossas soluções podem realmente agregar valor à sua empresa. "
-                    "Gostaria de agendar uma conversa com um de nossos especialistas? Ele(a) poderá apresentar demonstrações personalizadas e discutir como podemos atender às suas necessidades específicas.",
-                    yes_value="schedule_meeting_yes", no_value="schedule_meeting_no"
-                )
+            prediction = {}
+            if isinstance(clu_raw_response, dict) and 'result' in clu_raw_response:
+                prediction = clu_raw_response.get('result', {}).get('prediction', {})
+                log_event(CLU_LOGGER, logging.DEBUG, "clu_response", intent=prediction.get("topIntent"),
+                          latency_ms=round((time.perf_counter() - clu_started) * 1000, 2))
             else:
-                state["state"] = "handling_unqualified"
-                response_activity_to_send = self._create_yes_no_card( #
-                    text="Obrigado pelas informações. No momento, parece que nossas soluções podem não ser o encaixe ideal para as suas necessidades atuais / perfil da sua empresa. "
-                    "Gostaria de receber alguns materiais informativos sobre [Tópico Relevante] por e-mail para referência futura? (Sim/Não)",
-                    yes_value="send_materials_yes", no_value="send_materials_no"
-                )
-            handled = True
-
-        elif current_state == "proposing_meeting":
-            if turn_context.activity.text.lower() == "schedule_meeting_yes":
-                state["state"] = "awaiting_email_for_schedule"
-                response_activity_to_send = MessageFactory.text("Excelente! Para qual e-mail posso enviar o convite da reunião?")
-            else:
-                response_activity_to_send = MessageFactory.text("Entendido. Se mudar de ideia ou precisar de algo mais, é só chamar!")
-                state["state"] = "none"
-            handled = True
-
-        elif current_state == "awaiting_email_for_schedule":
-            state["email"] = turn_context.activity.text
-            response_activity_to_send = MessageFactory.text(f"Perfeito! Agendamento confirmado. O convite foi enviado para {state.get('email')}. "
-                                        f"Há mais algo em que posso ajudar agora?")
-            state["state"] = "none"
-            handled = True
-
-        elif current_state == "handling_unqualified":
-            if turn_context.activity.text.lower() == "send_materials_yes":
-                state["state"] = "awaiting_email_for_materials"
-                response_activity_to_send = MessageFactory.text("Ótimo! Para qual e-mail posso enviar os materiais?")
+                log_event(CLU_LOGGER, logging.WARNING, "clu_unexpected_response", response_type=type(clu_raw_response).__name__)
+                prediction = {}
+            return prediction
+
+        except CircuitOpenError:
+            log_event(CLU_LOGGER, logging.DEBUG, "clu_circuit_open")
+        except CLUBudgetExceeded:
+            log_event(CLU_LOGGER, logging.DEBUG, "clu_budget_exceeded")
+        except asyncio.TimeoutError:
+            log_event(CLU_LOGGER, logging.WARNING, "clu_timeout", timeout_s=round(self.clu_client.current_timeout, 3))
+        except Exception as e:
+            if is_service_failure(e):
+                # Indisponibilidade do serviço: o disjuntor cuida das repetições, sem traceback por turno
+                log_event(CLU_LOGGER, logging.WARNING, "clu_error", error=type(e).__name__,
+                          status=getattr(e, "status_code", None))
             else:
-                response_activity_to_send = MessageFactory.text("Entendido. Agradeço seu tempo e interesse na Tralhotec. Tenha um ótimo dia!")
-                state["state"] = "none"
-            handled = True
-        
-        elif current_state == "awaiting_email_for_materials":
-            state["email"] = turn_context.activity.text
-            response_activity_to_send = MessageFactory.text(f"Materiais enviados para {state.get('email')}. Agradeço seu tempo e interesse na Tralhotec. Tenha um ótimo dia!")
-            state["state"] = "none"
-            handled = True
-
-        # === ALTERAÇÃO: ENVIA A ATIVIDADE DIRETAMENTE AQUI ===
-        if handled and response_activity_to_send: # Só envia se um fluxo gerou uma atividade para resposta
-            await turn_context.send_activity(response_activity_to_send)
-            await self.sdr_state_accessor.set(turn_context, state)
-        elif handled and not response_activity_to_send:
-            print("WARNING: SDR flow handled but no response activity was generated to send.")
-        
-        return handled # Retorna se o fluxo foi tratado e a resposta enviada
-
-
-    def _create_yes_no_card(self, text: str, yes_value: str, no_value: str) -> Attachment:
-        return CardFactory.hero_card(
-            title=text, # Alterado para 'title' conforme a documentação de HeroCard
-            buttons=[
-                CardAction(title="Sim", type=ActionTypes.im_back, value=yes_value),
-                CardAction(title="Não", type=ActionTypes.im_back, value=no_value),
-            ],
-        ).attachments[0]
\ No newline at end of file
+                CLU_LOGGER.error("Erro ao chamar o CLU: %s", e, exc_info=True, extra={"fields": {"conversation_id": CONVERSATION_ID.get()}})
+        return self._local_fallback(local_prediction)
+
+    @staticmethod
+    def _local_fallback(local_prediction) -> Dict:
+        """Sem resposta do CLU: a intenção do classificador local, se passar de CLU_FALLBACK_MIN_CONFIDENCE; senão {} (FAQ)."""
+        if local_prediction and local_prediction["intents"][0]["confidenceScore"] >= CONFIG.CLU_FALLBACK_MIN_CONFIDENCE:
+            return {**local_prediction, "source": "local_fallback"}
+        return {}
+
+
+    async def _handle_support_flow(self, turn_context: TurnContext, state: SupportState) -> bool:
+        log_event(FLOW_LOGGER, logging.DEBUG, "support_flow", state=state.state, text=redact(turn_context.activity.text))
+        return await self._run_flow(SUPPORT_FLOW, self.support_state_accessor, turn_context, state)
+
+
+    async def _handle_sdr_flow(self, turn_context: TurnContext, state: SDRState) -> bool:
+        log_event(FLOW_LOGGER, logging.DEBUG, "sdr_flow", state=state.state, text=redact(turn_context.activity.text))
+        return await self._run_flow(SDR_FLOW, self.sdr_state_accessor, turn_context, state)
+
+
+    async def _run_flow(self, flow, accessor: RecordAccessor, turn_context: TurnContext, state) -> bool:
+        """Avança o fluxo (ver bots/flows.py), envia a resposta e grava o novo estado. False se o estado não pertence ao fluxo."""
+        with span("flow.step", flow=flow.name, state=state.state):
+            step = flow.step(state, turn_context.activity.text, activity_id=turn_context.activity.id or "")
+            if step is None:
+                return False
+            if step.lead and self.lead_sink is not None:
+                # Só enfileira: a gravação é feita pela thread do LeadSink
+                self.lead_sink.emit(lead_from_state(state, step.lead, turn_context.activity))
+            await turn_context.send_activity(step.reply)
+            await accessor.set(turn_context, state)
+            return True
+
+
+    def _append_to_log(self, turn_context: TurnContext, log: Dict, role: str, text: str):
+        append_entry(
+            log,
+            role,
+            text,
+            CONFIG.TRANSCRIPT_MAX_ENTRIES,
+            CONFIG.TRANSCRIPT_SPILL_DIR or None,
+            turn_context.activity.conversation.id,
+        )
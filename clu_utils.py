@@ -0,0 +1,436 @@
+import asyncio
+import inspect
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from log_utils import get_logger
+from metrics import CLU_DURATION
+from rate_limit import create_clu_budget
+
+LOGGER = get_logger("clu")
+
+
+class CircuitOpenError(Exception):
+    """O CLU não foi chamado porque o disjuntor está aberto (falhas seguidas recentes)."""
+
+
+class CLUBudgetExceeded(Exception):
+    """O CLU não foi chamado porque a cota de chamadas (RATE_LIMIT_CLU_*) acabou por enquanto."""
+
+
+def is_service_failure(error: BaseException) -> bool:
+    """
+    Falhas que indicam problema no serviço e contam para o disjuntor: timeout, erro de conexão,
+    5xx, 408 e 429. Um 4xx da própria requisição (ex: projeto inexistente) ou uma exceção sem
+    status (ex: bug no código local) não abre o disjuntor.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    status = getattr(error, "status_code", None)
+    # Sem status (ex: bug no código que monta a tarefa) não é falha do serviço
+    return status is not None and (status >= 500 or status in (408, 429))
+
+
+class CircuitBreaker:
+    """
+    Disjuntor do CLU.
+
+    - closed: as chamadas passam; `failure_threshold` falhas seguidas abrem o disjuntor.
+    - open: as chamadas falham na hora com CircuitOpenError, sem rede, por `reset_seconds`
+      (dobrando a cada reabertura seguida, até `max_reset_seconds`).
+    - half_open: passado o intervalo, até `half_open_calls` chamadas de teste passam; um sucesso
+      fecha o disjuntor, uma falha o abre de novo.
+
+    Usado só na thread do loop de eventos, sem locks.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 10.0, max_reset_seconds: float = 120.0,
+                 half_open_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max_reset_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._open_seconds = reset_seconds
+        self._trials = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self._open_seconds:
+            self._state = self.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def acquire(self) -> bool:
+        """Libera uma chamada ou lança CircuitOpenError. Retorna True se for uma chamada de teste (half_open)."""
+        state = self.state
+        if state == self.CLOSED:
+            return False
+        if state == self.HALF_OPEN and self._trials < self.half_open_calls:
+            self._trials += 1
+            return True
+        self.rejected += 1
+        raise CircuitOpenError(f"Disjuntor do CLU {state}.")
+
+    def release(self, trial: bool):
+        """Chamada de teste que terminou sem resultado (ex: cancelada): libera a vaga sem mudar o estado."""
+        if trial and self._state == self.HALF_OPEN:
+            self._trials -= 1
+
+    def record_success(self, trial: bool = False):
+        self.consecutive_failures = 0
+        if self._state != self.CLOSED and (trial or self._state == self.HALF_OPEN):
+            LOGGER.info("Disjuntor do CLU fechado: chamada de teste bem-sucedida.")
+            self._state = self.CLOSED
+            self._open_seconds = self.reset_seconds
+
+    def record_failure(self, trial: bool = False):
+        self.consecutive_failures += 1
+        if self._state == self.HALF_OPEN and trial:
+            self._trip(min(self._open_seconds * 2, self.max_reset_seconds))
+        elif self._state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._trip(self.reset_seconds)
+
+    def _trip(self, open_seconds: float):
+        self._state = self.OPEN
+        self._opened_at = self.clock()
+        self._open_seconds = open_seconds
+        self.trips += 1
+        LOGGER.warning("Disjuntor do CLU aberto por %.0f s após %d falhas seguidas.", open_seconds, self.consecutive_failures)
+
+
+class AdaptiveTimeout:
+    """
+    Prazo de cada chamada a partir da latência recente: `multiplier` x o percentil `percentile` das
+    últimas `window` chamadas, entre `min_seconds` e `max_seconds` (um timeout entra como amostra
+    igual ao prazo, então se o serviço ficar mais lento de forma duradoura o prazo acompanha). Enquanto houver
+    menos de `min_samples` amostras, vale `max_seconds`. O percentil é recalculado a cada
+    `recompute_every` amostras, não a cada chamada.
+    """
+
+    def __init__(self, max_seconds: float, min_seconds: float = 0.5, percentile: float = 0.95,
+                 multiplier: float = 2.0, window: int = 200, min_samples: int = 20, recompute_every: int = 10):
+        self.max_seconds = max_seconds
+        self.min_seconds = min(min_seconds, max_seconds)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.recompute_every = recompute_every
+        self.current = max_seconds
+        self._samples = deque(maxlen=window)
+        self._pending = 0
+
+    def observe(self, latency: float):
+        self._samples.append(latency)
+        self._pending += 1
+        if self._pending >= self.recompute_every and len(self._samples) >= self.min_samples:
+            self._pending = 0
+            ordered = sorted(self._samples)
+            value = ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+            self.current = min(max(value * self.multiplier, self.min_seconds), self.max_seconds)
+
+
+class AsyncCLUClient:
+    """
+    Envolve o ConversationAnalysisClient (síncrono ou assíncrono) para que a
+    chamada ao CLU nunca bloqueie o loop de eventos.
+
+    - Cliente de `azure.ai.language.conversations.aio`: a chamada é aguardada diretamente.
+    - Cliente síncrono: a chamada roda em um executor com número limitado de threads.
+
+    Em ambos os casos a chamada respeita um timeout e um limite de concorrência. Com `breaker`,
+    falhas seguidas do serviço abrem o disjuntor e as chamadas seguintes falham na hora com
+    CircuitOpenError; com `adaptive_timeout`, o prazo acompanha a latência recente (as chamadas de
+    teste do disjuntor usam sempre o timeout máximo). Com `budget` (um TokenBucket de rate_limit.py),
+    sem fichas a chamada falha na hora com CLUBudgetExceeded.
+    """
+
+    def __init__(self, clu_client, timeout: float = 3.0, max_concurrency: int = 16,
+                 breaker: Optional[CircuitBreaker] = None, adaptive_timeout: Optional[AdaptiveTimeout] = None,
+                 budget=None):
+        self.client = clu_client
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self.adaptive_timeout = adaptive_timeout
+        self.budget = budget
+        self.is_async = inspect.iscoroutinefunction(getattr(clu_client, "analyze_conversation", None))
+
+        # O executor só é necessário quando apenas o cliente síncrono existe
+        self._executor = None
+        if not self.is_async:
+            self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="clu")
+
+        # O semáforo é recriado se o loop mudar (ex: asyncio.run() por requisição no Flask)
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    @property
+    def current_timeout(self) -> float:
+        return self.adaptive_timeout.current if self.adaptive_timeout is not None else self.timeout
+
+    async def analyze_conversation(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Executa a análise do CLU sem bloquear o loop. Lança asyncio.TimeoutError se exceder o prazo
+        e CircuitOpenError ou CLUBudgetExceeded, sem chamar o serviço, se o disjuntor estiver aberto
+        ou a cota tiver acabado.
+        """
+        breaker = self.breaker
+        trial = breaker.acquire() if breaker is not None else False
+        # A ficha da cota só é gasta depois do disjuntor: com ele aberto nenhuma chamada sai
+        if self.budget is not None and not self.budget.try_take():
+            if breaker is not None:
+                breaker.release(trial)
+            raise CLUBudgetExceeded()
+        settled = False
+        try:
+            async with self._get_semaphore():
+                if self.is_async:
+                    call = self.client.analyze_conversation(task)
+                else:
+                    loop = asyncio.get_running_loop()
+                    call = loop.run_in_executor(self._executor, self.client.analyze_conversation, task)
+                started = time.perf_counter()
+                outcome = "error"
+                deadline = self.timeout if trial else self.current_timeout
+                try:
+                    result = await asyncio.wait_for(call, timeout=deadline)
+                    outcome = "ok"
+                    if self.adaptive_timeout is not None:
+                        self.adaptive_timeout.observe(time.perf_counter() - started)
+                    if breaker is not None:
+                        breaker.record_success(trial)
+                    settled = True
+                    return result
+                except asyncio.TimeoutError:
+                    outcome = "timeout"
+                    if self.adaptive_timeout is not None:
+                        # A latência real foi de pelo menos o prazo: com muitos timeouts o percentil sobe e o prazo cresce
+                        self.adaptive_timeout.observe(deadline)
+                    raise
+                finally:
+                    CLU_DURATION.observe(time.perf_counter() - started, outcome)
+        except Exception as e:
+            if breaker is not None and is_service_failure(e):
+                breaker.record_failure(trial)
+                settled = True
+            raise
+        finally:
+            if breaker is not None and not settled:
+                breaker.release(trial)
+
+    async def warmup(self):
+        """
+        Abre a conexão TLS com o endpoint do CLU antes do primeiro turno (ver startup.py), com um GET
+        na raiz da API: o status não importa, só a conexão que fica no pool do cliente. (Depois de um
+        HEAD o aiohttp não reaproveita a conexão.)
+        """
+        from azure.core.rest import HttpRequest
+        request = HttpRequest("GET", "/")
+        if self.is_async:
+            response = await self.client.send_request(request)
+            await response.close()
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(self._executor, self.client.send_request, request)
+            response.close()
+
+    async def close(self):
+        """Fecha o cliente subjacente e libera as threads do executor."""
+        if self.is_async and hasattr(self.client, "close"):
+            await self.client.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def create_resilience(config):
+    """Disjuntor, prazo adaptativo e cota conforme o DefaultConfig (CLU_BREAKER_*, CLU_ADAPTIVE_TIMEOUT*, RATE_LIMIT_CLU_*)."""
+    breaker = None
+    if config.CLU_BREAKER_ENABLED:
+        breaker = CircuitBreaker(config.CLU_BREAKER_FAILURES, config.CLU_BREAKER_RESET_SECONDS,
+                                 config.CLU_BREAKER_MAX_RESET_SECONDS, config.CLU_BREAKER_HALF_OPEN_CALLS)
+    adaptive_timeout = None
+    if config.CLU_ADAPTIVE_TIMEOUT:
+        adaptive_timeout = AdaptiveTimeout(config.CLU_TIMEOUT_SECONDS, config.CLU_TIMEOUT_MIN_SECONDS,
+                                           config.CLU_TIMEOUT_PERCENTILE, config.CLU_TIMEOUT_MULTIPLIER)
+    return breaker, adaptive_timeout, create_clu_budget(config)
+
+
+def create_clu_client(config, use_async: bool = True):
+    """
+    Cria o cliente CLU a partir do DefaultConfig, ou None se as credenciais não estiverem configuradas.
+
+    Com use_async=True usa o cliente de `azure.ai.language.conversations.aio`, que mantém
+    as conexões HTTP abertas entre as chamadas enquanto o loop de eventos do worker viver.
+    """
+    if not (config.CLU_ENDPOINT and config.CLU_API_KEY):
+        LOGGER.warning("Credenciais CLU (ENDPOINT/API_KEY) não configuradas. O bot não usará o CLU para NLU.")
+        return None
+
+    from azure.core.credentials import AzureKeyCredential
+    if use_async:
+        from azure.ai.language.conversations.aio import ConversationAnalysisClient
+    else:
+        from azure.ai.language.conversations import ConversationAnalysisClient
+
+    try:
+        clu_client = ConversationAnalysisClient(
+            endpoint=config.CLU_ENDPOINT,
+            credential=AzureKeyCredential(config.CLU_API_KEY),
+            retry_total=config.CLU_RETRIES,
+        )
+        LOGGER.info("CLU Client inicializado com sucesso.")
+        return AsyncCLUClient(clu_client, config.CLU_TIMEOUT_SECONDS, config.CLU_MAX_CONCURRENCY,
+                              *create_resilience(config))
+    except Exception as e:
+        LOGGER.exception("Falha ao inicializar CLU Client: %s", e)
+        return None
+
+
+# CLU falso com falhas injetadas e comparação com/sem disjuntor e prazo adaptativo.
+# Cada fase dura alguns segundos, com 10 usuários simulados chamando o CLU em sequência.
+# Uso: python clu_utils.py [segundos por fase]
+if __name__ == "__main__":
+    import statistics
+    import sys
+
+    from aiohttp import web
+
+    # Disjuntor com relógio controlado: fechado -> aberto -> em teste -> aberto (tempo dobrado) -> fechado
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=10, max_reset_seconds=15, clock=lambda: now[0])
+    for _ in range(3):
+        assert breaker.acquire() is False
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 1
+    try:
+        breaker.acquire()
+        raise AssertionError("Disjuntor aberto deveria recusar a chamada")
+    except CircuitOpenError:
+        pass
+    now[0] = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN and breaker.acquire() is True
+    try:
+        breaker.acquire()
+        raise AssertionError("Só uma chamada de teste por vez")
+    except CircuitOpenError:
+        pass
+    breaker.record_failure(trial=True)
+    now[0] = 24
+    assert breaker.state == CircuitBreaker.OPEN  # Reaberto por 15 s (20 s limitados a max_reset_seconds)
+    now[0] = 25
+    assert breaker.acquire() is True
+    breaker.record_success(trial=True)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.trips == 2 and breaker.rejected == 2
+    # 4xx da própria requisição não contam como falha do serviço
+    assert not is_service_failure(type("E", (Exception,), {"status_code": 400})())
+    assert is_service_failure(asyncio.TimeoutError()) and is_service_failure(type("E", (Exception,), {"status_code": 503})())
+    assert not is_service_failure(KeyError("kind")) and not is_service_failure(type("E", (Exception,), {"status_code": None})())
+    from azure.core.exceptions import ServiceRequestError
+    assert is_service_failure(ServiceRequestError("conexão recusada")) and is_service_failure(ConnectionResetError())
+    # Com o disjuntor aberto a cota do CLU não é gasta
+    from rate_limit import TokenBucket
+    open_breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60, clock=lambda: now[0])
+    open_breaker.record_failure()
+    budget = TokenBucket(1.0, 2, clock=lambda: now[0])
+    guarded = AsyncCLUClient(object(), breaker=open_breaker, budget=budget)
+    for _ in range(5):
+        try:
+            asyncio.run(guarded.analyze_conversation({}))
+        except CircuitOpenError:
+            pass
+    assert budget.tokens == 2 and budget.rejected == 0
+    print("Disjuntor: transições verificadas.")
+
+    phase_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    # (fase, latência do CLU falso em s, fração de respostas 500)
+    phases = [("saudável", 0.05, 0.0), ("erros 500", 0.05, 1.0), ("lento (2 s)", 2.0, 0.0), ("recuperado", 0.05, 0.0)]
+    fault = {"latency": 0.05, "error_rate": 0.0, "calls": 0}
+
+    async def fake_clu(request: web.Request) -> web.Response:
+        fault["calls"] += 1
+        await request.read()
+        await asyncio.sleep(fault["latency"])
+        if fault["calls"] % 100 < fault["error_rate"] * 100:
+            return web.json_response({"error": {"code": "InternalServerError", "message": "falha injetada"}}, status=500)
+        prediction = {"topIntent": "Saudacao", "intents": [{"category": "Saudacao", "confidenceScore": 0.9}], "entities": []}
+        return web.json_response({"kind": "ConversationResult", "result": {"query": "oi", "prediction": prediction}})
+
+    task = {"kind": "Conversation",
+            "analysisInput": {"conversationItem": {"participantId": "u", "id": "1", "text": "oi", "modality": "text"}},
+            "parameters": {"projectName": "p", "deploymentName": "d"}}
+
+    async def run_phase(client: AsyncCLUClient, seconds: float, concurrency: int = 10) -> Dict[str, Any]:
+        latencies, outcomes = [], {"ok": 0, "recusada": 0, "timeout": 0, "erro": 0}
+        turn_gap = 0.02  # Intervalo entre turnos de um mesmo usuário simulado
+        phase_end = time.perf_counter() + seconds
+
+        async def user():
+            while time.perf_counter() < phase_end:
+                started = time.perf_counter()
+                try:
+                    await client.analyze_conversation(task)
+                    outcomes["ok"] += 1
+                except CircuitOpenError:
+                    outcomes["recusada"] += 1
+                except asyncio.TimeoutError:
+                    outcomes["timeout"] += 1
+                except Exception:  # pylint: disable=broad-except
+                    outcomes["erro"] += 1
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(turn_gap)
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        latencies.sort()
+        return {"p50": latencies[len(latencies) // 2], "p99": latencies[int(len(latencies) * 0.99) - 1],
+                "total": sum(latencies), **outcomes}
+
+    async def compare():
+        from azure.ai.language.conversations.aio import ConversationAnalysisClient
+        from azure.core.credentials import AzureKeyCredential
+
+        app = web.Application()
+        app.router.add_post("/language/:analyze-conversations", fake_clu)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 9199).start()
+        try:
+            for label, resilient in (("sem disjuntor (timeout fixo de 3 s)", False), ("com disjuntor e prazo adaptativo", True)):
+                sdk_client = ConversationAnalysisClient("http://127.0.0.1:9199", AzureKeyCredential("teste"), retry_total=0)
+                client = AsyncCLUClient(sdk_client, 3.0, 16,
+                                        CircuitBreaker(5, reset_seconds=0.5, max_reset_seconds=2.0) if resilient else None,
+                                        AdaptiveTimeout(3.0, min_seconds=0.2) if resilient else None)
+                print(f"\n{label}")
+                print(f"{'fase':<14} {'p50 ms':>8} {'p99 ms':>8} {'espera total s':>15} {'ok':>5} {'recusadas':>10} {'timeouts':>9} {'erros':>6} {'prazo ms':>9} {'disjuntor':>10}")
+                for phase, latency, error_rate in phases:
+                    fault.update(latency=latency, error_rate=error_rate)
+                    result = await run_phase(client, phase_seconds)
+                    state = client.breaker.state if client.breaker is not None else "-"
+                    print(f"{phase:<14} {result['p50'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} {result['total']:>15.1f} "
+                          f"{result['ok']:>5} {result['recusada']:>10} {result['timeout']:>9} {result['erro']:>6} "
+                          f"{client.current_timeout * 1000:>9.0f} {state:>10}")
+                await client.close()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(compare())
@@ -3,7 +3,8 @@ import os
 class DefaultConfig:
     """Bot Configuration"""
 
-    PORT = 3979  # Porta padrão para bots do Bot Framework
+    PORT = int(os.environ.get("PORT", 3979))  # Porta padrão para bots do Bot Framework (o Render define PORT)
+    HOST = os.environ.get("HOST", "127.0.0.1")  # Use "0.0.0.0" para aceitar conexões externas
     APP_ID = os.environ.get("MicrosoftAppId", "") # Deixe vazio para testes locais no Emulator
     APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "") # Deixe vazio para testes locais no Emulator
     
@@ -13,10 +14,136 @@ class DefaultConfig:
     EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD", "sua_senha_de_app_ou_email") # Senha do seu e-mail (ou senha de app se usar Gmail/Outlook com 2FA)
     EMAIL_SMTP_SERVER = os.environ.get("EMAIL_SMTP_SERVER", "smtp.gmail.com") # Ex: smtp.gmail.com (Gmail), smtp.office365.com (Outlook)
     EMAIL_SMTP_PORT = int(os.environ.get("EMAIL_SMTP_PORT", 587)) # Porta: 587 (TLS) ou 465 (SSL)
+    EMAIL_OUTBOX_DIR = os.environ.get("EMAIL_OUTBOX_DIR", "email_outbox") # Pasta onde os e-mails aguardam envio (sobrevive a restarts)
+    EMAIL_BATCH_SIZE = int(os.environ.get("EMAIL_BATCH_SIZE", 20)) # Máximo de e-mails enviados em sequência pela mesma conexão
+    EMAIL_MAX_RETRIES = int(os.environ.get("EMAIL_MAX_RETRIES", 5)) # Falhas temporárias com espera dobrando a cada vez; depois o e-mail segue sendo tentado no intervalo máximo (5xx vão para EMAIL_OUTBOX_DIR/failed)
+    EMAIL_RETRY_BASE_SECONDS = float(os.environ.get("EMAIL_RETRY_BASE_SECONDS", 2)) # Espera inicial do backoff exponencial entre tentativas
+    EMAIL_SMTP_STARTTLS = os.environ.get("EMAIL_SMTP_STARTTLS", "true").lower() == "true" # Exige STARTTLS fora da porta 465 e o login; "false" (só para um SMTP local de testes) dispensa o TLS e o AUTH que o servidor não oferecer
+    EMAIL_SMTP_IDLE_SECONDS = float(os.environ.get("EMAIL_SMTP_IDLE_SECONDS", 60)) # Fecha a conexão SMTP após esse tempo sem e-mails
 
     # Configurações para o Azure Ai Language (CLU)
 
     CLU_ENDPOINT = os.environ.get("CLU_ENDPOINT", "https://sdr-language-ai.cognitiveservices.azure.com/")  # Endpoint da API
     CLU_API_KEY = os.environ.get("CLU_API_KEY", "9fH7Dt5goNSnlWTbfR4dq8Fm9yZP4IOvJC1boq5zSdoFY0I76XdhJQQJ99BFACYeBjFXJ3w3AAAaACOG26ju")  # Chave de API
     CLU_PROJECT_NAME = os.environ.get("CLU_PROJECT_NAME", "Tralhobot_CLU")  # Nome do projeto CLU
-    CLU_DEPLOYMENT_NAME = os.environ.get("CLU_DEPLOYMENT_NAME", "production-deployment")  # Nome do deployment CLU
\ No newline at end of file
+    CLU_DEPLOYMENT_NAME = os.environ.get("CLU_DEPLOYMENT_NAME", "production-deployment")  # Nome do deployment CLU
+    CLU_TIMEOUT_SECONDS = float(os.environ.get("CLU_TIMEOUT_SECONDS", 3.0))  # Tempo máximo de espera por uma resposta do CLU
+    CLU_MAX_CONCURRENCY = int(os.environ.get("CLU_MAX_CONCURRENCY", 16))  # Máximo de chamadas simultâneas ao CLU por worker
+    CLU_RETRIES = int(os.environ.get("CLU_RETRIES", 0))  # Retentativas do SDK do Azure (com backoff) dentro de uma chamada; o disjuntor e o fallback local cuidam das falhas
+    CLU_BREAKER_ENABLED = os.environ.get("CLU_BREAKER_ENABLED", "true").lower() == "true"  # Disjuntor: para de chamar o CLU após falhas seguidas
+    CLU_BREAKER_FAILURES = int(os.environ.get("CLU_BREAKER_FAILURES", 5))  # Falhas seguidas (timeout, 5xx, 429, conexão) que abrem o disjuntor
+    CLU_BREAKER_RESET_SECONDS = float(os.environ.get("CLU_BREAKER_RESET_SECONDS", 10))  # Tempo aberto antes da chamada de teste
+    CLU_BREAKER_MAX_RESET_SECONDS = float(os.environ.get("CLU_BREAKER_MAX_RESET_SECONDS", 120))  # O tempo aberto dobra a cada teste que falha, até este limite
+    CLU_BREAKER_HALF_OPEN_CALLS = int(os.environ.get("CLU_BREAKER_HALF_OPEN_CALLS", 1))  # Chamadas de teste simultâneas com o disjuntor em teste
+    CLU_ADAPTIVE_TIMEOUT = os.environ.get("CLU_ADAPTIVE_TIMEOUT", "true").lower() == "true"  # Prazo por chamada a partir da latência recente (limitado a CLU_TIMEOUT_SECONDS)
+    CLU_TIMEOUT_MIN_SECONDS = float(os.environ.get("CLU_TIMEOUT_MIN_SECONDS", 0.5))  # Prazo mínimo com o timeout adaptativo
+    CLU_TIMEOUT_PERCENTILE = float(os.environ.get("CLU_TIMEOUT_PERCENTILE", 0.95))  # Percentil da latência recente usado no prazo
+    CLU_TIMEOUT_MULTIPLIER = float(os.environ.get("CLU_TIMEOUT_MULTIPLIER", 2.0))  # Prazo = percentil x multiplicador
+    CLU_FALLBACK_MIN_CONFIDENCE = float(os.environ.get("CLU_FALLBACK_MIN_CONFIDENCE", 0.4))  # Sem o CLU, usa a intenção do classificador local acima desta confiança
+    CLU_CACHE_MAX_ENTRIES = int(os.environ.get("CLU_CACHE_MAX_ENTRIES", 5000))  # Respostas do CLU mantidas em cache por worker (0 = sem cache)
+    CLU_CACHE_TTL_SECONDS = float(os.environ.get("CLU_CACHE_TTL_SECONDS", 3600))  # Validade de uma resposta em cache
+    CLU_CACHE_SHARED = os.environ.get("CLU_CACHE_SHARED", "false").lower() == "true"  # Compartilha o cache entre workers via STATE_STORAGE
+
+    # Classificador local de intenções (evita chamar o CLU quando está confiante)
+    INTENT_MODEL_PATH = os.environ.get("INTENT_MODEL_PATH", "data/intent_model.json")  # Modelo treinado offline (python intent_classifier.py train ...)
+    INTENT_TRAINING_PATH = os.environ.get("INTENT_TRAINING_PATH", "data/intent_utterances.json")  # Frases rotuladas (export do CLU) usadas se o modelo não existir
+    INTENT_LOCAL_THRESHOLD = float(os.environ.get("INTENT_LOCAL_THRESHOLD", 0.7))  # Confiança mínima para responder sem o CLU
+
+    # Armazenamento do estado (ConversationState/UserState)
+    STATE_STORAGE = os.environ.get("STATE_STORAGE", "memory")  # "memory" (volátil, limitado pelos STATE_MEMORY_*), "sqlite" (um nó) ou "redis" (compartilhado)
+    STATE_SQLITE_PATH = os.environ.get("STATE_SQLITE_PATH", "tralhobot_state.db")  # Arquivo do banco SQLite
+    STATE_REDIS_URL = os.environ.get("STATE_REDIS_URL", "redis://localhost:6379/0")  # URL do servidor Redis (ou compatível)
+    STATE_REDIS_KEY_PREFIX = os.environ.get("STATE_REDIS_KEY_PREFIX", "tralhobot:")  # Prefixo das chaves no Redis
+    STATE_MEMORY_MAX_MB = int(os.environ.get("STATE_MEMORY_MAX_MB", 64))  # Orçamento de memória do storage "memory"; acima dele, despeja as conversas menos recentes
+    STATE_MEMORY_IDLE_SECONDS = int(os.environ.get("STATE_MEMORY_IDLE_SECONDS", 6 * 3600))  # Conversas sem turnos há mais tempo que isso são despejadas
+    STATE_MEMORY_SWEEP_SECONDS = int(os.environ.get("STATE_MEMORY_SWEEP_SECONDS", 60))  # Intervalo da varredura de conversas ociosas
+    STATE_MEMORY_COLD_PATH = os.environ.get("STATE_MEMORY_COLD_PATH", "")  # SQLite onde guardar as conversas despejadas (vazio = descartar)
+
+    # Transcrição da conversa (propriedade ConversationLog)
+    TRANSCRIPT_MAX_ENTRIES = int(os.environ.get("TRANSCRIPT_MAX_ENTRIES", 50))  # Máximo de mensagens mantidas no estado da conversa
+    TRANSCRIPT_SPILL_DIR = os.environ.get("TRANSCRIPT_SPILL_DIR", "")  # Pasta para guardar as mensagens antigas em disco (vazio = descartar)
+
+    # Confirmação imediata (202) com processamento do turno em segundo plano
+    TURN_QUEUE_ENABLED = os.environ.get("TURN_QUEUE_ENABLED", "false").lower() == "true"  # Liga o modo de fila no /api/messages
+    TURN_QUEUE_WORKERS = int(os.environ.get("TURN_QUEUE_WORKERS", 16))  # Turnos processados em paralelo por worker
+    TURN_QUEUE_MAX_DEPTH = int(os.environ.get("TURN_QUEUE_MAX_DEPTH", 1000))  # Acima disso o endpoint responde 503 (backpressure)
+    TURN_QUEUE_DEDUP_SIZE = int(os.environ.get("TURN_QUEUE_DEDUP_SIZE", 10000))  # Activity ids lembrados para ignorar retentativas do canal
+    TURN_QUEUE_DRAIN_SECONDS = float(os.environ.get("TURN_QUEUE_DRAIN_SECONDS", 10))  # Tempo para concluir os turnos já aceitos ao desligar
+
+    # Logs estruturados (ver log_utils.py)
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")  # DEBUG mostra o detalhe de cada passo do turno
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # "json" (uma linha por evento) ou "text" (leitura local)
+    LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")  # Amostragem por categoria abaixo de WARNING, ex: "turn=0.1,clu=0.5"
+    LOG_REDACT = os.environ.get("LOG_REDACT", "true").lower() == "true"  # Não grava o texto das mensagens (só o tamanho)
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # Registros aguardando escrita; acima disso são descartados
+
+    # Envio das respostas ao Bot Connector (ver connector_client.py)
+    CONNECTOR_POOL_ENABLED = os.environ.get("CONNECTOR_POOL_ENABLED", "true").lower() == "true"  # false = cliente HTTP do SDK
+    CONNECTOR_POOL_SIZE = int(os.environ.get("CONNECTOR_POOL_SIZE", 32))  # Conexões keep-alive por serviceUrl (host do canal)
+    CONNECTOR_KEEPALIVE_SECONDS = float(os.environ.get("CONNECTOR_KEEPALIVE_SECONDS", 60))  # Tempo que uma conexão ociosa fica aberta
+    CONNECTOR_TIMEOUT_SECONDS = float(os.environ.get("CONNECTOR_TIMEOUT_SECONDS", 10))  # Tempo máximo de um envio ao canal
+    CONNECTOR_TOKEN_URL = os.environ.get("CONNECTOR_TOKEN_URL", "https://login.microsoftonline.com/botframework.com/oauth2/v2.0/token")  # Endpoint do token do bot
+    CONNECTOR_TOKEN_SCOPE = os.environ.get("CONNECTOR_TOKEN_SCOPE", "https://api.botframework.com/.default")  # Escopo do token para o Bot Connector
+    CONNECTOR_TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get("CONNECTOR_TOKEN_REFRESH_MARGIN_SECONDS", 300))  # Renova o token este tempo antes de expirar
+
+    # Leitura das atividades recebidas (ver activity_parser.py)
+    ACTIVITY_FAST_PARSE = os.environ.get("ACTIVITY_FAST_PARSE", "true").lower() == "true"  # false = Activity().deserialize completo do SDK
+
+    # Validação dos tokens recebidos do Bot Connector (ver auth_cache.py)
+    AUTH_CACHE_ENABLED = os.environ.get("AUTH_CACHE_ENABLED", "true").lower() == "true"  # false = validação do SDK a cada requisição
+    AUTH_OPENID_METADATA_URL = os.environ.get("AUTH_OPENID_METADATA_URL", "https://login.botframework.com/v1/.well-known/openidconfiguration")  # Metadados OpenID com o endereço das chaves
+    AUTH_KEYS_REFRESH_SECONDS = float(os.environ.get("AUTH_KEYS_REFRESH_SECONDS", 6 * 3600))  # Intervalo da atualização das chaves em segundo plano
+    AUTH_CACHE_MAX_TOKENS = int(os.environ.get("AUTH_CACHE_MAX_TOKENS", 10000))  # Tokens válidos memorizados até o exp
+
+    # Partida a frio no Render (ver startup.py)
+    STARTUP_LAZY = os.environ.get("STARTUP_LAZY", "true").lower() == "true"  # Abre a porta antes de importar o SDK; o bot é montado em segundo plano
+    STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() == "true"  # Abre as conexões (CLU, canais, login) e busca token/chaves na subida
+    STARTUP_PRECONNECT_URLS = os.environ.get("STARTUP_PRECONNECT_URLS", "")  # serviceUrls dos canais, separados por vírgula, ex: "https://smba.trafficmanager.net/br/"
+    STARTUP_READY_TIMEOUT_SECONDS = float(os.environ.get("STARTUP_READY_TIMEOUT_SECONDS", 60))  # Espera máxima de uma requisição pela montagem do bot
+
+    # Rastreamento por fase do turno e perfil sob demanda (ver tracing.py)
+    TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "")  # "" (desligado), "file" ou "otlp"
+    TRACE_FILE_PATH = os.environ.get("TRACE_FILE_PATH", "traces.jsonl")  # Com TRACE_EXPORTER=file: um lote OTLP/JSON por linha
+    TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")  # Com TRACE_EXPORTER=otlp: coletor OTLP/HTTP
+    TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))  # Fração dos turnos rastreados
+    TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 10000))  # Spans aguardando exportação; acima disso são descartados
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")  # Token de POST /admin/profile (vazio = rota desligada)
+    PROFILE_MAX_TURNS = int(os.environ.get("PROFILE_MAX_TURNS", 1000))  # Máximo de turnos por perfil sob demanda
+
+    # Leads do funil SDR (ver lead_sink.py)
+    LEAD_SINK_ENABLED = os.environ.get("LEAD_SINK_ENABLED", "true").lower() == "true"  # Grava um lead a cada e-mail capturado no funil
+    LEAD_SINK_DIR = os.environ.get("LEAD_SINK_DIR", "leads")  # Pasta dos segmentos
+    LEAD_SINK_FORMATS = os.environ.get("LEAD_SINK_FORMATS", "jsonl")  # "jsonl", "csv" ou os dois separados por vírgula
+    LEAD_SINK_SQLITE_PATH = os.environ.get("LEAD_SINK_SQLITE_PATH", "")  # Também grava na tabela "leads" deste SQLite (vazio = não)
+    LEAD_SEGMENT_MAX_BYTES = int(os.environ.get("LEAD_SEGMENT_MAX_BYTES", 16 * 1024 * 1024))  # Troca de segmento acima deste tamanho
+    LEAD_SEGMENT_MAX_SECONDS = float(os.environ.get("LEAD_SEGMENT_MAX_SECONDS", 24 * 3600))  # ... ou depois deste tempo aberto
+    LEAD_FSYNC_INTERVAL_SECONDS = float(os.environ.get("LEAD_FSYNC_INTERVAL_SECONDS", 1.0))  # Intervalo máximo entre fsyncs (0 = a cada lote)
+    LEAD_QUEUE_SIZE = int(os.environ.get("LEAD_QUEUE_SIZE", 10000))  # Leads aguardando gravação; acima disso são descartados
+
+    # Base de conhecimento do FAQ (ver knowledge_base.py)
+    KB_PATH = os.environ.get("KB_PATH", "data/faq.json")  # Perguntas e respostas em JSON, YAML ou Markdown (vazio = sem FAQ)
+    KB_MIN_SCORE = float(os.environ.get("KB_MIN_SCORE", 0.3))  # Confiança mínima (0 a 1) para responder com uma entrada do FAQ
+    KB_RELOAD_SECONDS = float(os.environ.get("KB_RELOAD_SECONDS", 5))  # Intervalo de verificação do arquivo para recarga a quente (0 = não recarrega)
+
+    # Vários processos com afinidade de conversa (SERVER_MODE=sharded, ver sharded_server.py)
+    SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", os.cpu_count() or 1))  # Processos do bot; todos os turnos de uma conversa vão sempre para o mesmo
+    SHARD_SOCKET = os.environ.get("SHARD_SOCKET", "")  # Definido pelo processo de frente: o worker escuta neste socket unix em vez da PORT
+    SHARD_SOCKET_DIR = os.environ.get("SHARD_SOCKET_DIR", "")  # Pasta dos sockets dos workers (vazio = pasta temporária)
+    SHARD_STATE_PATH = os.environ.get("SHARD_STATE_PATH", "state_shards.sqlite")  # Camada fria comum dos workers com STATE_STORAGE=memory sem STATE_MEMORY_COLD_PATH; leva as conversas de um worker a outro no rebalanceamento
+    SHARD_VNODES = int(os.environ.get("SHARD_VNODES", 128))  # Pontos de cada worker no anel de hash consistente
+    SHARD_HOLD_SECONDS = float(os.environ.get("SHARD_HOLD_SECONDS", 30))  # Espera máxima de uma requisição enquanto o worker da conversa reinicia
+    SHARD_START_TIMEOUT_SECONDS = float(os.environ.get("SHARD_START_TIMEOUT_SECONDS", 60))  # Prazo para um worker novo abrir o socket
+    SHARD_DRAIN_SECONDS = float(os.environ.get("SHARD_DRAIN_SECONDS", 30))  # Prazo para um worker concluir a fila e gravar o estado antes do SIGKILL
+
+    # Limites de uso do /api/messages e da cota do CLU (ver rate_limit.py)
+    RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"  # false = sem controle de admissão
+    RATE_LIMIT_USER_PER_SECOND = float(os.environ.get("RATE_LIMIT_USER_PER_SECOND", 2))  # Mensagens por segundo de cada remetente (canal + from.id), em média, por processo (0 = sem limite)
+    RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", 20))  # ... e a rajada máxima acima dessa média
+    RATE_LIMIT_CONVERSATION_PER_SECOND = float(os.environ.get("RATE_LIMIT_CONVERSATION_PER_SECOND", 2))  # Mensagens por segundo de cada conversation.id (0 = sem limite)
+    RATE_LIMIT_CONVERSATION_BURST = float(os.environ.get("RATE_LIMIT_CONVERSATION_BURST", 20))  # ... e a rajada máxima
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))  # Baldes guardados por tipo (mínimo 1); acima disso os menos recentes são descartados
+    RATE_LIMIT_MAX_CONCURRENT_TURNS = int(os.environ.get("RATE_LIMIT_MAX_CONCURRENT_TURNS", 256))  # Turnos em processamento no processo; acima disso 429 (0 = sem teto). No modo sharded é o total, dividido entre os SHARD_WORKERS
+    RATE_LIMIT_CLU_PER_SECOND = float(os.environ.get("RATE_LIMIT_CLU_PER_SECOND", 0))  # Chamadas ao CLU por segundo no processo; sem cota, o bot usa o classificador local (0 = sem limite). No modo sharded é o total, dividido entre os SHARD_WORKERS
+    RATE_LIMIT_CLU_BURST = float(os.environ.get("RATE_LIMIT_CLU_BURST", 20))  # ... e a rajada máxima (também dividida no modo sharded)
+    RATE_LIMIT_ACTION = os.environ.get("RATE_LIMIT_ACTION", "reply")  # "reply": avisa o remetente uma vez por rajada e responde 429 ao resto; "429": sempre 429
+    RATE_LIMIT_REPLY = os.environ.get("RATE_LIMIT_REPLY", "Você está enviando mensagens muito rápido. Aguarde alguns segundos e tente de novo.")  # Aviso enviado com RATE_LIMIT_ACTION=reply
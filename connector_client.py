@@ -0,0 +1,272 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from urllib.parse import quote
+
+import aiohttp
+from botbuilder.schema import Activity, ResourceResponse
+
+from log_utils import get_logger
+
+LOGGER = get_logger("connector")
+
+
+class TokenCache:
+    """
+    Token de aplicativo (client credentials) do bot para falar com o Bot Connector.
+    Guardado até `refresh_margin` segundos antes de expirar; quando vários turnos precisam
+    renovar ao mesmo tempo, só uma requisição vai ao endpoint de token (single-flight).
+    """
+
+    def __init__(self, app_id: str, app_password: str, token_url: str, scope: str, refresh_margin: float = 300):
+        self.app_id = app_id
+        self.app_password = app_password
+        self.token_url = token_url
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refreshing: Optional[asyncio.Future] = None
+        self.fetches = 0
+
+    def invalidate(self):
+        self._token = None
+        self._expires_at = 0.0
+
+    async def get_token(self, session: aiohttp.ClientSession) -> str:
+        if self._token and time.monotonic() < self._expires_at - self.refresh_margin:
+            return self._token
+        if self._refreshing is not None:
+            return await asyncio.shield(self._refreshing)
+
+        self._refreshing = asyncio.get_running_loop().create_future()
+        try:
+            token = await self._fetch(session)
+            self._refreshing.set_result(token)
+            return token
+        except BaseException as e:
+            self._refreshing.set_exception(e)
+            self._refreshing.exception()  # Marca como lida se ninguém mais estiver aguardando
+            raise
+        finally:
+            self._refreshing = None
+
+    async def _fetch(self, session: aiohttp.ClientSession) -> str:
+        self.fetches += 1
+        form = {
+            "grant_type": "client_credentials",
+            "client_id": self.app_id,
+            "client_secret": self.app_password,
+            "scope": self.scope,
+        }
+        async with session.post(self.token_url, data=form) as response:
+            response.raise_for_status()
+            data = await response.json()
+        self._token = data["access_token"]
+        expires_in = float(data.get("expires_in", 3600))
+        self._expires_at = time.monotonic() + expires_in
+        LOGGER.info("Token do Bot Connector renovado (expira em %.0fs).", expires_in)
+        return self._token
+
+
+class OutboundConnector:
+    """
+    Envio das respostas do bot ao Bot Connector por uma única sessão aiohttp por loop de eventos:
+    conexões keep-alive reaproveitadas por serviceUrl (limite por host) e token em cache.
+
+    As atividades de um mesmo send_activities vão em sequência pela mesma conexão já aberta
+    (o canal exige a ordem; o protocolo do Bot Connector não tem envio em lote).
+    """
+
+    def __init__(self, token_cache: Optional[TokenCache] = None, pool_size: int = 32,
+                 keepalive_seconds: float = 60, timeout_seconds: float = 10):
+        self.token_cache = token_cache
+        self.pool_size = pool_size
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout_seconds = timeout_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session_loop is not loop or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size,
+                                             keepalive_timeout=self.keepalive_seconds)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def _headers(self, session: aiohttp.ClientSession) -> Dict[str, str]:
+        if self.token_cache is None:
+            return {}
+        return {"Authorization": f"Bearer {await self.token_cache.get_token(session)}"}
+
+    async def send(self, service_url: str, activity: Activity) -> ResourceResponse:
+        """POST de uma atividade (nova mensagem ou resposta a reply_to_id) na conversa da própria atividade."""
+        conversation_id = quote(activity.conversation.id, safe="")
+        url = f"{service_url.rstrip('/')}/v3/conversations/{conversation_id}/activities"
+        if activity.reply_to_id:
+            url += f"/{quote(activity.reply_to_id, safe='')}"
+        body = activity.serialize()
+
+        session = self._get_session()
+        for attempt in range(2):
+            try:
+                async with session.post(url, json=body, headers=await self._headers(session)) as response:
+                    if response.status == 401 and self.token_cache is not None and attempt == 0:
+                        self.token_cache.invalidate()  # Token revogado/expirado antes do previsto: renova uma vez
+                        continue
+                    response.raise_for_status()
+                    data = await response.json(content_type=None) if response.content_length != 0 else None
+                    return ResourceResponse(id=(data or {}).get("id") or activity.id or "")
+            except aiohttp.ServerDisconnectedError:
+                # Conexão keep-alive fechada pelo servidor enquanto estava ociosa: tenta de novo em outra
+                if attempt == 1:
+                    raise
+        raise RuntimeError("Falha ao enviar a atividade ao Bot Connector.")
+
+    async def warmup(self, service_urls=()):
+        """
+        Abre a sessão, uma conexão keep-alive com cada serviceUrl e busca o token do app antes do
+        primeiro turno (ver startup.py). O status das respostas não importa, só a conexão aberta.
+        """
+        session = self._get_session()
+
+        async def connect(url: str):
+            async with session.get(url) as response:
+                await response.read()
+
+        calls = [connect(url) for url in service_urls]
+        if self.token_cache is not None:
+            calls.append(self.token_cache.get_token(session))
+        await asyncio.gather(*calls)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+def create_outbound_connector(config) -> Optional[OutboundConnector]:
+    """Cria o cliente de saída conforme o DefaultConfig (None se CONNECTOR_POOL_ENABLED estiver desligado)."""
+    if not config.CONNECTOR_POOL_ENABLED:
+        return None
+    token_cache = None
+    if config.APP_ID and config.APP_PASSWORD:
+        token_cache = TokenCache(
+            config.APP_ID, config.APP_PASSWORD, config.CONNECTOR_TOKEN_URL, config.CONNECTOR_TOKEN_SCOPE,
+            config.CONNECTOR_TOKEN_REFRESH_MARGIN_SECONDS,
+        )
+    return OutboundConnector(token_cache, config.CONNECTOR_POOL_SIZE, config.CONNECTOR_KEEPALIVE_SECONDS,
+                             config.CONNECTOR_TIMEOUT_SECONDS)
+
+
+# Latência de saída por turno (3 respostas por turno) contra um Bot Connector e um endpoint
+# de token falsos, locais: cliente do SDK versus OutboundConnector, e token em cache versus
+# um token buscado a cada turno. Uso: python connector_client.py [turnos] [concorrencia] [latencia_token_ms]
+if __name__ == "__main__":
+    import sys
+    import uuid
+
+    from aiohttp import web
+    from botbuilder.schema import ActivityTypes, ConversationAccount
+    from botframework.connector.aio import ConnectorClient
+    from botframework.connector.auth import MicrosoftAppCredentials
+
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    token_latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.05
+    replies_per_turn = 3
+
+    async def _fake_services():
+        stats = {"token_requests": 0}
+
+        async def activities(request):
+            await request.read()
+            return web.json_response({"id": uuid.uuid4().hex})
+
+        async def token(request):
+            stats["token_requests"] += 1
+            await asyncio.sleep(token_latency)
+            return web.json_response({"access_token": uuid.uuid4().hex, "expires_in": 3600})
+
+        app = web.Application()
+        app.router.add_post("/v3/conversations/{conversation_id}/activities", activities)
+        app.router.add_post("/token", token)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+        return runner, f"http://127.0.0.1:{port}", stats
+
+    def _reply(conversation_id: str) -> Activity:
+        return Activity(type=ActivityTypes.message, text="Resposta do Tralhobot",
+                        conversation=ConversationAccount(id=conversation_id))
+
+    async def _measure(send_turn):
+        semaphore = asyncio.Semaphore(concurrency)
+        durations = []
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await send_turn(f"conv-{i % 50}")
+                durations.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one(i) for i in range(turns)))
+        durations.sort()
+        return sum(durations) / len(durations) * 1000, durations[int(len(durations) * 0.99)] * 1000
+
+    async def _main():
+        runner, base_url, stats = await _fake_services()
+        results = []
+
+        sdk_client = ConnectorClient(MicrosoftAppCredentials.empty(), base_url=base_url)
+
+        async def sdk_turn(conversation_id):
+            for _ in range(replies_per_turn):
+                await sdk_client.conversations.send_to_conversation(conversation_id, _reply(conversation_id))
+
+        results.append(("SDK (ConnectorClient, sem token)", *(await _measure(sdk_turn)), "-"))
+
+        pooled = OutboundConnector()
+
+        async def pooled_turn(conversation_id):
+            for _ in range(replies_per_turn):
+                await pooled.send(base_url, _reply(conversation_id))
+
+        results.append(("OutboundConnector, sem token", *(await _measure(pooled_turn)), "-"))
+
+        # Sem cache: um token novo por turno (o que acontece quando nada guarda o token entre turnos)
+        async def token_per_turn(conversation_id):
+            uncached = OutboundConnector(TokenCache("app", "senha", base_url + "/token", "escopo"))
+            uncached._session, uncached._session_loop = pooled._get_session(), asyncio.get_running_loop()  # pylint: disable=protected-access
+            for _ in range(replies_per_turn):
+                await uncached.send(base_url, _reply(conversation_id))
+
+        stats["token_requests"] = 0
+        mean, p99 = await _measure(token_per_turn)
+        results.append(("OutboundConnector, token por turno", mean, p99, stats["token_requests"]))
+
+        cached = OutboundConnector(TokenCache("app", "senha", base_url + "/token", "escopo"))
+
+        async def cached_turn(conversation_id):
+            for _ in range(replies_per_turn):
+                await cached.send(base_url, _reply(conversation_id))
+
+        stats["token_requests"] = 0
+        mean, p99 = await _measure(cached_turn)
+        results.append(("OutboundConnector, token em cache", mean, p99, stats["token_requests"]))
+
+        await pooled.close()
+        await cached.close()
+        await runner.cleanup()
+
+        print(f"{turns} turnos x {replies_per_turn} respostas, concorrência {concurrency}, token em {token_latency * 1000:.0f} ms")
+        print(f"{'cliente':<36} {'média ms/turno':>15} {'p99 ms/turno':>13} {'pedidos de token':>17}")
+        for name, mean, p99, token_requests in results:
+            print(f"{name:<36} {mean:>15.1f} {p99:>13.1f} {token_requests:>17}")
+
+    asyncio.run(_main())
@@ -1,69 +1,326 @@
+import heapq
+import os
+import queue
 import smtplib
+import threading
+import time
+import uuid
+from email import message_from_string
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from config import DefaultConfig
+from log_utils import get_logger
 
 CONFIG = DefaultConfig()
+LOGGER = get_logger("email")
+
+def _email_configured() -> bool:
+    if not CONFIG.EMAIL_FROM_ADDRESS or not CONFIG.EMAIL_PASSWORD or not CONFIG.EMAIL_TO_ADDRESS:
+        LOGGER.error("As configurações de e-mail (EMAIL_FROM_ADDRESS, EMAIL_PASSWORD, EMAIL_TO_ADDRESS) não estão preenchidas no config.py.")
+        return False
+    return True
+
+def build_log_message(conversation_log: str, sdr_data: dict) -> MIMEMultipart:
+    """
+    Builds the email with the conversation log and SDR data for the stakeholders.
+    """
+    msg = MIMEMultipart()
+    msg["From"] = CONFIG.EMAIL_FROM_ADDRESS
+    msg["To"] = CONFIG.EMAIL_TO_ADDRESS
+
+    # Define o assunto do e-mail com base na qualificação
+    subject = f"Log de Conversa Tralhobot - Contato {'Qualificado' if sdr_data.get('qualified') else 'Não Qualificado'}"
+    msg["Subject"] = subject
+
+    body = (
+        f"Prezados(as) Stakeholders,\n\n"
+        f"Uma nova interação com o Tralhobot foi concluída. Abaixo estão os detalhes da conversa e os dados coletados:\n\n"
+        f"--- Dados do Contato ---\n"
+        f"Nome: {sdr_data.get('name', 'N/A')}\n"
+        f"Cargo: {sdr_data.get('role', 'N/A')}\n"
+        f"Empresa: {sdr_data.get('company', 'N/A')}\n"
+        f"Necessidades: {sdr_data.get('needs', 'N/A')}\n"
+        f"Porte da Empresa: {sdr_data.get('size', 'N/A')}\n"
+        f"Email de Contato: {sdr_data.get('email', 'N/A')}\n"
+        f"Qualificado para SDR: {'Sim' if sdr_data.get('qualified') else 'Não'}\n\n"
+        f"--- Log da Conversa ---\n"
+        f"{conversation_log}\n"
+        f"-----------------------\n\n"
+        f"Atenciosamente,\n"
+        f"Tralhobot Automatizado"
+    )
+    msg.attach(MIMEText(body, "plain"))
+    return msg
+
+def _open_smtp_session() -> smtplib.SMTP:
+    """Abre uma sessão SMTP autenticada (SSL na porta 465, STARTTLS obrigatório nas demais)."""
+    if CONFIG.EMAIL_SMTP_PORT == 465:
+        server = smtplib.SMTP_SSL(CONFIG.EMAIL_SMTP_SERVER, CONFIG.EMAIL_SMTP_PORT, timeout=30)
+    else:
+        server = smtplib.SMTP(CONFIG.EMAIL_SMTP_SERVER, CONFIG.EMAIL_SMTP_PORT, timeout=30)
+    try:
+        if CONFIG.EMAIL_SMTP_PORT != 465 and CONFIG.EMAIL_SMTP_STARTTLS:
+            # Sem fallback para texto puro: se o servidor não oferecer STARTTLS, starttls() levanta
+            # SMTPNotSupportedError e a senha não é enviada
+            server.starttls()  # Inicia TLS para conexão segura
+        server.ehlo()  # Também na porta 465: sem EHLO a lista de extensões do servidor fica vazia
+        # Só o SMTP local de testes (EMAIL_SMTP_STARTTLS=false) pode dispensar o AUTH que não oferece
+        if CONFIG.EMAIL_PASSWORD and (CONFIG.EMAIL_SMTP_STARTTLS or server.has_extn("auth")):
+            server.login(CONFIG.EMAIL_FROM_ADDRESS, CONFIG.EMAIL_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
 
 def send_log_to_stakeholders(conversation_log: str, sdr_data: dict) -> bool:
     """
-    Sends the conversation log and SDR data to stakeholders via email.
+    Sends the conversation log and SDR data to stakeholders via email, synchronously,
+    opening a new SMTP connection. Prefer enqueue_log_to_stakeholders() from turn handlers.
     Returns True if successful, False otherwise.
     """
-    if not CONFIG.EMAIL_FROM_ADDRESS or not CONFIG.EMAIL_PASSWORD or not CONFIG.EMAIL_TO_ADDRESS:
-        print("Erro: As configurações de e-mail (EMAIL_FROM_ADDRESS, EMAIL_PASSWORD, EMAIL_TO_ADDRESS) não estão preenchidas no config.py.")
+    if not _email_configured():
         return False
 
     try:
-        msg = MIMEMultipart()
-        msg["From"] = CONFIG.EMAIL_FROM_ADDRESS
-        msg["To"] = CONFIG.EMAIL_TO_ADDRESS
-        
-        # Define o assunto do e-mail com base na qualificação
-        subject = f"Log de Conversa Tralhobot - Contato {'Qualificado' if sdr_data.get('qualified') else 'Não Qualificado'}"
-        msg["Subject"] = subject
-
-        body = (
-            f"Prezados(as) Stakeholders,\n\n"
-            f"Uma nova interação com o Tralhobot foi concluída. Abaixo estão os detalhes da conversa e os dados coletados:\n\n"
-            f"--- Dados do Contato ---\n"
-            f"Nome: {sdr_data.get('name', 'N/A')}\n"
-            f"Cargo: {sdr_data.get('role', 'N/A')}\n"
-            f"Empresa: {sdr_data.get('company', 'N/A')}\n"
-            f"Necessidades: {sdr_data.get('needs', 'N/A')}\n"
-            f"Porte da Empresa: {sdr_data.get('size', 'N/A')}\n"
-            f"Email de Contato: {sdr_data.get('email', 'N/A')}\n"
-            f"Qualificado para SDR: {'Sim' if sdr_data.get('qualified') else 'Não'}\n\n"
-            f"--- Log da Conversa ---\n"
-            f"{conversation_log}\n"
-            f"-----------------------\n\n"
-            f"Atenciosamente,\n"
-            f"Tralhobot Automatizado"
-        )
-        msg.attach(MIMEText(body, "plain"))
-
-        with smtplib.SMTP(CONFIG.EMAIL_SMTP_SERVER, CONFIG.EMAIL_SMTP_PORT) as server:
-            server.starttls()  # Inicia TLS para conexão segura
-            server.login(CONFIG.EMAIL_FROM_ADDRESS, CONFIG.EMAIL_PASSWORD)
+        msg = build_log_message(conversation_log, sdr_data)
+        server = _open_smtp_session()
+        try:
             server.send_message(msg)
-        print("E-mail de log enviado com sucesso!")
+        finally:
+            server.quit()
+        LOGGER.info("E-mail de log enviado com sucesso!")
         return True
     except Exception as e:
-        print(f"Erro ao enviar e-mail de log: {e}")
+        LOGGER.error("Erro ao enviar e-mail de log: %s", e)
+        return False
+
+
+def is_permanent_failure(error: BaseException) -> bool:
+    """Recusas que não mudam com uma nova tentativa: destinatários recusados e respostas 5xx (inclusive AUTH)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class EmailOutbox:
+    """
+    Fila de saída de e-mails processada por uma thread em segundo plano.
+
+    - Cada mensagem é gravada na pasta de spool antes de entrar na fila, então as
+      mensagens não enviadas sobrevivem a um restart (são recarregadas em start()).
+    - A thread mantém uma única sessão SMTP autenticada e envia várias mensagens
+      seguidas por ela; a sessão é fechada após um período ocioso.
+    - Uma falha temporária não segura a fila: a mensagem é reagendada com backoff exponencial
+      (até retry_base_seconds * 2 ** (max_retries - 1)) e as demais continuam saindo. Ela
+      continua sendo tentada nesse intervalo máximo enquanto o processo estiver rodando.
+    - Falhas permanentes (5xx, destinatários recusados) movem o arquivo para a subpasta failed/.
+    """
+
+    def __init__(self, spool_dir: str, batch_size: int = 20, max_retries: int = 5,
+                 retry_base_seconds: float = 2.0, idle_seconds: float = 60.0):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.idle_seconds = idle_seconds
+        self.sent_count = 0
+        self.failed_count = 0
+        self.retry_count = 0
+        self._queue = queue.Queue()
+        self._retry = []  # heap de (próxima tentativa em, arquivo); só a thread de envio mexe nele
+        self._attempts = {}  # arquivo -> falhas seguidas
+        self._session = None
+        self._last_used = time.monotonic()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Inicia a thread de envio (uma única vez) e recarrega as mensagens pendentes do spool."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for file_name in sorted(os.listdir(self.spool_dir)):
+                if file_name.endswith(".eml"):
+                    self._queue.put(file_name)
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, msg) -> str:
+        """Grava a mensagem no spool e a coloca na fila. Não faz I/O de rede; retorna o id da mensagem."""
+        self.start()
+        file_name = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.eml"
+        path = os.path.join(self.spool_dir, file_name)
+        with open(path + ".tmp", "w", encoding="utf-8") as spool_file:
+            spool_file.write(msg.as_string())
+        os.replace(path + ".tmp", path)  # Escrita atômica: o arquivo .eml nunca fica pela metade
+        self._queue.put(file_name)
+        return file_name
+
+    def pending(self) -> int:
+        """Mensagens na fila ou aguardando uma nova tentativa."""
+        return self._queue.qsize() + len(self._retry)
+
+    def join(self, timeout: float = None) -> bool:
+        """Aguarda todas as mensagens serem enviadas ou movidas para failed/. Retorna True se terminou."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _next_batch(self) -> list:
+        """Até batch_size mensagens: as reagendadas que já venceram e as que estão na fila."""
+        timeout = self.idle_seconds
+        if self._retry:
+            timeout = min(timeout, max(0.0, self._retry[0][0] - time.monotonic()))
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        while self._retry and self._retry[0][0] <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self._retry)[1])
+        # Junta o que mais já estiver na fila para enviar tudo pela mesma conexão
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if time.monotonic() - self._last_used >= self.idle_seconds:
+                    self._close_session()  # Nada para enviar: libera a conexão ociosa
+                continue
+
+            for index, file_name in enumerate(batch):
+                if self._session is None:
+                    try:
+                        self._session = _open_smtp_session()
+                    except Exception as e:
+                        # Sem conexão, o resto do lote não sai: é reagendado (ou recusado) de uma vez
+                        for remaining in batch[index:]:
+                            self._finish_if(self._failed(remaining, e))
+                        break
+                self._finish_if(self._deliver(file_name))
+            self._last_used = time.monotonic()
+
+    def _finish_if(self, finished: bool):
+        # A mensagem só conta como concluída para o join() quando sai de vez da fila
+        if finished:
+            self._queue.task_done()
+
+    def _deliver(self, file_name: str) -> bool:
+        """Envia pela sessão aberta. True se a mensagem saiu da fila (enviada, já enviada ou recusada)."""
+        path = os.path.join(self.spool_dir, file_name)
+        try:
+            with open(path, encoding="utf-8") as spool_file:
+                msg = message_from_string(spool_file.read())
+        except FileNotFoundError:
+            self._attempts.pop(file_name, None)
+            return True  # Já enviado por outra instância do outbox
+
+        try:
+            self._session.send_message(msg)
+        except Exception as e:
+            self._close_session()
+            return self._failed(file_name, e)
+        os.remove(path)
+        self._attempts.pop(file_name, None)
+        self.sent_count += 1
+        return True
+
+    def _failed(self, file_name: str, error: Exception) -> bool:
+        """Move a mensagem para failed/ (falha permanente, retorna True) ou a reagenda (retorna False)."""
+        if is_permanent_failure(error):
+            self._attempts.pop(file_name, None)
+            self.failed_count += 1
+            failed_dir = os.path.join(self.spool_dir, "failed")
+            try:
+                os.makedirs(failed_dir, exist_ok=True)
+                os.replace(os.path.join(self.spool_dir, file_name), os.path.join(failed_dir, file_name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                LOGGER.error("Outbox: não foi possível mover '%s' para %s: %s", file_name, failed_dir, e)
+            LOGGER.error("Outbox: '%s' recusado pelo servidor (%s). Movido para %s.", file_name, error, failed_dir)
+            return True
+
+        attempt = self._attempts.get(file_name, 0) + 1
+        self._attempts[file_name] = attempt
+        self.retry_count += 1
+        delay = self.retry_base_seconds * (2 ** (min(attempt, max(self.max_retries, 1)) - 1))
+        heapq.heappush(self._retry, (time.monotonic() + delay, file_name))
+        if attempt == self.max_retries:
+            LOGGER.error("Outbox: '%s' falhou %d vezes seguidas (%s). Novas tentativas a cada %.1fs.", file_name, attempt, error, delay)
+        elif attempt < self.max_retries:
+            LOGGER.warning("Outbox: falha ao enviar '%s' (tentativa %d): %s. Nova tentativa em %.1fs.", file_name, attempt, error, delay)
+        return False
+
+    def _close_session(self):
+        if self._session is not None:
+            try:
+                self._session.quit()
+            except Exception:
+                pass
+            self._session = None
+
+
+OUTBOX = EmailOutbox(
+    CONFIG.EMAIL_OUTBOX_DIR,
+    CONFIG.EMAIL_BATCH_SIZE,
+    CONFIG.EMAIL_MAX_RETRIES,
+    CONFIG.EMAIL_RETRY_BASE_SECONDS,
+    CONFIG.EMAIL_SMTP_IDLE_SECONDS,
+)
+
+def enqueue_log_to_stakeholders(conversation_log: str, sdr_data: dict) -> bool:
+    """
+    Queues the conversation log and SDR data for background delivery to stakeholders.
+    Safe to call from a turn handler: returns immediately after spooling the message.
+    """
+    if not _email_configured():
         return False
+    OUTBOX.enqueue(build_log_message(conversation_log, sdr_data))
+    return True
+
+# Benchmark: e-mails/s com uma conexão por e-mail versus o outbox (sessão reaproveitada).
+# Use um servidor SMTP local, ex: python -m aiosmtpd -n -l localhost:8025
+# e rode: EMAIL_SMTP_SERVER=localhost EMAIL_SMTP_PORT=8025 EMAIL_SMTP_STARTTLS=false python email_utils.py 200
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    test_log = "User: Olá!\nBot: Bem-vindo!\nUser: Quero agendar uma reunião.\nBot: Ok, me diga seu nome."
+    test_sdr_data = {
+        "name": "João Teste",
+        "role": "Analista",
+        "company": "Empresa Teste",
+        "needs": "Automatização",
+        "size": "Pequena",
+        "qualified": True,
+        "email": "teste@exemplo.com"
+    }
+
+    start = time.perf_counter()
+    for _ in range(total):
+        send_log_to_stakeholders(test_log, test_sdr_data)
+    direct_elapsed = time.perf_counter() - start
+
+    OUTBOX.spool_dir = tempfile.mkdtemp(prefix="email_outbox_")
+    start = time.perf_counter()
+    for _ in range(total):
+        enqueue_log_to_stakeholders(test_log, test_sdr_data)
+    OUTBOX.join()
+    outbox_elapsed = time.perf_counter() - start
 
-# Você pode descomentar o bloco abaixo para testar o envio de e-mail separadamente
-# if __name__ == "__main__":
-#     # Preencha as configurações de e-mail no config.py antes de testar
-#     test_log = "User: Olá!\nBot: Bem-vindo!\nUser: Quero agendar uma reunião.\nBot: Ok, me diga seu nome."
-#     test_sdr_data = {
-#         "name": "João Teste",
-#         "role": "Analista",
-#         "company": "Empresa Teste",
-#         "needs": "Automatização",
-#         "size": "Pequena",
-#         "qualified": True,
-#         "email": "teste@exemplo.com"
-#     }
-#     send_log_to_stakeholders(test_log, test_sdr_data)
\ No newline at end of file
+    print(f"Conexão por e-mail: {total / direct_elapsed:.0f} e-mails/s")
+    print(f"Outbox (sessão reaproveitada): {total / outbox_elapsed:.0f} e-mails/s ({OUTBOX.sent_count} enviados, {OUTBOX.failed_count} falhas)")
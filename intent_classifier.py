@@ -0,0 +1,176 @@
+import json
+import math
+import os
+import random
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from log_utils import get_logger
+from nlu_cache import normalize_utterance
+
+LOGGER = get_logger("intent")
+
+
+def _char_ngrams(text: str, sizes=(2, 3, 4)) -> Counter:
+    """N-gramas de caracteres por palavra, com bordas marcadas ("oi" -> "<o", "oi", "i>", "<oi", ...)."""
+    grams = Counter()
+    for word in normalize_utterance(text).split():
+        padded = f"<{word}>"
+        for size in sizes:
+            for i in range(len(padded) - size + 1):
+                grams[padded[i:i + size]] += 1
+    return grams
+
+
+def _normalize_vector(vector: Dict[str, float]) -> Dict[str, float]:
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    return {key: value / norm for key, value in vector.items()} if norm else vector
+
+
+def load_utterances(path: str) -> List[Tuple[str, str]]:
+    """
+    Lê frases rotuladas de um arquivo JSON: o export de um projeto CLU
+    ({"assets": {"utterances": [...]}}) ou uma lista simples de {"text", "intent"}.
+    """
+    with open(path, encoding="utf-8") as data_file:
+        data = json.load(data_file)
+    if isinstance(data, dict):
+        data = data.get("assets", {}).get("utterances", [])
+    return [(item["text"], item["intent"]) for item in data if item.get("text") and item.get("intent")]
+
+
+class IntentClassifier:
+    """
+    Classificador local de intenções: TF-IDF de n-gramas de caracteres e similaridade
+    de cosseno com o centróide de cada intenção, em Python puro.
+
+    predict() devolve um dicionário no mesmo formato da predição do CLU
+    ("topIntent", "intents" com "confidenceScore"), então o bot trata as duas fontes igual.
+    """
+
+    def __init__(self, idf: Dict[str, float], centroids: Dict[str, Dict[str, float]], temperature: float = 0.1):
+        self.idf = idf
+        self.centroids = centroids
+        self.temperature = temperature
+
+    @classmethod
+    def train(cls, utterances: List[Tuple[str, str]], temperature: float = 0.1) -> "IntentClassifier":
+        documents = [(_char_ngrams(text), intent) for text, intent in utterances]
+        document_frequency = Counter(gram for grams, _ in documents for gram in grams)
+        total = len(documents)
+        idf = {gram: math.log((1 + total) / (1 + count)) + 1 for gram, count in document_frequency.items()}
+
+        sums = defaultdict(lambda: defaultdict(float))
+        for grams, intent in documents:
+            vector = _normalize_vector({gram: count * idf[gram] for gram, count in grams.items()})
+            for gram, value in vector.items():
+                sums[intent][gram] += value
+        centroids = {intent: _normalize_vector(dict(vector)) for intent, vector in sums.items()}
+        return cls(idf, centroids, temperature)
+
+    def _vectorize(self, text: str) -> Dict[str, float]:
+        grams = _char_ngrams(text)
+        return _normalize_vector({gram: count * self.idf[gram] for gram, count in grams.items() if gram in self.idf})
+
+    def predict(self, text: str) -> Dict:
+        vector = self._vectorize(text)
+        similarities = {
+            intent: sum(value * centroid.get(gram, 0.0) for gram, value in vector.items())
+            for intent, centroid in self.centroids.items()
+        }
+        # Softmax das similaridades: confiança alta só quando uma intenção se destaca das demais
+        top_similarity = max(similarities.values(), default=0.0)
+        weights = {intent: math.exp((similarity - top_similarity) / self.temperature) for intent, similarity in similarities.items()}
+        total = sum(weights.values()) or 1.0
+        intents = sorted(
+            ({"category": intent, "confidenceScore": weight / total} for intent, weight in weights.items()),
+            key=lambda item: item["confidenceScore"],
+            reverse=True,
+        )
+        if not vector:
+            intents = [{"category": "None", "confidenceScore": 0.0}]
+        return {"topIntent": intents[0]["category"], "intents": intents, "entities": [], "source": "local"}
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as model_file:
+            json.dump({"temperature": self.temperature, "idf": self.idf, "centroids": self.centroids}, model_file)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with open(path, encoding="utf-8") as model_file:
+            data = json.load(model_file)
+        return cls(data["idf"], data["centroids"], data.get("temperature", 0.1))
+
+
+def load_intent_classifier(config) -> Optional[IntentClassifier]:
+    """
+    Carrega o modelo treinado (INTENT_MODEL_PATH) ou, se não existir, treina na hora
+    a partir das frases de INTENT_TRAINING_PATH. Retorna None se nenhum dos dois existir.
+    """
+    try:
+        if config.INTENT_MODEL_PATH and os.path.exists(config.INTENT_MODEL_PATH):
+            classifier = IntentClassifier.load(config.INTENT_MODEL_PATH)
+        elif config.INTENT_TRAINING_PATH and os.path.exists(config.INTENT_TRAINING_PATH):
+            classifier = IntentClassifier.train(load_utterances(config.INTENT_TRAINING_PATH))
+        else:
+            LOGGER.warning("Nenhum modelo/frases para o classificador local de intenções. Apenas o CLU será usado.")
+            return None
+        LOGGER.info("Classificador local de intenções carregado (%d intenções).", len(classifier.centroids))
+        return classifier
+    except Exception as e:
+        LOGGER.error("Falha ao carregar o classificador local de intenções: %s", e)
+        return None
+
+
+def evaluate(utterances: List[Tuple[str, str]], threshold: float, folds: int = 5, seed: int = 42) -> Dict:
+    """
+    Validação cruzada contra os rótulos do CLU. Reporta a acurácia geral, a parcela de
+    chamadas ao CLU evitadas (confiança >= threshold) e a acurácia nessas respostas locais.
+    """
+    shuffled = list(utterances)
+    random.Random(seed).shuffle(shuffled)
+    correct = answered = answered_correct = 0
+    for fold in range(folds):
+        test = shuffled[fold::folds]
+        train = [item for i, item in enumerate(shuffled) if i % folds != fold]
+        classifier = IntentClassifier.train(train)
+        for text, intent in test:
+            prediction = classifier.predict(text)
+            hit = prediction["topIntent"] == intent
+            correct += hit
+            if prediction["intents"][0]["confidenceScore"] >= threshold:
+                answered += 1
+                answered_correct += hit
+    total = len(shuffled)
+    return {
+        "utterances": total,
+        "accuracy": correct / total if total else 0.0,
+        "clu_calls_avoided": answered / total if total else 0.0,
+        "accuracy_when_local": answered_correct / answered if answered else 0.0,
+    }
+
+
+# Uso:
+#   python intent_classifier.py train <export_clu.json> <modelo.json>
+#   python intent_classifier.py eval <export_clu.json> [--threshold 0.7]
+if __name__ == "__main__":
+    import argparse
+
+    from config import DefaultConfig
+
+    parser = argparse.ArgumentParser(description="Treino e avaliação do classificador local de intenções.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="Treina com o export do projeto CLU e salva o modelo.")
+    train_parser.add_argument("data", help="Export do projeto CLU (JSON)")
+    train_parser.add_argument("model", help="Arquivo do modelo a gravar (JSON)")
+    eval_parser = commands.add_parser("eval", help="Validação cruzada contra os rótulos do CLU.")
+    eval_parser.add_argument("data", help="Export do projeto CLU (JSON)")
+    eval_parser.add_argument("--threshold", type=float, default=DefaultConfig.INTENT_LOCAL_THRESHOLD,
+                             help="Confiança mínima para responder sem o CLU (padrão: INTENT_LOCAL_THRESHOLD)")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        IntentClassifier.train(load_utterances(args.data)).save(args.model)
+        print(f"Modelo salvo em {args.model}")
+    else:
+        print(json.dumps(evaluate(load_utterances(args.data), args.threshold), indent=2))
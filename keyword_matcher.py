@@ -0,0 +1,114 @@
+import re
+import unicodedata
+from typing import Any, List, Mapping, NamedTuple, Optional
+
+
+def fold_text(text: str) -> str:
+    """Normaliza para comparação: minúsculas e sem acentos ("Preço" -> "preco")."""
+    text = text or ""
+    if text.isascii():
+        return text.casefold()
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def _trie_pattern(keywords: List[str]) -> str:
+    """
+    Monta a alternância como uma árvore de prefixos ("pre(?:co|sente)" em vez de
+    "preco|presente"), para o motor de regex não testar cada palavra-chave do zero.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node) -> str:
+        ends_here = "" in node
+        branches = []
+        for char in sorted(key for key in node if key):
+            atom = r"\s+" if char == " " else re.escape(char)
+            branches.append(atom + build(node[char]))
+        if not branches:
+            return ""
+        if len(branches) == 1 and not ends_here:
+            return branches[0]
+        # Se uma palavra-chave termina aqui, o restante é opcional (o mais longo é tentado primeiro)
+        return "(?:" + "|".join(branches) + (")?" if ends_here else ")")
+
+    return build(trie)
+
+
+class KeywordMatch(NamedTuple):
+    keyword: str    # Palavra-chave como foi cadastrada
+    value: Any      # Valor associado (ex: a resposta do FAQ)
+    priority: int   # Posição da palavra-chave no cadastro (menor = mais prioritária)
+    start: int      # Posição do acerto no texto
+
+
+class KeywordMatcher:
+    """
+    Casador de palavras-chave compilado uma única vez em uma regex combinada.
+
+    - Ignora maiúsculas e acentos ("preco" casa com "preço").
+    - Exige fronteira de palavra no início da palavra-chave, mas aceita sufixos
+      ("preço" casa com "preços", "acesso" não casa com "reacesso").
+    - Frases ("não consigo") aceitam qualquer espaço em branco entre as palavras.
+    - A prioridade segue a ordem de cadastro, como na busca linear pelo dicionário.
+    """
+
+    def __init__(self, keywords: Mapping[str, Any]):
+        self._entries = {}
+        for priority, (keyword, value) in enumerate(keywords.items()):
+            # Mesma normalização de espaços que find_all() aplica ao acerto ("não  consigo" -> "não consigo")
+            self._entries.setdefault(" ".join(fold_text(keyword).split()), (priority, keyword, value))
+
+        # No mesmo ponto do texto vence a palavra-chave mais longa ("microsoft teams" antes de "microsoft")
+        if self._entries:
+            self._pattern = re.compile(rf"(?<!\w)({_trie_pattern(list(self._entries))})")
+        else:
+            self._pattern = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """Retorna todos os acertos no texto, do mais prioritário para o menos prioritário."""
+        if self._pattern is None:
+            return []
+        matches = {}
+        for hit in self._pattern.finditer(fold_text(text)):
+            key = re.sub(r"\s+", " ", hit.group(1))
+            if key not in matches:
+                priority, keyword, value = self._entries[key]
+                matches[key] = KeywordMatch(keyword, value, priority, hit.start())
+        return sorted(matches.values(), key=lambda match: match.priority)
+
+    def first(self, text: str) -> Optional[KeywordMatch]:
+        """Retorna o acerto mais prioritário, ou None."""
+        matches = self.find_all(text)
+        return matches[0] if matches else None
+
+
+# Microbenchmark: regex compilada versus busca linear com 'keyword in text.lower()'.
+# Uso: python keyword_matcher.py
+if __name__ == "__main__":
+    import timeit
+
+    assert KeywordMatcher({"não  consigo\tacessar ": 1}).first("Nao consigo acessar o Teams").value == 1
+
+    text = "Olá, gostaria de saber o preço da implementação do Microsoft Teams para minha empresa"
+    for size in (10, 100, 1000):
+        keywords = {f"palavra{i}": i for i in range(size - 1)}
+        keywords["microsoft teams"] = "hit"
+        matcher = KeywordMatcher(keywords)
+
+        def linear():
+            lowered = text.lower()
+            return [keyword for keyword in keywords if keyword in lowered]
+
+        runs = 2000
+        linear_us = timeit.timeit(linear, number=runs) / runs * 1e6
+        compiled_us = timeit.timeit(lambda: matcher.find_all(text), number=runs) / runs * 1e6
+        print(f"{size:>5} palavras-chave | linear: {linear_us:8.1f} us | compilado: {compiled_us:6.1f} us")
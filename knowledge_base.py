@@ -0,0 +1,414 @@
+"""
+Base de conhecimento do FAQ: perguntas e respostas lidas de um arquivo (KB_PATH, em JSON, YAML ou
+Markdown), indexadas em um índice invertido e ranqueadas por BM25.
+
+O texto passa pela mesma normalização do restante do bot (minúsculas, sem acentos; ver
+keyword_matcher.fold_text), perde as palavras vazias do português e é reduzido a um radical por um
+stemmer leve de sufixos, então "preços" e "preço" (ou "implementação", "implementações" e
+"implementar") caem no mesmo termo. As perguntas e palavras-chave de cada entrada pesam mais que a
+resposta. Os pesos BM25 de cada termo são calculados na montagem do índice, então uma busca é só a
+soma das listas de postagens dos termos da mensagem.
+
+A confiança de um resultado é o score dividido pelo máximo que a mensagem poderia obter (termos
+que não existem na base contam como o termo mais raro), e só resultados acima de KB_MIN_SCORE são
+respondidos. Com KB_RELOAD_SECONDS, uma thread observa o arquivo e, quando ele muda, monta um índice
+novo e troca a referência de uma vez: as buscas em andamento continuam no índice antigo.
+
+Formatos aceitos:
+- JSON/YAML: {"entries": [{"id": ..., "questions": [...], "keywords": [...], "answer": ...}]}
+- Markdown: cada "## Pergunta" abre uma entrada; uma linha "Palavras-chave: a, b" é opcional e o
+  restante do bloco é a resposta.
+
+Verificação com o data/faq.json e benchmark com 100, 1 mil e 10 mil entradas:  python knowledge_base.py
+"""
+import functools
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from keyword_matcher import fold_text
+from log_utils import get_logger
+
+LOGGER = get_logger("kb")
+
+# Parâmetros do BM25. A resposta conta com peso menor que as perguntas e palavras-chave: uma palavra
+# que só aparece no texto da resposta ("orçamento" na resposta sobre preços) não basta para respondê-la.
+K1 = 1.2
+B = 0.75
+ANSWER_WEIGHT = 0.3
+
+STOPWORDS = frozenset(fold_text(word) for word in """
+a à ao aos as às o os um uma uns umas de do da dos das dum duma em no na nos nas num numa por pelo pela
+pelos pelas para pra pro com sem sob sobre entre até após e ou nem mas que se porque pois como quando
+onde qual quais quanto quanta quantos quantas quem cujo eu tu ele ela nós vós eles elas você vocês me
+te lhe lhes nos vos meu minha meus minhas seu sua seus suas teu tua nosso nossa nossos nossas este
+esta estes estas esse essa esses essas aquele aquela aqueles aquelas isto isso aquilo aqui ali lá já
+só também muito muita muitos muitas mais menos bem mal sim não então ainda é são era eram foi foram ser
+sou está estão estou estava ter tem têm tenho tinha há haver vai vou ir fazer faz fazem pode podem
+posso poderia gostaria queria quero preciso precisa precisamos precisar saber ajuda ajudam ajudar
+usa usam usar utiliza utilizam utilizar olá oi bom boa dia tarde noite obrigado obrigada favor
+""".split())
+
+_TOKEN = re.compile(r"\w+")
+
+# Reduções de plural (sem acentos) e sufixos, do mais longo para o mais curto
+_PLURALS = (("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"), ("ns", "m"), ("res", "r"))
+_SUFFIXES = tuple(sorted((
+    "amentos", "imentos", "amento", "imento", "adoras", "adores", "adora", "ador", "acao", "icao", "mente",
+    "idade", "ismo", "ista", "avel", "ivel", "ancia", "encia", "ando", "endo", "indo", "ado", "ada", "ido",
+    "ida", "aram", "eram", "iram", "ar", "er", "ir", "ou", "am",
+), key=len, reverse=True))
+_MIN_STEM = 3
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Radical aproximado de uma palavra já normalizada ("implementacoes" -> "implement")."""
+    if len(word) <= _MIN_STEM:
+        return word
+    for suffix, replacement in _PLURALS:
+        if word.endswith(suffix):
+            word = word[:-len(suffix)] + replacement
+            break
+    else:
+        if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+            word = word[:-1]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    if word[-1] in "aeo" and len(word) > _MIN_STEM:
+        return word[:-1]
+    return word
+
+
+def analyze(text: str) -> List[str]:
+    """Termos de um texto: normalizado, sem palavras vazias e reduzido ao radical."""
+    return [stem(token) for token in _TOKEN.findall(fold_text(text)) if token not in STOPWORDS and len(token) > 1]
+
+
+@dataclass(slots=True)
+class KnowledgeEntry:
+    id: str
+    questions: Tuple[str, ...]
+    answer: str
+    keywords: Tuple[str, ...] = ()
+
+
+class KnowledgeMatch(NamedTuple):
+    entry: KnowledgeEntry
+    score: float        # Score BM25
+    confidence: float   # Score dividido pelo máximo possível para a mensagem (0 a 1)
+
+
+class _Index:
+    """Índice imutável: termo -> {posição da entrada: peso BM25}, montado uma vez por versão do arquivo."""
+
+    __slots__ = ("entries", "postings", "term_max", "max_weight", "unknown_weight", "version")
+
+    def __init__(self, entries: List[KnowledgeEntry], version=None):
+        self.entries = entries
+        self.version = version
+        documents = []
+        for entry in entries:
+            frequencies: Dict[str, float] = {}
+            for term in analyze(" ".join(entry.questions + entry.keywords)):
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term in analyze(entry.answer):
+                frequencies[term] = frequencies.get(term, 0) + ANSWER_WEIGHT
+            documents.append(frequencies)
+
+        total = len(documents)
+        average_length = sum(sum(document.values()) for document in documents) / total if total else 1.0
+        document_frequency: Dict[str, int] = {}
+        for document in documents:
+            for term in document:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        def idf(frequency: int) -> float:
+            return math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+        postings: Dict[str, Dict[int, float]] = {}
+        for position, document in enumerate(documents):
+            length_norm = K1 * (1 - B + B * sum(document.values()) / average_length)
+            for term, frequency in document.items():
+                weight = idf(document_frequency[term]) * frequency * (K1 + 1) / (frequency + length_norm)
+                postings.setdefault(term, {})[position] = weight
+        self.postings = postings
+        # Maior peso de cada termo no índice (poda da busca) e teto teórico do score (confiança)
+        self.term_max = {term: max(weights.values()) for term, weights in postings.items()}
+        self.max_weight = {term: idf(frequency) * (K1 + 1) for term, frequency in document_frequency.items()}
+        self.unknown_weight = idf(0) * (K1 + 1)
+
+    def search(self, text: str, limit: int = 1, min_confidence: float = 0.0) -> List[KnowledgeMatch]:
+        """
+        Soma as postagens dos termos, do mais raro (maior peso) para o mais comum. Quando os termos que
+        faltam não bastam para uma entrada nova chegar ao `limit`-ésimo lugar (ou a `min_confidence`),
+        eles só completam o score das candidatas que já existem, sem percorrer as listas longas.
+        """
+        terms = set(analyze(text))
+        if not terms:
+            return []
+        ceiling = sum(self.max_weight.get(term, self.unknown_weight) for term in terms)
+        term_max, postings = self.term_max, self.postings
+        known = sorted((term for term in terms if term in postings), key=term_max.__getitem__, reverse=True)
+        remaining = sum(term_max[term] for term in known)
+        floor = min_confidence * ceiling
+        scores: Dict[int, float] = {}
+        for term in known:
+            weights = postings[term]
+            cutoff = floor
+            if len(scores) >= limit:
+                cutoff = max(cutoff, max(scores.values()) if limit == 1 else heapq.nlargest(limit, scores.values())[-1])
+            if remaining < cutoff:
+                if not scores:
+                    return []
+                for position in scores:
+                    weight = weights.get(position)
+                    if weight is not None:
+                        scores[position] += weight
+            else:
+                for position, weight in weights.items():
+                    scores[position] = scores.get(position, 0.0) + weight
+            remaining -= term_max[term]
+        if not scores:
+            return []
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [KnowledgeMatch(self.entries[position], score, score / ceiling) for position, score in ranked]
+
+
+# --------------------------------------------------
+# Leitura do arquivo
+# --------------------------------------------------
+def _entries_from_records(records) -> List[KnowledgeEntry]:
+    if isinstance(records, dict):
+        records = records["entries"]
+    entries = []
+    for number, record in enumerate(records, start=1):
+        questions = record.get("questions") or [record["question"]]
+        entries.append(KnowledgeEntry(
+            str(record.get("id") or number),
+            tuple(questions),
+            record["answer"],
+            tuple(record.get("keywords", ())),
+        ))
+    return entries
+
+
+def _entries_from_markdown(text: str) -> List[KnowledgeEntry]:
+    entries = []
+    for block in re.split(r"^##\s+", text, flags=re.MULTILINE)[1:]:
+        heading, _, body = block.partition("\n")
+        keywords: Tuple[str, ...] = ()
+        answer_lines = []
+        for line in body.strip().splitlines():
+            label, separator, value = line.partition(":")
+            if separator and fold_text(label.strip()) == "palavras-chave":
+                keywords = tuple(keyword.strip() for keyword in value.split(",") if keyword.strip())
+            else:
+                answer_lines.append(line)
+        entry_id = "_".join(_TOKEN.findall(fold_text(heading))) or str(len(entries) + 1)
+        entries.append(KnowledgeEntry(entry_id, (heading.strip(),), "\n".join(answer_lines).strip(), keywords))
+    return entries
+
+
+def load_entries(path: str) -> List[KnowledgeEntry]:
+    """Entradas do arquivo, conforme a extensão (.json, .yaml/.yml ou .md). Lança ValueError se vier vazio."""
+    with open(path, encoding="utf-8") as kb_file:
+        content = kb_file.read()
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".yaml", ".yml"):
+        import yaml  # PyYAML é opcional: só necessário para bases em YAML
+
+        entries = _entries_from_records(yaml.safe_load(content))
+    elif extension in (".md", ".markdown"):
+        entries = _entries_from_markdown(content)
+    else:
+        entries = _entries_from_records(json.loads(content))
+    if not entries:
+        raise ValueError(f"Nenhuma entrada em {path}.")
+    return entries
+
+
+def _file_version(path: str):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Versão de um arquivo que não pôde ser lido (ex: apagado durante um deploy)
+_UNREADABLE = (-1, -1)
+
+
+class KnowledgeBase:
+    """
+    FAQ indexado com recarga a quente. search() só lê a referência do índice atual, que a thread de
+    recarga substitui inteira quando o arquivo muda; se o arquivo novo tiver erro, o índice atual fica.
+    """
+
+    def __init__(self, path: str, min_score: float = 0.3, reload_seconds: float = 0):
+        self.path = path
+        self.min_score = min_score
+        self.reload_seconds = reload_seconds
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._index = _Index(load_entries(path), _file_version(path))
+        self._failed_version = None  # Versão que já falhou: só é lida de novo quando o arquivo mudar
+        self._stopped = threading.Event()
+        self._thread = None
+        if reload_seconds > 0:
+            self._thread = threading.Thread(target=self._watch, name="kb-reload", daemon=True)
+            self._thread.start()
+
+    @property
+    def entries(self) -> List[KnowledgeEntry]:
+        return self._index.entries
+
+    def search(self, text: str, limit: int = 1) -> List[KnowledgeMatch]:
+        """As `limit` entradas mais bem ranqueadas, sem aplicar o limiar."""
+        return self._index.search(text, limit)
+
+    def answer(self, text: str) -> Optional[KnowledgeMatch]:
+        """A melhor entrada, se a confiança passar de min_score."""
+        matches = self._index.search(text, 1, self.min_score)
+        if matches and matches[0].confidence >= self.min_score:
+            return matches[0]
+        return None
+
+    def reload(self) -> bool:
+        """Remonta o índice se o arquivo mudou. Retorna True se trocou."""
+        version = _UNREADABLE
+        try:
+            version = _file_version(self.path)
+            if version == self._index.version or version == self._failed_version:
+                return False
+            index = _Index(load_entries(self.path), version)
+        except Exception as e:  # pylint: disable=broad-except
+            if version == self._failed_version:
+                return False
+            self._failed_version = version
+            self.failed_reloads += 1
+            LOGGER.error("Falha ao recarregar a base de conhecimento %s (mantida a versão anterior): %s", self.path, e)
+            return False
+        self._failed_version = None
+        self._index = index
+        self.reloads += 1
+        LOGGER.info("Base de conhecimento recarregada: %d entradas.", len(index.entries))
+        return True
+
+    def _watch(self):
+        while not self._stopped.wait(self.reload_seconds):
+            self.reload()
+
+    def close(self):
+        self._stopped.set()
+
+
+def create_knowledge_base(config) -> Optional[KnowledgeBase]:
+    """KnowledgeBase de KB_PATH, ou None (com aviso) se o arquivo não existir ou for inválido."""
+    if not config.KB_PATH:
+        return None
+    try:
+        knowledge_base = KnowledgeBase(config.KB_PATH, config.KB_MIN_SCORE, config.KB_RELOAD_SECONDS)
+    except Exception as e:  # pylint: disable=broad-except
+        LOGGER.warning("Base de conhecimento %s não carregada: %s. O FAQ ficará sem respostas.", config.KB_PATH, e)
+        return None
+    LOGGER.info("Base de conhecimento carregada: %d entradas.", len(knowledge_base.entries))
+    return knowledge_base
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import timeit
+
+    from config import DefaultConfig
+    from keyword_matcher import KeywordMatcher  # Só para comparar com o casador de palavras-chave anterior
+
+    config = DefaultConfig()
+    kb = KnowledgeBase(config.KB_PATH, config.KB_MIN_SCORE)
+    # Mensagens que o casador de palavras-chave antigo respondia, variações que ele não pegava, e
+    # mensagens sem relação com o FAQ, que precisam ficar abaixo do limiar
+    expected = {
+        "Qual o preço?": "preco",
+        "quanto custa a solução de vocês": "preco",
+        "vocês têm planos mais baratos? qual o valor?": "preco",
+        "Como é a implementação?": "implementacao",
+        "quais as etapas para implantar": "implementacao",
+        "Vocês trabalham com Microsoft Teams?": "microsoft_teams",
+        "usam o teams?": "microsoft_teams",
+        "preciso organizar documentos da empresa": "documentacao",
+        "Vocês trabalham com sharepoint": "documentacao",
+        "gestão de contratos": "contratos",
+        "como faço para abrir um chamado de suporte": "suporte",
+        "quero um orçamento": None,  # Segue para o funil SDR (palavra-chave comercial)
+        "preciso de ajuda": None,
+        "qual a previsão do tempo para amanhã": None,
+        "meu cachorro fugiu": None,
+        "asdfgh": None,
+    }
+    for message, entry_id in expected.items():
+        match = kb.answer(message)
+        found = match.entry.id if match else None
+        assert found == entry_id, (message, found, kb.search(message, 3))
+    print(f"{len(expected)} mensagens respondidas como esperado com {len(kb.entries)} entradas (limiar {kb.min_score}).")
+
+    # Recarga: o arquivo novo entra no lugar do antigo; um arquivo inválido mantém o índice atual
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "faq.md")
+        with open(path, "w", encoding="utf-8") as md_file:
+            md_file.write("## Qual o horário de atendimento?\nPalavras-chave: horário, expediente\nDe segunda a sexta, das 9h às 18h.\n")
+        reloading = KnowledgeBase(path, reload_seconds=0.05)
+        assert reloading.answer("horario de atendimento").entry.id == "qual_o_horario_de_atendimento"
+        with open(path, "a", encoding="utf-8") as md_file:
+            md_file.write("\n## Onde fica o escritório?\nRua Exemplo, 100, São Paulo.\n")
+        deadline = time.monotonic() + 5
+        while reloading.reloads == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert reloading.answer("onde fica o escritorio").entry.answer.startswith("Rua Exemplo")
+        with open(path, "w", encoding="utf-8") as md_file:
+            md_file.write("sem entradas")
+        time.sleep(0.2)
+        assert len(reloading.entries) == 2 and reloading.failed_reloads == 1  # Lido e registrado uma vez só
+        reloading.close()
+    print("Recarga a quente: arquivo novo aplicado, arquivo inválido ignorado.")
+
+    # Benchmark: as entradas reais mais entradas sintéticas com vocabulário de distribuição Zipf
+    rng = random.Random(42)
+    vocabulary = [f"termo{number}x" for number in range(20000)]
+    zipf_weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    queries = [message for message in expected if expected[message]]
+
+    def synthetic(count: int) -> List[KnowledgeEntry]:
+        entries = list(kb.entries)
+        for number in range(count - len(entries)):
+            words = rng.choices(vocabulary, zipf_weights, k=40)
+            entries.append(KnowledgeEntry(f"s{number}", (" ".join(words[:8]), " ".join(words[8:14])),
+                                          " ".join(words[14:]), tuple(words[:3])))
+        return entries
+
+    def per_search_us(queries_to_run, **options) -> float:
+        runs = 200
+        elapsed = timeit.timeit(lambda: [index.search(query, **options) for query in queries_to_run], number=runs)
+        return elapsed / runs / len(queries_to_run) * 1e6
+
+    print(f"{'entradas':>9} {'montagem ms':>12} {'resposta us':>12} {'c/ termos comuns us':>20} {'top-5 us':>9}")
+    for count in (100, 1000, 10000):
+        entries = synthetic(count)
+        started = time.perf_counter()
+        index = _Index(entries)
+        build_ms = (time.perf_counter() - started) * 1000
+        # O caminho do bot (melhor entrada acima do limiar), com as mensagens de exemplo e com elas
+        # acrescidas de termos frequentes do vocabulário sintético (listas de postagens longas)
+        mixed = [query + " " + " ".join(rng.choices(vocabulary[:50], k=3)) for query in queries]
+        answer_us = per_search_us(queries, min_confidence=kb.min_score)
+        mixed_us = per_search_us(mixed, min_confidence=kb.min_score)
+        top5_us = per_search_us(mixed, limit=5)
+        print(f"{count:>9} {build_ms:>12.1f} {answer_us:>12.1f} {mixed_us:>20.1f} {top5_us:>9.1f}")
+    old = KeywordMatcher({entry.keywords[0]: entry.answer for entry in kb.entries})
+    old_us = timeit.timeit(lambda: [old.first(query) for query in queries], number=200) / 200 / len(queries) * 1e6
+    print(f"Casador de palavras-chave anterior (6 entradas): {old_us:.1f} us por busca")
@@ -0,0 +1,482 @@
+"""
+Saída dos leads do funil SDR.
+
+Quando o funil recebe o e-mail do contato (estados awaiting_email_for_schedule e
+awaiting_email_for_materials, marcados com "lead" em bots/flows.py), o bot monta um Lead com os
+dados do SDRState e chama LeadSink.emit(): o lead só entra em uma fila em memória, sem I/O no turno.
+Uma thread junta os leads em lotes e os grava em segmentos rotativos (JSONL e/ou CSV, e
+opcionalmente uma tabela SQLite), com um único fsync por lote a cada LEAD_FSYNC_INTERVAL_SECONDS.
+
+O id do lead é derivado da conversa e da atividade que trouxe o e-mail, então uma retentativa do
+canal não gera um segundo lead: a thread descarta ids já gravados (inclusive antes de um restart),
+a tabela SQLite usa o id como chave e a exportação mantém só a primeira ocorrência de cada id.
+
+Exportação de todos os segmentos:  python lead_sink.py export [--dir leads] [--format csv] [--out leads.csv]
+Vazão sustentada (leads/s até o disco):  python lead_sink.py bench [leads]
+"""
+import atexit
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import astuple, dataclass, fields
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from log_utils import get_logger
+
+LOGGER = get_logger("leads")
+
+FORMATS = ("jsonl", "csv")
+# Espera máxima da thread com a fila vazia e nada por sincronizar
+_IDLE_WAIT = 1.0
+
+
+@dataclass(slots=True)
+class Lead:
+    lead_id: str
+    captured_at: str  # ISO 8601 em UTC
+    outcome: str  # "meeting" (pediu reunião) ou "materials" (pediu materiais)
+    conversation_id: Optional[str] = None
+    channel_id: Optional[str] = None
+    user_id: Optional[str] = None
+    name: Optional[str] = None
+    role: Optional[str] = None
+    company: Optional[str] = None
+    needs: Optional[str] = None
+    size: Optional[str] = None
+    qualified: Optional[bool] = None
+    email: Optional[str] = None
+
+
+LEAD_FIELDS = tuple(field.name for field in fields(Lead))
+
+
+def make_lead_id(conversation_id: Optional[str], activity_id: Optional[str], email: Optional[str]) -> str:
+    """Mesmo id para a mesma captura: a retentativa de uma atividade não vira um segundo lead."""
+    key = f"{conversation_id or ''}|{activity_id or email or ''}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def lead_from_state(state, outcome: str, activity) -> Lead:
+    """Lead com os dados do SDRState (ver bots/state_records.py) e da atividade que trouxe o e-mail."""
+    conversation_id = activity.conversation.id if activity.conversation else None
+    return Lead(
+        make_lead_id(conversation_id, activity.id, state.email),
+        datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        outcome,
+        conversation_id,
+        activity.channel_id,
+        activity.from_property.id if activity.from_property else None,
+        state.name,
+        state.role,
+        state.company,
+        state.needs,
+        state.size,
+        state.qualified,
+        state.email,
+    )
+
+
+def _lead_dict(lead: Lead) -> Dict:
+    return dict(zip(LEAD_FIELDS, astuple(lead)))
+
+
+class _Segment:
+    """Arquivo de segmento aberto para escrita: leads-<início UTC>-<pid>-<seq>.<formato>."""
+
+    def __init__(self, directory: str, file_format: str, sequence: int):
+        self.file_format = file_format
+        started = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.path = os.path.join(directory, f"leads-{started}-{os.getpid()}-{sequence:04d}.{file_format}")
+        self.opened_at = time.monotonic()
+        self.file = open(self.path, "a", encoding="utf-8", newline="")
+        self.size = self.file.tell()
+        self.dirty = False
+        if file_format == "csv" and self.size == 0:
+            self.write(_csv_rows([LEAD_FIELDS]))
+
+    def write(self, text: str):
+        self.file.write(text)
+        self.size += len(text)
+        self.dirty = True
+
+    def sync(self):
+        if self.dirty:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def _csv_rows(rows: Iterable[Sequence]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _encode(file_format: str, leads: List[Lead]) -> str:
+    if file_format == "jsonl":
+        return "".join(json.dumps(_lead_dict(lead), ensure_ascii=False) + "\n" for lead in leads)
+    return _csv_rows(astuple(lead) for lead in leads)
+
+
+class LeadSink:
+    """
+    Gravação dos leads em segundo plano.
+
+    - emit() não faz I/O: coloca o lead em uma fila sem locks (acima de `max_queue` o lead é
+      descartado e registrado no log, para nunca segurar o turno).
+    - A thread grava cada lote em todos os formatos, troca de segmento ao passar de
+      `segment_max_bytes` ou `segment_max_seconds` e faz o fsync (e o COMMIT no SQLite) no máximo a
+      cada `fsync_interval` segundos, o que junta vários lotes em uma escrita durável.
+    - Falhas de disco não perdem leads: o lote volta a ser tentado no ciclo seguinte.
+    """
+
+    def __init__(self, directory: str, formats: Sequence[str] = ("jsonl",), sqlite_path: str = None,
+                 segment_max_bytes: int = 16 * 1024 * 1024, segment_max_seconds: float = 24 * 3600,
+                 fsync_interval: float = 1.0, batch_size: int = 500, max_queue: int = 10000,
+                 recent_ids: int = 100000):
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"Formatos de lead desconhecidos: {sorted(unknown)} (use {FORMATS}).")
+        self.directory = directory
+        self.formats = tuple(formats)
+        self.sqlite_path = sqlite_path
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.recent_ids = recent_ids
+        self.emitted = 0
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.fsyncs = 0
+        self._durable = 0  # Leads emitidos que já foram gravados com fsync (ou descartados como duplicados)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._segments: Dict[str, _Segment] = {}
+        self._sequence = 0
+        self._db = None
+        self._retry: List[Lead] = []
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._flush_requested = threading.Event()
+        self._durable_changed = threading.Condition()
+        self._stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="lead-sink", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() + len(self._retry)
+
+    def emit(self, lead: Lead) -> bool:
+        """Enfileira o lead para gravação. False se a fila estiver cheia (lead descartado)."""
+        if self._queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            LOGGER.error("Fila de leads cheia (%d): lead %s descartado.", self.max_queue, lead.lead_id)
+            return False
+        self.emitted += 1
+        self._queue.put_nowait(lead)
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Espera até que todos os leads já emitidos estejam em disco. Retorna False se o tempo acabar."""
+        target = self.emitted
+        self._flush_requested.set()
+        self._queue.put_nowait(None)  # Acorda a thread, se estiver esperando a fila
+        with self._durable_changed:
+            return self._durable_changed.wait_for(lambda: self._durable >= target, timeout)
+
+    def close(self, timeout: float = 10.0):
+        """Grava o que ainda estiver na fila, faz o fsync e fecha os segmentos."""
+        if self._stopped.is_set():
+            return
+        self.flush(timeout)
+        self._stopped.set()
+        self._queue.put_nowait(None)
+        self._thread.join(timeout)
+
+    # --------------------------------------------------
+    # Thread de gravação
+    # --------------------------------------------------
+    def _run(self):
+        self._load_recent_ids()
+        while not self._stopped.is_set():
+            wait = max(self._last_sync + self.fsync_interval - time.monotonic(), 0) if self._unsynced else _IDLE_WAIT
+            batch = self._retry + self._next_batch(wait)
+            self._retry = []
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:  # pylint: disable=broad-except
+                    LOGGER.error("Falha ao gravar %d leads (nova tentativa em seguida): %s", len(batch), e)
+                    self._retry = batch
+                    time.sleep(min(self.fsync_interval, 1.0) or 0.1)
+                    continue
+            # Com flush() pedido, sincroniza assim que a fila esvaziar, sem esperar o intervalo
+            if self._unsynced and ((self._flush_requested.is_set() and self._queue.empty())
+                                   or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+            if self._flush_requested.is_set() and not self._unsynced and not self._retry and self._queue.empty():
+                self._flush_requested.clear()
+        self._sync()
+        for segment in self._segments.values():
+            segment.close()
+        if self._db is not None:
+            self._db.close()
+
+    def _next_batch(self, wait: float) -> List[Lead]:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=wait) if wait > 0 and not self._flush_requested.is_set()
+                         else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return [lead for lead in batch if lead is not None]  # None = só acordar a thread (flush/close)
+
+    def _write(self, batch: List[Lead]):
+        fresh = []
+        for lead in batch:
+            if lead.lead_id in self._seen:
+                self.duplicates += 1
+                continue
+            self._remember(lead.lead_id)
+            fresh.append(lead)
+        try:
+            if fresh:
+                for file_format in self.formats:
+                    self._segment(file_format).write(_encode(file_format, fresh))
+                if self.sqlite_path:
+                    self._insert(fresh)
+        except Exception:
+            for lead in fresh:
+                self._seen.pop(lead.lead_id, None)
+            raise
+        self.written += len(fresh)
+        self._unsynced += len(batch)
+
+    def _remember(self, lead_id: str):
+        self._seen[lead_id] = None
+        if len(self._seen) > self.recent_ids:
+            self._seen.popitem(last=False)
+
+    def _segment(self, file_format: str) -> _Segment:
+        segment = self._segments.get(file_format)
+        if segment is not None and (segment.size >= self.segment_max_bytes
+                                    or time.monotonic() - segment.opened_at >= self.segment_max_seconds):
+            segment.close()
+            segment = None
+        if segment is None:
+            self._sequence += 1
+            segment = self._segments[file_format] = _Segment(self.directory, file_format, self._sequence)
+        return segment
+
+    def _insert(self, leads: List[Lead]):
+        if self._db is None:
+            self._db = _open_database(self.sqlite_path)
+        if not self._db.in_transaction:
+            self._db.execute("BEGIN")
+        self._db.executemany(
+            f"INSERT OR IGNORE INTO leads ({', '.join(LEAD_FIELDS)}) VALUES ({', '.join('?' * len(LEAD_FIELDS))})",
+            [astuple(lead) for lead in leads])
+
+    def _sync(self):
+        if not self._unsynced:
+            return
+        try:
+            for segment in self._segments.values():
+                segment.sync()
+            if self._db is not None and self._db.in_transaction:
+                self._db.execute("COMMIT")
+        except Exception as e:  # pylint: disable=broad-except
+            LOGGER.error("Falha no fsync dos leads: %s", e)
+            return
+        self.fsyncs += 1
+        self._last_sync = time.monotonic()
+        with self._durable_changed:
+            self._durable += self._unsynced
+            self._unsynced = 0
+            self._durable_changed.notify_all()
+
+    def _load_recent_ids(self):
+        """Ids dos segmentos mais recentes, para descartar retentativas que chegarem depois de um restart."""
+        file_format = "jsonl" if "jsonl" in self.formats else "csv"
+        read = _read_jsonl if file_format == "jsonl" else _read_csv
+        ids: List[str] = []
+        for path in sorted(_segment_paths(self.directory, file_format), reverse=True):
+            ids[:0] = [record["lead_id"] for record in read(path)]
+            if len(ids) >= self.recent_ids:
+                break
+        for lead_id in ids[-self.recent_ids:]:
+            self._remember(lead_id)
+
+
+def _open_database(path: str):
+    import sqlite3  # Só com LEAD_SINK_SQLITE_PATH
+
+    db = sqlite3.connect(path, isolation_level=None, timeout=10)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(f"CREATE TABLE IF NOT EXISTS leads (lead_id TEXT PRIMARY KEY, "
+               f"{', '.join(name + (' INTEGER' if name == 'qualified' else ' TEXT') for name in LEAD_FIELDS[1:])})")
+    return db
+
+
+def create_lead_sink(config) -> Optional[LeadSink]:
+    """LeadSink conforme o DefaultConfig (LEAD_SINK_*). None se LEAD_SINK_ENABLED=false."""
+    if not config.LEAD_SINK_ENABLED:
+        return None
+    sink = LeadSink(
+        config.LEAD_SINK_DIR,
+        [name.strip() for name in config.LEAD_SINK_FORMATS.split(",") if name.strip()],
+        config.LEAD_SINK_SQLITE_PATH or None,
+        config.LEAD_SEGMENT_MAX_BYTES,
+        config.LEAD_SEGMENT_MAX_SECONDS,
+        config.LEAD_FSYNC_INTERVAL_SECONDS,
+        max_queue=config.LEAD_QUEUE_SIZE,
+    )
+    atexit.register(sink.close)
+    return sink
+
+
+# --------------------------------------------------
+# Leitura e exportação
+# --------------------------------------------------
+def _segment_paths(directory: str, file_format: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, f"leads-*.{file_format}")))
+
+
+def _read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as segment_file:
+        for line in segment_file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # Última linha de um segmento interrompido no meio da escrita
+
+
+def _read_csv(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8", newline="") as segment_file:
+        for row in csv.DictReader(segment_file):
+            if None in row.values() or None in row:
+                continue  # Linha incompleta
+            row["qualified"] = {"True": True, "False": False}.get(row["qualified"])
+            yield {name: (value if value != "" else None) for name, value in row.items()}
+
+
+def _read_sqlite(path: str) -> Iterator[Dict]:
+    db = _open_database(path)
+    try:
+        for row in db.execute(f"SELECT {', '.join(LEAD_FIELDS)} FROM leads"):
+            record = dict(zip(LEAD_FIELDS, row))
+            record["qualified"] = None if record["qualified"] is None else bool(record["qualified"])
+            yield record
+    finally:
+        db.close()
+
+
+def read_leads(directory: str, sqlite_path: str = None, since: str = None) -> List[Dict]:
+    """
+    Todos os leads gravados, sem repetição de id, em ordem de captura. Lê a tabela SQLite (se
+    indicada) ou os segmentos JSONL; sem JSONL na pasta, os segmentos CSV.
+    """
+    if sqlite_path:
+        records: Iterable[Dict] = _read_sqlite(sqlite_path)
+    elif _segment_paths(directory, "jsonl"):
+        records = (record for path in _segment_paths(directory, "jsonl") for record in _read_jsonl(path))
+    else:
+        records = (record for path in _segment_paths(directory, "csv") for record in _read_csv(path))
+    leads: Dict[str, Dict] = {}
+    for record in records:
+        if since and record["captured_at"] < since:
+            continue
+        leads.setdefault(record["lead_id"], record)
+    return sorted(leads.values(), key=lambda record: record["captured_at"])
+
+
+def export_leads(leads: List[Dict], output, file_format: str = "csv"):
+    if file_format == "jsonl":
+        for record in leads:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return
+    writer = csv.DictWriter(output, LEAD_FIELDS)
+    writer.writeheader()
+    writer.writerows(leads)
+
+
+def _benchmark(total: int):
+    import tempfile
+
+    def sample(index: int) -> Lead:
+        return Lead(make_lead_id(f"conv-{index}", f"act-{index}", None), datetime.now(timezone.utc).isoformat(),
+                    "meeting", f"conv-{index}", "msteams", f"user-{index}", "Ana Souza", "Diretora", "Acme",
+                    "Contratos", "11-50", True, f"ana{index}@acme.com")
+
+    leads = [sample(index) for index in range(total)]
+    scenarios = [
+        ("fsync por lead (sem lote)", dict(formats=("jsonl",), fsync_interval=0, batch_size=1)),
+        ("jsonl, fsync a cada 1 s", dict(formats=("jsonl",))),
+        ("jsonl + csv, fsync a cada 1 s", dict(formats=("jsonl", "csv"))),
+        ("jsonl + sqlite, fsync a cada 1 s", dict(formats=("jsonl",), sqlite=True)),
+    ]
+    print(f"{'cenário':<34} {'emit() us':>10} {'leads/s':>10} {'fsyncs':>7}")
+    for name, options in scenarios:
+        directory = tempfile.mkdtemp(prefix="leads_")
+        sqlite_path = os.path.join(directory, "leads.db") if options.pop("sqlite", False) else None
+        count = total if options.get("batch_size") != 1 else min(total, 2000)
+        sink = LeadSink(directory, sqlite_path=sqlite_path, max_queue=2 * total, **options)
+        started = time.perf_counter()
+        for lead in leads[:count]:
+            sink.emit(lead)
+        emitted = time.perf_counter() - started
+        for lead in leads[:count // 10]:
+            sink.emit(lead)  # Retentativas: não podem virar leads novos
+        assert sink.flush(timeout=300)
+        elapsed = time.perf_counter() - started
+        sink.close()
+        assert sink.written == count and sink.duplicates == count // 10, (sink.written, sink.duplicates)
+        assert len(read_leads(directory, sqlite_path)) == count
+        print(f"{name:<34} {emitted / count * 1e6:>10.2f} {count / elapsed:>10.0f} {sink.fsyncs:>7}")
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Exportação dos leads gravados e benchmark do LeadSink.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Junta todos os segmentos em um único arquivo, sem leads repetidos.")
+    export_parser.add_argument("--dir", default=os.environ.get("LEAD_SINK_DIR", "leads"), help="Pasta dos segmentos")
+    export_parser.add_argument("--sqlite", default=os.environ.get("LEAD_SINK_SQLITE_PATH", ""), help="Ler da tabela SQLite em vez dos segmentos")
+    export_parser.add_argument("--format", choices=FORMATS, default="csv")
+    export_parser.add_argument("--since", help="Só leads capturados a partir desta data/hora ISO (UTC), ex: 2026-01-31")
+    export_parser.add_argument("--out", default="-", help="Arquivo de saída (- = stdout)")
+    bench_parser = commands.add_parser("bench", help="Vazão sustentada, em leads/s, até o fsync.")
+    bench_parser.add_argument("leads", type=int, nargs="?", default=100000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        _benchmark(args.leads)
+    else:
+        exported = read_leads(args.dir, args.sqlite or None, args.since)
+        if args.out == "-":
+            export_leads(exported, sys.stdout, args.format)
+        else:
+            with open(args.out, "w", encoding="utf-8", newline="") as out_file:
+                export_leads(exported, out_file, args.format)
+        print(f"{len(exported)} leads exportados.", file=sys.stderr)
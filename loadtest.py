@@ -0,0 +1,431 @@
+"""
+Gerador de carga para o /api/messages do Tralhobot.
+
+Sobe localmente um Bot Connector falso (recebe as respostas do bot) e um endpoint CLU
+falso com latência configurável, e dispara conversas completas em paralelo:
+boas-vindas -> FAQ -> funil SDR até o e-mail de agendamento -> escalonamento de suporte.
+
+Exemplos:
+    # Sobe o próprio bot (app.py ou app_flask.py) apontando para os serviços falsos
+    python loadtest.py --spawn app.py --conversations 200 --concurrency 50 --out resultado.json
+
+    # Contra um bot já rodando (configure CLU_ENDPOINT=http://127.0.0.1:9101 nele)
+    python loadtest.py --url http://127.0.0.1:3979/api/messages
+
+    # Compara com uma execução anterior
+    python loadtest.py --spawn app.py --compare resultado_anterior.json
+
+    # Partida a frio: tempo entre subir o processo e a primeira resposta chegar ao conector,
+    # com 150 ms de "handshake" na primeira requisição de cada conexão aos serviços falsos
+    python loadtest.py --spawn app.py --cold-start 10 --connect-latency-ms 150
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+# Roteiro de cada conversa: (passo da máquina de estados, tipo da atividade, texto)
+CONVERSATION_SCRIPT = [
+    ("welcome", "conversationUpdate", None),
+    ("faq", "message", "Vocês trabalham com Microsoft Teams?"),
+    ("sdr_start", "message", "Quero um orçamento"),
+    ("awaiting_name_role", "message", "Ana Souza, diretora de operações"),
+    ("awaiting_company", "message", "Acme Ltda"),
+    ("awaiting_needs", "message", "Organizar documentos e contratos"),
+    ("awaiting_size", "message", "11-50"),
+    ("proposing_meeting", "message", "schedule_meeting_yes"),
+    ("awaiting_email_for_schedule", "message", "ana@acme.com"),
+    ("support_start", "message", "Preciso de suporte"),
+    ("awaiting_problem_description", "message", "Não consigo acessar o sistema"),
+    ("awaiting_resolution_confirmation", "message", "Não"),
+    ("awaiting_escalation_details", "message", "Ana, ana@acme.com, Acme"),
+]
+
+ERROR_REPLY = "Desculpe, algo deu errado no Tralhobot."
+
+# Intenções devolvidas pelo CLU falso, por palavra-chave
+FAKE_CLU_INTENTS = [
+    ("suporte", "SolicitarSuporte"),
+    ("problema", "SolicitarSuporte"),
+    ("orçamento", "QualificarSDR"),
+    ("especialista", "QualificarSDR"),
+    ("preço", "PerguntarPreco"),
+    ("olá", "Saudacao"),
+    ("tchau", "Despedida"),
+]
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class FakeServices:
+    """Bot Connector e CLU falsos, servidos pelo mesmo processo do gerador de carga."""
+
+    def __init__(self, clu_latency: float, clu_error_rate: float, connect_latency: float = 0.0):
+        self.clu_latency = clu_latency
+        self.clu_error_rate = clu_error_rate
+        self.connect_latency = connect_latency
+        self.replies = defaultdict(list)  # conversation_id -> textos recebidos
+        self.first_reply_at = {}  # conversation_id -> time.perf_counter() da primeira resposta
+        self.clu_calls = 0
+        self.clu_errors = 0
+        self._connections = set()
+
+    async def _handshake(self, request: web.Request):
+        # Simula o custo de abrir uma conexão TLS nova (DNS + TCP + TLS) até os serviços reais
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        if self.connect_latency and peer not in self._connections:
+            self._connections.add(peer)
+            await asyncio.sleep(self.connect_latency)
+
+    async def connector_reply(self, request: web.Request) -> web.Response:
+        await self._handshake(request)
+        activity = await request.json()
+        conversation_id = request.match_info["conversation_id"]
+        self.first_reply_at.setdefault(conversation_id, time.perf_counter())
+        self.replies[conversation_id].append(activity.get("text") or "")
+        return web.json_response({"id": uuid.uuid4().hex})
+
+    async def clu_analyze(self, request: web.Request) -> web.Response:
+        await self._handshake(request)
+        self.clu_calls += 1
+        task = await request.json()
+        await asyncio.sleep(self.clu_latency)
+        if random.random() < self.clu_error_rate:
+            self.clu_errors += 1
+            return web.json_response({"error": {"code": "InternalServerError", "message": "falha injetada"}}, status=500)
+
+        text = task["analysisInput"]["conversationItem"]["text"].lower()
+        top_intent = next((intent for keyword, intent in FAKE_CLU_INTENTS if keyword in text), "None")
+        return web.json_response({
+            "kind": "ConversationResult",
+            "result": {
+                "query": text,
+                "prediction": {
+                    "projectKind": "Conversation",
+                    "topIntent": top_intent,
+                    "intents": [{"category": top_intent, "confidenceScore": 0.95}],
+                    "entities": [],
+                },
+            },
+        })
+
+    async def preconnect(self, request: web.Request) -> web.Response:
+        await self._handshake(request)
+        return web.Response(status=404)
+
+    async def start(self, host: str, connector_port: int, clu_port: int):
+        connector = web.Application()
+        connector.router.add_post("/v3/conversations/{conversation_id}/activities", self.connector_reply)
+        connector.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.connector_reply)
+        connector.router.add_get("/{path:.*}", self.preconnect)
+        clu = web.Application()
+        clu.router.add_post("/language/:analyze-conversations", self.clu_analyze)
+        clu.router.add_get("/{path:.*}", self.preconnect)
+
+        self._runners = []
+        for app, port in ((connector, connector_port), (clu, clu_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            self._runners.append(runner)
+
+    async def stop(self):
+        for runner in self._runners:
+            await runner.cleanup()
+
+
+async def _run_conversation(session: ClientSession, url: str, service_url: str, samples, semaphore):
+    conversation_id = f"load-{uuid.uuid4().hex[:12]}"
+    user = {"id": f"user-{conversation_id}", "name": "Usuário de carga", "role": "user"}
+    async with semaphore:
+        for step, activity_type, text in CONVERSATION_SCRIPT:
+            activity = {
+                "type": activity_type,
+                "id": uuid.uuid4().hex,
+                "channelId": "emulator",
+                "serviceUrl": service_url,
+                "conversation": {"id": conversation_id},
+                "from": user,
+                "recipient": {"id": "tralhobot", "name": "Tralhobot", "role": "bot"},
+                "locale": "pt-BR",
+            }
+            if activity_type == "conversationUpdate":
+                activity["membersAdded"] = [user]
+            else:
+                activity["text"] = text
+
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json=activity) as response:
+                    await response.read()
+                    ok = response.status < 300
+            except Exception:
+                ok = False
+            samples[step].append((time.perf_counter() - start, ok))
+    return conversation_id
+
+
+def _spawn_bot(args):
+    """Sobe o bot (app.py ou app_flask.py) apontando para os serviços falsos."""
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(args.bot_port),
+        "HOST": args.host,
+        "CLU_ENDPOINT": f"http://{args.host}:{args.clu_port}",
+        "CLU_API_KEY": env.get("CLU_API_KEY_LOADTEST", "loadtest"),
+        "MicrosoftAppId": "",
+        "MicrosoftAppPassword": "",
+        "STARTUP_PRECONNECT_URLS": f"http://{args.host}:{args.connector_port}",
+        "LEAD_SINK_DIR": tempfile.mkdtemp(prefix="loadtest_leads_"),  # Os leads do funil não vão para a pasta do projeto
+    })
+    env.update(dict(item.split("=", 1) for item in args.bot_env))
+    command = [sys.executable, args.spawn]
+    if args.spawn.endswith("app_flask.py"):
+        command = [sys.executable, "-c", f"import app_flask; app_flask.app.run(host='{args.host}', port={args.bot_port}, threaded=True)"]
+    bot_process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return bot_process, f"http://{args.host}:{args.bot_port}/api/messages"
+
+
+def _stop_bot(bot_process):
+    bot_process.terminate()
+    try:
+        bot_process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        bot_process.kill()
+
+
+async def run_load(args) -> dict:
+    services = FakeServices(args.clu_latency_ms / 1000, args.clu_error_rate, args.connect_latency_ms / 1000)
+    await services.start(args.host, args.connector_port, args.clu_port)
+    # Metade das conversas usa "localhost" no serviceUrl, como o Bot Framework Emulator e o desenvolvimento local
+    service_urls = (f"http://{args.host}:{args.connector_port}", f"http://localhost:{args.connector_port}")
+
+    bot_process = None
+    url = args.url
+    if args.spawn:
+        bot_process, url = _spawn_bot(args)
+
+    samples = defaultdict(list)
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as session:
+            if bot_process is not None:
+                await _wait_for_bot(session, url, bot_process)
+            semaphore = asyncio.Semaphore(args.concurrency)
+            start = time.perf_counter()
+            conversation_ids = await asyncio.gather(*(
+                _run_conversation(session, url, service_urls[index % 2], samples, semaphore) for index in range(args.conversations)
+            ))
+            elapsed = time.perf_counter() - start
+            # No modo de confirmação imediata (202) as respostas chegam depois: espera elas pararem de chegar
+            await _wait_for_replies(services, args.timeout)
+    finally:
+        if bot_process is not None:
+            _stop_bot(bot_process)
+        await services.stop()
+
+    return _report(args, samples, elapsed, services, conversation_ids)
+
+
+async def run_cold_start(args) -> dict:
+    """
+    Mede, para cada partida, o tempo entre subir o processo do bot e a primeira resposta chegar ao
+    conector falso. A primeira mensagem é enviada assim que a porta aceita conexões, como faz o
+    proxy do Render com a requisição que acordou a instância.
+    """
+    services = FakeServices(args.clu_latency_ms / 1000, args.clu_error_rate, args.connect_latency_ms / 1000)
+    await services.start(args.host, args.connector_port, args.clu_port)
+    service_url = f"http://{args.host}:{args.connector_port}"
+    runs = []
+    try:
+        for _ in range(args.cold_start):
+            services._connections.clear()  # pylint: disable=protected-access
+            conversation_id = f"cold-{uuid.uuid4().hex[:12]}"
+            activity = {
+                "type": "message", "id": uuid.uuid4().hex, "channelId": "emulator", "serviceUrl": service_url,
+                "conversation": {"id": conversation_id}, "from": {"id": f"user-{conversation_id}", "role": "user"},
+                "recipient": {"id": "tralhobot", "role": "bot"}, "locale": "pt-BR", "text": "Quero um orçamento",
+            }
+            started = time.perf_counter()
+            bot_process, url = _spawn_bot(args)
+            listening = None
+            try:
+                async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as session:
+                    deadline = started + args.timeout
+                    while listening is None:
+                        if bot_process.poll() is not None or time.perf_counter() > deadline:
+                            raise RuntimeError("O bot não subiu a tempo")
+                        try:
+                            async with session.post(url, json=activity) as response:
+                                await response.read()
+                                listening = time.perf_counter()
+                        except Exception:
+                            await asyncio.sleep(0.01)
+                    while conversation_id not in services.first_reply_at and time.perf_counter() < deadline:
+                        await asyncio.sleep(0.005)
+            finally:
+                _stop_bot(bot_process)
+            runs.append({
+                "first_reply_s": round(services.first_reply_at[conversation_id] - started, 3),
+                "first_response_s": round(listening - started, 3),
+            })
+    finally:
+        await services.stop()
+
+    first_reply = [run["first_reply_s"] for run in runs]
+    return {
+        "target": args.spawn,
+        "bot_env": args.bot_env,
+        "connect_latency_ms": args.connect_latency_ms,
+        "clu_latency_ms": args.clu_latency_ms,
+        "runs": runs,
+        "first_reply_p50_s": round(statistics.median(first_reply), 3),
+        "first_reply_min_s": min(first_reply),
+        "first_reply_max_s": max(first_reply),
+    }
+
+
+async def _wait_for_replies(services: FakeServices, timeout: float, quiet_period: float = 0.5):
+    deadline = time.monotonic() + timeout
+    previous = -1
+    while time.monotonic() < deadline:
+        current = sum(len(replies) for replies in services.replies.values())
+        if current == previous:
+            return
+        previous = current
+        await asyncio.sleep(quiet_period)
+
+
+async def _wait_for_bot(session: ClientSession, url: str, bot_process, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if bot_process.poll() is not None:
+            raise RuntimeError(f"O processo do bot terminou com código {bot_process.returncode}")
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                return  # Qualquer resposta HTTP (ex: 405) indica que o servidor está no ar
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("O bot não subiu a tempo")
+
+
+def _report(args, samples, elapsed, services, conversation_ids) -> dict:
+    steps = {}
+    total_turns = total_errors = 0
+    for step, _, _ in CONVERSATION_SCRIPT:
+        latencies = sorted(latency for latency, _ in samples[step])
+        errors = sum(1 for _, ok in samples[step] if not ok)
+        total_turns += len(latencies)
+        total_errors += errors
+        steps[step] = {
+            "turns": len(latencies),
+            "http_errors": errors,
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p90_ms": round(_percentile(latencies, 0.90) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round((latencies[-1] if latencies else 0) * 1000, 2),
+        }
+
+    bot_error_replies = sum(services.replies[cid].count(ERROR_REPLY) for cid in conversation_ids)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        commit = ""
+
+    return {
+        "commit": commit,
+        "target": args.spawn or args.url,
+        "conversations": args.conversations,
+        "concurrency": args.concurrency,
+        "clu_latency_ms": args.clu_latency_ms,
+        "clu_error_rate": args.clu_error_rate,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_turns_per_s": round(total_turns / elapsed, 1) if elapsed else 0.0,
+        "turns": total_turns,
+        "http_error_rate": round(total_errors / total_turns, 4) if total_turns else 0.0,
+        "bot_error_replies": bot_error_replies,
+        "replies_received": sum(len(services.replies[cid]) for cid in conversation_ids),
+        "clu_calls": services.clu_calls,
+        "clu_injected_errors": services.clu_errors,
+        "steps": steps,
+    }
+
+
+def _print_report(report: dict, baseline: dict = None):
+    def delta(key, current, previous):
+        if previous is None or not previous.get(key):
+            return ""
+        return f" ({(current - previous[key]) / previous[key] * 100:+.1f}%)"
+
+    print(f"Alvo: {report['target']} | commit {report['commit']} | {report['conversations']} conversas, concorrência {report['concurrency']}")
+    print(f"Vazão: {report['throughput_turns_per_s']} turnos/s{delta('throughput_turns_per_s', report['throughput_turns_per_s'], baseline)}"
+          f" | erros HTTP: {report['http_error_rate'] * 100:.2f}% | respostas de erro do bot: {report['bot_error_replies']}"
+          f" | chamadas CLU: {report['clu_calls']}")
+    print(f"{'passo':<34}{'turnos':>8}{'erros':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for step, stats in report["steps"].items():
+        previous = (baseline or {}).get("steps", {}).get(step)
+        print(f"{step:<34}{stats['turns']:>8}{stats['http_errors']:>7}{stats['p50_ms']:>10}{stats['p90_ms']:>10}"
+              f"{stats['p99_ms']:>10}{delta('p99_ms', stats['p99_ms'], previous)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do /api/messages do Tralhobot")
+    parser.add_argument("--url", default="http://127.0.0.1:3979/api/messages", help="Endpoint do bot (ignorado com --spawn)")
+    parser.add_argument("--spawn", help="Sobe o bot com este arquivo (app.py ou app_flask.py) apontando para os serviços falsos")
+    parser.add_argument("--bot-env", action="append", default=[], help="Variável extra para o bot iniciado com --spawn (CHAVE=valor)")
+    parser.add_argument("--bot-port", type=int, default=3990)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--connector-port", type=int, default=9100)
+    parser.add_argument("--clu-port", type=int, default=9101)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--clu-latency-ms", type=float, default=200)
+    parser.add_argument("--clu-error-rate", type=float, default=0.0)
+    parser.add_argument("--connect-latency-ms", type=float, default=0,
+                        help="Atraso na primeira requisição de cada conexão aos serviços falsos (simula DNS/TLS)")
+    parser.add_argument("--cold-start", type=int, default=0,
+                        help="Em vez da carga, mede N partidas a frio (exige --spawn): tempo até a primeira resposta")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout de cada requisição em segundos")
+    parser.add_argument("--out", help="Arquivo JSON onde salvar o resultado")
+    parser.add_argument("--compare", help="Resultado JSON anterior para comparar")
+    args = parser.parse_args()
+
+    if args.cold_start:
+        report = asyncio.run(run_cold_start(args))
+        print(f"Alvo: {report['target']} {' '.join(report['bot_env'])} | {len(report['runs'])} partidas a frio"
+              f" | handshake simulado: {report['connect_latency_ms']:.0f} ms | CLU: {report['clu_latency_ms']:.0f} ms")
+        print(f"Primeira resposta: p50 {report['first_reply_p50_s'] * 1000:.0f} ms"
+              f" (mín {report['first_reply_min_s'] * 1000:.0f}, máx {report['first_reply_max_s'] * 1000:.0f})")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as out_file:
+                json.dump(report, out_file, indent=2, ensure_ascii=False)
+        return
+
+    report = asyncio.run(run_load(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    _print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out_file:
+            json.dump(report, out_file, indent=2, ensure_ascii=False)
+        print(f"Resultado salvo em {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+from typing import Dict, Optional
+
+# Conversa do turno atual: incluída automaticamente em todo registro emitido durante o turno
+CONVERSATION_ID = contextvars.ContextVar("conversation_id", default=None)
+
+_ROOT_LOGGER = "tralhobot"
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_DIGITS_RE = re.compile(r"\d{4,}")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_sampling: Dict[str, float] = {}
+_redact = True
+
+
+def get_logger(category: str) -> logging.Logger:
+    """Logger de uma categoria ("turn", "clu", "flow", "adapter"...). A amostragem é configurada por categoria."""
+    return logging.getLogger(f"{_ROOT_LOGGER}.{category}")
+
+
+def redact(text) -> str:
+    """
+    Texto do usuário nunca vai para o log por padrão (LOG_REDACT=true): só o tamanho.
+    Com LOG_REDACT=false o texto aparece, mas e-mails e sequências de dígitos continuam mascarados.
+    """
+    if text is None:
+        return None
+    text = str(text)
+    if _redact:
+        return f"<{len(text)} caracteres>"
+    return _DIGITS_RE.sub("<numero>", _EMAIL_RE.sub("<email>", text))
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """
+    Registra um evento estruturado. Se o nível estiver desligado, retorna antes de montar
+    qualquer coisa; a serialização para JSON acontece depois, na thread do QueueListener.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING:
+        rate = _sampling.get(logger.name.rpartition(".")[2], 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+    conversation_id = CONVERSATION_ID.get()
+    if conversation_id is not None and "conversation_id" not in fields:
+        fields["conversation_id"] = conversation_id
+    # makeRecord direto: evita o findCaller (inspeção da pilha) que logger.log faz a cada chamada
+    logger.handle(logger.makeRecord(logger.name, level, "", 0, event, None, None, extra={"fields": fields}))
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro: ts, level, logger, event e os campos estruturados."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para desenvolvimento local (LOG_FORMAT=text)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Só enfileira o registro: nada de formatação nem I/O na thread que loga (o loop de eventos).
+    Com a fila cheia o registro é descartado e contado, em vez de bloquear o turno.
+    """
+
+    dropped = 0
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # SimpleQueue não tem limite nem locks de Condition (put mais barato); o limite é conferido aqui
+        if self.queue.qsize() >= self.max_size:
+            _NonBlockingQueueHandler.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def _parse_sampling(spec: str) -> Dict[str, float]:
+    """"turn=1,clu=0.1" -> {"turn": 1.0, "clu": 0.1}"""
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            category, rate = item.split("=", 1)
+            rates[category.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(config, stream=None):
+    """
+    Configura o logger "tralhobot" conforme o DefaultConfig (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING,
+    LOG_REDACT, LOG_QUEUE_SIZE). Pode ser chamada mais de uma vez; só a primeira tem efeito.
+    """
+    global _listener, _sampling, _redact
+    if _listener is not None:
+        return
+
+    _sampling = _parse_sampling(config.LOG_SAMPLING)
+    _redact = config.LOG_REDACT
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(TextFormatter() if config.LOG_FORMAT == "text" else JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    # Campos que o formato não usa não precisam ser coletados em cada registro
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    logger = logging.getLogger(_ROOT_LOGGER)
+    logger.handlers = [_NonBlockingQueueHandler(log_queue, config.LOG_QUEUE_SIZE)]
+    logger.setLevel(config.LOG_LEVEL.upper())
+    logger.propagate = False
+
+
+def dropped_records() -> int:
+    return _NonBlockingQueueHandler.dropped
+
+
+# Benchmark do custo por turno na thread do bot (a que roda o loop de eventos): os prints de um
+# turno de Tralhobot versus os eventos estruturados equivalentes, com o nível em INFO e em DEBUG.
+# Duas saídas: /dev/null e uma saída lenta (coletor de logs com backpressure, 1 ms a cada 4 KB).
+# Uso: python log_utils.py [turnos]
+if __name__ == "__main__":
+    import io
+    import os
+
+    class _BenchConfig:
+        LOG_LEVEL = "INFO"
+        LOG_FORMAT = "json"
+        LOG_SAMPLING = ""
+        LOG_REDACT = True
+        LOG_QUEUE_SIZE = 100000
+
+    class _SlowSink(io.TextIOBase):
+        def __init__(self):
+            self._pending = 0
+
+        def write(self, data):
+            self._pending += len(data)
+            if self._pending >= 4096:
+                self._pending = 0
+                time.sleep(0.001)
+            return len(data)
+
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    text = "Olá, meu e-mail é ana@acme.com e preciso de ajuda com o Microsoft Teams"
+    prediction = {"topIntent": "SolicitarSuporte", "intents": [{"category": "SolicitarSuporte", "confidenceScore": 0.93}]}
+
+    def turn_with_print(out):
+        print(f"ON_TURN: Activity Type: message, User ID: user-1", file=out)
+        print(f"ON_MESSAGE_ACTIVITY: Mensagem do usuário: '{text}'", file=out)
+        print(f"ON_MESSAGE_ACTIVITY: Estados atuais - Suporte: 'none', SDR: 'none'", file=out)
+        print(f"RECOGNIZE_INTENT: CLU ativado. Chamando analyze_conversation.", file=out)
+        print(f"RECOGNIZE_INTENT: Resposta CLU processada (como dicionário direto): {prediction}", file=out)
+        print(f"CLU: Intenção detectada: 'SolicitarSuporte' com confiança: 0.93", file=out)
+        print(f"ON_MESSAGE_ACTIVITY: Entrando em fluxo de fallback (FAQ/padrão).", file=out)
+        print(f"ON_MESSAGE_ACTIVITY: Turn finished for activity type message.", file=out)
+
+    turn_logger, clu_logger = get_logger("turn"), get_logger("clu")
+
+    def turn_with_logging():
+        token = CONVERSATION_ID.set("conv-1")
+        log_event(turn_logger, logging.DEBUG, "message_received", text=redact(text))
+        log_event(turn_logger, logging.DEBUG, "states", support_state="none", sdr_state="none")
+        log_event(clu_logger, logging.DEBUG, "clu_call")
+        log_event(clu_logger, logging.INFO, "intent", source="clu", intent=prediction["topIntent"], confidence=0.93)
+        log_event(turn_logger, logging.DEBUG, "fallback")
+        log_event(turn_logger, logging.INFO, "turn", activity_type="message", latency_ms=1.2)
+        CONVERSATION_ID.reset(token)
+
+    def measure(run_turn):
+        durations = []
+        for _ in range(turns):
+            start = time.perf_counter()
+            run_turn()
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        return sum(durations) / turns * 1e6, durations[int(turns * 0.99)] * 1e6
+
+    devnull = open(os.devnull, "w")
+    setup_logging(_BenchConfig, devnull)
+    output_handler = _listener.handlers[0]
+    print(f"{'saída':<10} {'modo':<14} {'média us/turno':>15} {'p99 us/turno':>13}")
+    for sink_name, sink in (("/dev/null", devnull), ("lenta", _SlowSink())):
+        mean, p99 = measure(lambda: turn_with_print(sink))
+        print(f"{sink_name:<10} {'print()':<14} {mean:>15.1f} {p99:>13.1f}")
+        output_handler.setStream(sink)
+        for level in ("INFO", "DEBUG"):
+            logging.getLogger(_ROOT_LOGGER).setLevel(level)
+            mean, p99 = measure(turn_with_logging)
+            print(f"{sink_name:<10} {'logging ' + level:<14} {mean:>15.1f} {p99:>13.1f}")
+            while not _listener.queue.empty():  # Espera o listener escrever tudo antes da próxima medição
+                time.sleep(0.01)
+    print(f"registros descartados por fila cheia: {dropped_records()}")
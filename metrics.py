@@ -0,0 +1,311 @@
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Buckets em segundos: de 1 ms (classificador local, storage em memória) a 10 s (timeout do CLU/conector)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Contador por combinação de labels. Sem locks: as métricas do bot são registradas
+    apenas na thread do loop de eventos (aiohttp, ou o LOOP dedicado do app_flask).
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _sample_name(self) -> str:
+        return self.name + "_total"
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        sample_name = self._sample_name()
+        for labels, value in list(self._values.items()):
+            yield sample_name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """Valor que sobe e desce (ex: turnos em andamento)."""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def _sample_name(self) -> str:
+        return self.name
+
+
+class CallbackMetric:
+    """Valor lido na hora da coleta a partir de uma função (ex: atributos da TurnQueue)."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        yield self.name + ("_total" if self.kind == "counter" else ""), "", self.callback()
+
+
+class Histogram:
+    """
+    Histograma com buckets fixos. Cada combinação de labels ganha, na primeira observação,
+    uma lista de contagens pré-alocada; observe() só faz uma busca binária e dois incrementos.
+    As contagens acumuladas do formato Prometheus são montadas apenas na coleta.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}  # labels -> contagem por bucket (+Inf no fim)
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str):
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """Mede um bloco: `with HISTOGRAM.time("read"): ...`"""
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for labels, counts in list(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), list(counts)):
+                cumulative += count
+                le = f'le="{_format_value(bound) if bound != float("inf") else "+Inf"}"'
+                yield self.name + "_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), self._sums[labels]
+            yield self.name + "_count", _format_labels(self.labelnames, labels), cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        """Texto no formato de exposição do Prometheus (GET /metrics)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TURN_DURATION = REGISTRY.register(Histogram(
+    "tralhobot_turn_duration_seconds", "Duração de Tralhobot.on_turn.", ["activity_type"]))
+TURNS = REGISTRY.register(Counter(
+    "tralhobot_turns", "Turnos processados.", ["activity_type", "outcome"]))
+TURNS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "tralhobot_turns_in_flight", "Turnos em processamento neste worker."))
+INTENTS = REGISTRY.register(Counter(
+    "tralhobot_intents", "Turnos respondidos por intenção.", ["intent", "source"]))
+STATE_TRANSITIONS = REGISTRY.register(Counter(
+    "tralhobot_state_transitions", "Transições de estado dos fluxos de suporte e SDR.", ["flow", "from_state", "to_state"]))
+CLU_DURATION = REGISTRY.register(Histogram(
+    "tralhobot_clu_duration_seconds", "Duração das chamadas ao CLU (sem contar acertos de cache).", ["outcome"]))
+STORAGE_DURATION = REGISTRY.register(Histogram(
+    "tralhobot_storage_duration_seconds", "Duração das operações no storage de estado.", ["operation"]))
+SEND_DURATION = REGISTRY.register(Histogram(
+    "tralhobot_send_duration_seconds", "Duração do envio das respostas ao Bot Connector.", ["outcome"]))
+AUTH_DURATION = REGISTRY.register(Histogram(
+    "tralhobot_auth_duration_seconds", "Duração da autenticação das requisições recebidas.", ["outcome"]))
+ACTIVITY_FULL_DESERIALIZATIONS = REGISTRY.register(Counter(
+    "tralhobot_activity_full_deserializations", "Atividades recebidas que precisaram da desserialização completa do SDK."))
+AUTH_TOKEN_CACHE = REGISTRY.register(Counter(
+    "tralhobot_auth_token_cache", "Tokens do Bot Connector aceitos pela memória de tokens validados (hit) ou validados de novo (miss).", ["result"]))
+STATE_EVICTIONS = REGISTRY.register(Counter(
+    "tralhobot_state_evictions", "Conversas despejadas do storage em memória.", ["reason"]))
+STATE_COLD_READS = REGISTRY.register(Counter(
+    "tralhobot_state_cold_reads", "Conversas trazidas de volta da camada fria do storage em memória."))
+TRACE_SPANS_DROPPED = REGISTRY.register(Counter(
+    "tralhobot_trace_spans_dropped", "Spans descartados porque a fila de exportação estava cheia (ver tracing.py)."))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "tralhobot_rate_limited", "Turnos recusados pelo limitador (ver rate_limit.py), por motivo e resposta dada.", ["reason", "action"]))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "tralhobot_startup_seconds", "Segundos desde o início do processo até cada marco da subida do worker (ver startup.py).", ["stage"]))
+
+# Processo de frente do SERVER_MODE=sharded (ver sharded_server.py): registro à parte, porque o
+# /metrics dele junta estas séries às dos workers, que já trazem as do REGISTRY.
+SHARD_REGISTRY = Registry()
+SHARD_FORWARD_DURATION = SHARD_REGISTRY.register(Histogram(
+    "tralhobot_shard_forward_duration_seconds", "Duração do repasse de /api/messages ao worker da conversa.", ["worker", "outcome"]))
+SHARD_HELD = SHARD_REGISTRY.register(Counter(
+    "tralhobot_shard_held_requests", "Requisições que esperaram o worker da conversa reiniciar ou o rebalanceamento terminar.", ["worker"]))
+SHARD_RESTARTS = SHARD_REGISTRY.register(Counter(
+    "tralhobot_shard_restarts", "Workers reiniciados (crash, reinício gradual ou rebalanceamento).", ["reason"]))
+
+
+def register_turn_queue(turn_queue):
+    """Expõe a profundidade e os contadores da fila de turnos (se TURN_QUEUE_ENABLED)."""
+    if turn_queue is None:
+        return
+    for field, documentation, kind in (
+        ("depth", "Turnos aguardando na fila.", "gauge"),
+        ("in_progress", "Turnos da fila em execução.", "gauge"),
+        ("processed", "Turnos da fila processados.", "counter"),
+        ("duplicates", "Retentativas descartadas pelo activity id.", "counter"),
+        ("rejected", "Turnos recusados com 503 (fila cheia).", "counter"),
+    ):
+        REGISTRY.register(CallbackMetric(
+            f"tralhobot_turn_queue_{field}", documentation, lambda field=field: getattr(turn_queue, field), kind))
+
+
+def register_clu_client(clu_client):
+    """Expõe o estado do disjuntor do CLU e o prazo atual das chamadas (ver clu_utils.py)."""
+    if clu_client is None:
+        return
+    breaker = clu_client.breaker
+    if breaker is not None:
+        states = {breaker.CLOSED: 0, breaker.HALF_OPEN: 1, breaker.OPEN: 2}
+        REGISTRY.register(CallbackMetric(
+            "tralhobot_clu_circuit_state", "Estado do disjuntor do CLU (0 = fechado, 1 = em teste, 2 = aberto).",
+            lambda: states[breaker.state]))
+        REGISTRY.register(CallbackMetric(
+            "tralhobot_clu_circuit_trips", "Aberturas do disjuntor do CLU.", lambda: breaker.trips, "counter"))
+        REGISTRY.register(CallbackMetric(
+            "tralhobot_clu_circuit_rejected", "Chamadas ao CLU recusadas com o disjuntor aberto.", lambda: breaker.rejected, "counter"))
+    REGISTRY.register(CallbackMetric(
+        "tralhobot_clu_timeout_seconds", "Prazo atual das chamadas ao CLU.", lambda: clu_client.current_timeout))
+    if clu_client.budget is not None:
+        REGISTRY.register(CallbackMetric(
+            "tralhobot_clu_budget_rejected", "Chamadas ao CLU evitadas porque a cota (RATE_LIMIT_CLU_*) acabou.",
+            lambda: clu_client.budget.rejected, "counter"))
+
+
+def register_rate_limiter(rate_limiter):
+    """Expõe os turnos em processamento e os baldes guardados pelo limitador (se RATE_LIMIT_ENABLED)."""
+    if rate_limiter is None:
+        return
+    REGISTRY.register(CallbackMetric(
+        "tralhobot_rate_limit_in_flight", "Turnos em processamento contados pelo teto RATE_LIMIT_MAX_CONCURRENT_TURNS.",
+        lambda: rate_limiter.in_flight))
+    for name, buckets in (("users", rate_limiter.users), ("conversations", rate_limiter.conversations)):
+        if buckets is not None:
+            REGISTRY.register(CallbackMetric(
+                f"tralhobot_rate_limit_{name}_tracked", "Baldes de fichas guardados (os ociosos são descartados).",
+                lambda buckets=buckets: len(buckets)))
+
+
+def register_lead_sink(lead_sink):
+    """Expõe os contadores do LeadSink (se LEAD_SINK_ENABLED)."""
+    if lead_sink is None:
+        return
+    for field, documentation, kind in (
+        ("pending", "Leads aguardando gravação.", "gauge"),
+        ("emitted", "Leads emitidos pelo funil SDR.", "counter"),
+        ("written", "Leads gravados nos segmentos.", "counter"),
+        ("duplicates", "Leads descartados por id repetido (retentativas).", "counter"),
+        ("dropped", "Leads descartados com a fila cheia.", "counter"),
+        ("fsyncs", "Gravações duráveis (fsync) feitas.", "counter"),
+    ):
+        REGISTRY.register(CallbackMetric(
+            f"tralhobot_leads_{field}", documentation, lambda field=field: getattr(lead_sink, field), kind))
+
+
+def register_shard_server(server):
+    """Expõe quantos workers o processo de frente tem e quantos estão recebendo requisições (ver sharded_server.py)."""
+    SHARD_REGISTRY.register(CallbackMetric(
+        "tralhobot_shard_workers", "Workers no anel de hash.", lambda: len(server.workers)))
+    SHARD_REGISTRY.register(CallbackMetric(
+        "tralhobot_shard_workers_ready", "Workers recebendo requisições (fora de reinício ou drenagem).",
+        lambda: sum(1 for worker in server.workers if worker.ready.is_set())))
+
+
+def register_state_storage(storage):
+    """Expõe as conversas residentes e a memória estimada do storage em memória (STATE_STORAGE=memory)."""
+    storage = getattr(storage, "storage", storage)  # MeteredStorage
+    if not hasattr(storage, "stats"):
+        return
+    REGISTRY.register(CallbackMetric(
+        "tralhobot_state_resident_conversations", "Conversas guardadas na memória do worker.", lambda: storage.resident))
+    REGISTRY.register(CallbackMetric(
+        "tralhobot_state_memory_bytes", "Memória estimada das conversas residentes.", lambda: storage.memory_bytes))
+
+
+# Custo de registro por operação. Uso: python metrics.py
+if __name__ == "__main__":
+    import timeit
+
+    runs = 200000
+    counter = Counter("bench_counter", "bench", ["intent"])
+    histogram = Histogram("bench_histogram", "bench", ["operation"])
+    counter_ns = timeit.timeit(lambda: counter.inc("Saudacao"), number=runs) / runs * 1e9
+    observe_ns = timeit.timeit(lambda: histogram.observe(0.0123, "read"), number=runs) / runs * 1e9
+
+    def timed_block():
+        with histogram.time("write"):
+            pass
+
+    timer_ns = timeit.timeit(timed_block, number=runs) / runs * 1e9
+    print(f"Counter.inc:        {counter_ns:6.0f} ns")
+    print(f"Histogram.observe:  {observe_ns:6.0f} ns")
+    print(f"Histogram.time():   {timer_ns:6.0f} ns")
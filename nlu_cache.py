@@ -0,0 +1,206 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from keyword_matcher import fold_text
+
+
+def normalize_utterance(text: str) -> str:
+    """'  Olá!! ' e 'ola' viram a mesma chave: sem acento, minúsculas, sem pontuação e espaços extras."""
+    return " ".join(re.sub(r"[^\w\s]", " ", fold_text(text)).split())
+
+
+class NLUCache:
+    """
+    Cache de respostas do CLU com expiração (TTL) e limite de tamanho (LRU).
+
+    - Chave: texto normalizado + projeto + deployment do CLU.
+    - Single-flight: chamadas simultâneas com a mesma chave aguardam a mesma requisição.
+    - Opcionalmente consulta/grava também em um Storage compartilhado (SQLite/Redis),
+      para que os workers aproveitem as respostas uns dos outros. As linhas compartilhadas
+      expiram no próprio Redis (PEXPIRE); nos outros Storages, a linha vencida é apagada
+      quando alguém a lê e as gravadas por este processo são apagadas por uma varredura.
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 3600, shared_storage=None,
+                 shared_prefix: str = "clu-cache/", sweep_seconds: float = 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_storage = shared_storage
+        self.shared_prefix = shared_prefix
+        self._entries = OrderedDict()  # chave -> (expira_em, resposta)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # Linhas compartilhadas gravadas por este processo sem expiração nativa: chave -> expira_em
+        # (TTL fixo, então a ordem de gravação é a ordem de expiração)
+        self._shared_written: "OrderedDict[str, float]" = OrderedDict()
+        self.sweep_seconds = sweep_seconds
+        self._next_sweep = 0.0
+        self.hits = 0
+        self.shared_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str, project_name: str, deployment_name: str) -> str:
+        return f"{project_name}|{deployment_name}|{normalize_utterance(text)}"
+
+    def _get_local(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_local(self, key: str, result, ttl: float = None):
+        self._entries[key] = (time.monotonic() + (self.ttl_seconds if ttl is None else ttl), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_shared(self, key: str):
+        storage_key = self.shared_prefix + key
+        item = (await self.shared_storage.read([storage_key])).get(storage_key)
+        if not item:
+            return None, 0
+        if item.get("expires_at", 0) < time.time():
+            await self.shared_storage.delete([storage_key])
+            return None, 0
+        return item.get("result"), item["expires_at"] - time.time()
+
+    async def _put_shared(self, key: str, result):
+        storage_key = self.shared_prefix + key
+        expires_at = time.time() + self.ttl_seconds
+        await self.shared_storage.write({storage_key: {"result": result, "expires_at": expires_at}})
+        expire = getattr(self.shared_storage, "expire", None)
+        if expire is not None and await expire([storage_key], self.ttl_seconds):
+            return
+        self._shared_written[storage_key] = expires_at
+        self._shared_written.move_to_end(storage_key)
+        await self._sweep_shared()
+
+    async def _sweep_shared(self):
+        """Apaga as linhas compartilhadas vencidas; acima de max_entries, apaga as mais antigas antes da hora."""
+        now = time.time()
+        overflow = len(self._shared_written) > self.max_entries
+        if now < self._next_sweep and not overflow:
+            return
+        self._next_sweep = now + self.sweep_seconds
+        expired = []
+        for storage_key, expires_at in self._shared_written.items():
+            if expires_at >= now and len(self._shared_written) - len(expired) <= self.max_entries:
+                break
+            expired.append(storage_key)
+        for storage_key in expired:
+            del self._shared_written[storage_key]
+        if expired:
+            await self.shared_storage.delete(expired)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]):
+        """Retorna a resposta em cache ou chama compute() uma única vez por chave. Exceções não são guardadas."""
+        result = self._get_local(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if self.shared_storage is not None:
+                result, remaining_ttl = await self._get_shared(key)
+                if result is not None:
+                    self.shared_hits += 1
+                    self._put_local(key, result, remaining_ttl)
+                    future.set_result(result)
+                    return result
+
+            self.misses += 1
+            result = await compute()
+            self._put_local(key, result)
+            if self.shared_storage is not None:
+                await self._put_shared(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # Marca como lida se ninguém mais estiver aguardando
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.shared_hits + self.coalesced + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+
+def create_nlu_cache(config, storage=None) -> Optional[NLUCache]:
+    """Cria o cache do CLU conforme o DefaultConfig (None se CLU_CACHE_MAX_ENTRIES for 0)."""
+    if config.CLU_CACHE_MAX_ENTRIES <= 0:
+        return None
+    return NLUCache(
+        config.CLU_CACHE_MAX_ENTRIES,
+        config.CLU_CACHE_TTL_SECONDS,
+        storage if config.CLU_CACHE_SHARED else None,
+    )
+
+
+# Replay de um log de frases (uma por linha) contra um CLU simulado com latência,
+# com e sem cache. Uso: python nlu_cache.py frases.txt [latencia_ms] [concorrencia]
+if __name__ == "__main__":
+    import argparse
+
+    async def _replay(utterances, latency: float, concurrency: int, cache: Optional[NLUCache]):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def fake_clu():
+            await asyncio.sleep(latency)
+            return {"result": {"prediction": {"topIntent": "None"}}}
+
+        async def one(text):
+            async with semaphore:
+                start = time.perf_counter()
+                if cache is None:
+                    await fake_clu()
+                else:
+                    await cache.get_or_compute(NLUCache.make_key(text, "projeto", "deployment"), fake_clu)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one(text) for text in utterances))
+        latencies.sort()
+        return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+    parser = argparse.ArgumentParser(description="Replay de um log de frases contra um CLU simulado, com e sem cache.")
+    parser.add_argument("utterances", help="Arquivo com uma frase por linha")
+    parser.add_argument("latency_ms", type=float, nargs="?", default=300, help="Latência do CLU simulado (padrão: 300)")
+    parser.add_argument("concurrency", type=int, nargs="?", default=20, help="Frases em paralelo (padrão: 20)")
+    args = parser.parse_args()
+
+    with open(args.utterances, encoding="utf-8") as log_file:
+        utterances = [line.strip() for line in log_file if line.strip()]
+    latency = args.latency_ms / 1000
+    concurrency = args.concurrency
+
+    p50, p99 = asyncio.run(_replay(utterances, latency, concurrency, None))
+    print(f"Sem cache: {len(utterances)} chamadas ao CLU | p50 {p50:.1f} ms | p99 {p99:.1f} ms")
+    cache = NLUCache()
+    p50, p99 = asyncio.run(_replay(utterances, latency, concurrency, cache))
+    print(f"Com cache: {cache.misses} chamadas ao CLU | p50 {p50:.1f} ms | p99 {p99:.1f} ms | {cache.stats()}")
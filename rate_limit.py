@@ -0,0 +1,298 @@
+"""
+Controle de admissão do /api/messages: limites por remetente, por conversa e de turnos simultâneos.
+
+Um cliente falante (ou um script) mandando centenas de mensagens por segundo gastaria chamadas ao
+CLU, gravações de estado e respostas ao canal, e deixaria os usuários reais esperando. Depois da
+autenticação (assim um from.id forjado não esvazia o balde de um usuário real), cada atividade passa
+por:
+
+* um balde de fichas por remetente (canal + from.id) e outro por conversation.id
+  (RATE_LIMIT_USER_* e RATE_LIMIT_CONVERSATION_*);
+* um limite de turnos em processamento no worker (RATE_LIMIT_MAX_CONCURRENT_TURNS).
+
+O turno acima do limite não chega ao Tralhobot (nada de CLU nem de estado): com RATE_LIMIT_ACTION=reply
+a primeira mensagem recusada recebe RATE_LIMIT_REPLY e as seguintes, até o balde encher de novo,
+recebem 429 com Retry-After; com RATE_LIMIT_ACTION=429, todas recebem 429. O excesso de turnos
+simultâneos sempre recebe 429.
+
+A cota do CLU tem um balde próprio (RATE_LIMIT_CLU_*), usado pelo AsyncCLUClient: sem fichas, o CLU
+não é chamado e o bot responde com o classificador local, como com o disjuntor aberto.
+
+Cada verificação é O(1): os baldes ficam numa OrderedDict em ordem de uso, e os parados há tempo
+suficiente para estarem cheios de novo (descartá-los não muda nada) saem pela frente, sem varredura;
+acima de RATE_LIMIT_MAX_KEYS os menos recentes são descartados. Como os demais componentes do turno,
+o limitador só é usado na thread do loop de eventos, então não tem travas.
+
+Custo por requisição e memória com um milhão de remetentes: python rate_limit.py
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from log_utils import get_logger
+from metrics import RATE_LIMITED
+
+LOGGER = get_logger("rate_limit")
+
+_TOKENS, _REFILLED_AT, _NOTIFIED = range(3)
+
+
+class RateLimited(Exception):
+    """Turno recusado pelo limitador; o endpoint responde 429 com Retry-After."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"limite de {reason} excedido")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Um balde de fichas (ex: a cota do CLU): `rate` fichas por segundo, até `burst` acumuladas."""
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self._clock = clock
+        self._refilled_at = clock()
+        self.rejected = 0
+
+    def try_take(self) -> bool:
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.rejected += 1
+        return False
+
+
+class KeyedTokenBuckets:
+    """
+    Um balde de fichas por chave, com memória limitada. Cada entrada é uma lista
+    [fichas, instante da última recarga, já avisado] numa OrderedDict em ordem de uso.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        if max_keys < 1:
+            # Com 0 a chave recém-criada seria a primeira descartada e take() falharia
+            raise ValueError(f"max_keys deve ser pelo menos 1 (recebido {max_keys}).")
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self.full_after = self.burst / rate  # Parado por mais que isso, o balde está cheio: pode ser descartado
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def wait_time(self, key: str, now: float) -> float:
+        """Recarrega o balde da chave e devolve quanto falta para ele ter uma ficha (0 = pode passar)."""
+        buckets = self._buckets
+        entry = buckets.get(key)
+        if entry is None:
+            entry = buckets[key] = [self.burst, now, False]
+            self._evict(now)
+        else:
+            buckets.move_to_end(key)
+            entry[_TOKENS] = min(self.burst, entry[_TOKENS] + (now - entry[_REFILLED_AT]) * self.rate)
+            entry[_REFILLED_AT] = now
+            if entry[_TOKENS] >= self.burst:
+                entry[_NOTIFIED] = False  # O remetente se acalmou: a próxima rajada recebe o aviso de novo
+        tokens = entry[_TOKENS]
+        return 0.0 if tokens >= 1.0 else (1.0 - tokens) / self.rate
+
+    def take(self, key: str):
+        """Gasta uma ficha (depois de wait_time() == 0 para a mesma chave)."""
+        self._buckets[key][_TOKENS] -= 1.0
+
+    def notify_once(self, key: str) -> bool:
+        """True só na primeira recusa desde que o balde esteve cheio: o aviso ao usuário vai uma vez por rajada."""
+        entry = self._buckets[key]
+        first, entry[_NOTIFIED] = not entry[_NOTIFIED], True
+        return first
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        # No máximo duas saídas por chave nova: O(1) amortizado, sem varredura
+        for _ in range(2):
+            key, entry = next(iter(buckets.items()))
+            if len(buckets) > self.max_keys or now - entry[_REFILLED_AT] >= self.full_after:
+                del buckets[key]
+                self.evicted += 1
+            else:
+                break
+
+
+class RateLimiter:
+    """Limites por remetente e por conversa e teto de turnos simultâneos (ver a descrição do módulo)."""
+
+    def __init__(self, user_rate: float, user_burst: float, conversation_rate: float, conversation_burst: float,
+                 max_keys: int = 100000, max_concurrent: int = 0, action: str = "reply", reply_text: str = "",
+                 clock: Callable[[], float] = time.monotonic):
+        self.users = KeyedTokenBuckets(user_rate, user_burst, max_keys) if user_rate > 0 else None
+        self.conversations = KeyedTokenBuckets(conversation_rate, conversation_burst, max_keys) if conversation_rate > 0 else None
+        self.max_concurrent = max_concurrent
+        self.reply = action == "reply" and bool(reply_text)
+        self.reply_text = reply_text
+        self._clock = clock
+        self.in_flight = 0
+
+    def check(self, user_key: str, conversation_key: str, notify: bool = True) -> Optional[str]:
+        """
+        None se o turno pode seguir (e gasta as fichas dele). Senão lança RateLimited ou, se esta é a
+        primeira recusa da rajada (e `notify`), devolve o motivo: o remetente recebe a mensagem de limite.
+        """
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            raise RateLimited("busy", 1.0)
+        now = self._clock()
+        users, conversations = self.users, self.conversations
+        user_wait = users.wait_time(user_key, now) if users is not None else 0.0
+        conversation_wait = conversations.wait_time(conversation_key, now) if conversations is not None else 0.0
+        if not (user_wait or conversation_wait):
+            if users is not None:
+                users.take(user_key)
+            if conversations is not None:
+                conversations.take(conversation_key)
+            return None
+        if user_wait >= conversation_wait:
+            reason, buckets, key, wait = "user", users, user_key, user_wait
+        else:
+            reason, buckets, key, wait = "conversation", conversations, conversation_key, conversation_wait
+        if notify and self.reply and buckets.notify_once(key):
+            return reason
+        raise RateLimited(reason, wait)
+
+    def admit(self, activity, logic: Callable) -> Callable:
+        """
+        Chamado pelo adaptador depois da autenticação: devolve a lógica do turno a executar (o
+        Tralhobot, contado nos turnos simultâneos, ou a mensagem de limite) ou lança RateLimited.
+        """
+        user = activity.from_property.id if activity.from_property else ""
+        conversation = activity.conversation.id if activity.conversation else ""
+        try:
+            reason = self.check(f"{activity.channel_id}/{user}", conversation, activity.type == "message")
+        except RateLimited as e:
+            RATE_LIMITED.inc(e.reason, "429")
+            raise
+        if reason is None:
+            return self._counted(logic)
+        RATE_LIMITED.inc(reason, "reply")
+        return self._limited_reply
+
+    def _counted(self, logic: Callable) -> Callable:
+        async def run(turn_context):
+            self.in_flight += 1
+            try:
+                return await logic(turn_context)
+            finally:
+                self.in_flight -= 1
+        return run
+
+    async def _limited_reply(self, turn_context):
+        # Sem estado, sem CLU: só a resposta pronta
+        await turn_context.send_activity(self.reply_text)
+
+
+def create_rate_limiter(config) -> Optional[RateLimiter]:
+    """Cria o limitador conforme o DefaultConfig (RATE_LIMIT_*), ou None se RATE_LIMIT_ENABLED for false."""
+    if not config.RATE_LIMIT_ENABLED:
+        return None
+    action = (config.RATE_LIMIT_ACTION or "reply").lower()
+    if action not in ("reply", "429"):
+        LOGGER.warning("RATE_LIMIT_ACTION '%s' desconhecido. Usando 'reply'.", action)
+        action = "reply"
+    return RateLimiter(config.RATE_LIMIT_USER_PER_SECOND, config.RATE_LIMIT_USER_BURST,
+                       config.RATE_LIMIT_CONVERSATION_PER_SECOND, config.RATE_LIMIT_CONVERSATION_BURST,
+                       config.RATE_LIMIT_MAX_KEYS, config.RATE_LIMIT_MAX_CONCURRENT_TURNS, action, config.RATE_LIMIT_REPLY)
+
+
+def create_clu_budget(config) -> Optional[TokenBucket]:
+    """Balde da cota do CLU (RATE_LIMIT_CLU_PER_SECOND; 0 = sem limite)."""
+    if not (config.RATE_LIMIT_ENABLED and config.RATE_LIMIT_CLU_PER_SECOND > 0):
+        return None
+    return TokenBucket(config.RATE_LIMIT_CLU_PER_SECOND, config.RATE_LIMIT_CLU_BURST)
+
+
+# Custo por requisição, memória limitada e isolamento de um cliente falante. Uso: python rate_limit.py
+if __name__ == "__main__":
+    import tracemalloc
+
+    now = [0.0]
+    clock = lambda: now[0]  # noqa: E731 - relógio simulado: o teste não depende da velocidade da máquina
+
+    # Um script a 500 mensagens/s numa conversa e 50 pessoas a uma mensagem a cada 2 s, durante 10 s
+    limiter = RateLimiter(2.0, 20, 2.0, 20, max_keys=1000, action="reply", reply_text="Devagar", clock=clock)
+    admitted = {"script": 0, "people": 0}
+    notices = rejected = 0
+    for tick in range(5000):
+        now[0] = tick / 500
+        senders = [("script", "bot-42", "conv-script")]
+        if tick % 1000 == 0:
+            senders += [("people", f"user-{index}", f"conv-{index}") for index in range(50)]
+        for kind, user, conversation in senders:
+            try:
+                reason = limiter.check(user, conversation)
+            except RateLimited:
+                rejected += 1
+                continue
+            if reason is None:
+                admitted[kind] += 1
+            else:
+                notices += 1
+    print(f"Script a 500 msg/s por 10 s: {admitted['script']} turnos admitidos, 1 aviso ({notices}), {rejected} recusas com 429")
+    print(f"50 pessoas a 0,5 msg/s: {admitted['people']} de 250 turnos admitidos")
+    assert admitted["people"] == 250
+    assert admitted["script"] <= 20 + 2 * 10 + 1 and notices == 1
+
+    # Turnos simultâneos
+    busy = RateLimiter(0, 0, 0, 0, max_concurrent=2, clock=clock)
+    busy.in_flight = 2
+    try:
+        busy.check("a", "b")
+        raise AssertionError("o teto de turnos simultâneos não foi aplicado")
+    except RateLimited as e:
+        assert e.reason == "busy" and e.retry_after_header == "1"
+
+    try:
+        RateLimiter(2.0, 20, 2.0, 20, max_keys=0)
+        raise AssertionError("max_keys=0 foi aceito")
+    except ValueError:
+        pass
+
+    # Memória limitada: um milhão de remetentes diferentes, cada um com uma mensagem
+    tracemalloc.start()
+    limiter = RateLimiter(2.0, 20, 2.0, 20, max_keys=100000, clock=clock)
+    for index in range(1000000):
+        now[0] = index / 100000  # 100 mil remetentes novos por segundo
+        limiter.check(f"emulator/user-{index}", f"conv-{index}")
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"1 milhão de remetentes: {len(limiter.users)} baldes guardados por tipo "
+          f"({limiter.users.evicted} descartados), memória {current / 1e6:.1f} MB (pico {peak / 1e6:.1f} MB)")
+    assert len(limiter.users) <= 100000 and len(limiter.conversations) <= 100000
+
+    # Custo por requisição (relógio real): chaves já conhecidas e chaves novas
+    limiter = RateLimiter(1e9, 1e9, 1e9, 1e9, max_keys=100000)
+    keys = [(f"emulator/user-{index}", f"conv-{index}") for index in range(100000)]
+    for user, conversation in keys:
+        limiter.check(user, conversation)
+    for label, sample in (("remetentes conhecidos", keys), ("remetentes novos", [(u + "-n", c + "-n") for u, c in keys])):
+        started = time.perf_counter()
+        for user, conversation in sample:
+            limiter.check(user, conversation)
+        print(f"check() com {label}: {(time.perf_counter() - started) / len(sample) * 1e9:.0f} ns/requisição")
+
+    bucket, runs = TokenBucket(1e9, 1e9), 1000000
+    started = time.perf_counter()
+    for _ in range(runs):
+        bucket.try_take()
+    print(f"Cota do CLU (try_take): {(time.perf_counter() - started) / runs * 1e9:.0f} ns/chamada")
+    print("OK")
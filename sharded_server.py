@@ -0,0 +1,562 @@
+"""
+Vários processos do bot com afinidade de conversa (SERVER_MODE=sharded).
+
+Com STATE_STORAGE=memory o estado das conversas fica no processo: o gunicorn com mais de um
+worker mandaria turnos da mesma conversa para processos diferentes e quebraria o funil SDR no
+meio. Aqui um processo de frente (aiohttp na PORT, sem importar o SDK) sobe SHARD_WORKERS
+processos do app.py, cada um com seu Tralhobot, sua fila de turnos e sua fatia do storage em
+memória, escutando num socket unix. O /api/messages lê só o conversation.id do corpo e repassa
+a requisição (corpo e Authorization intactos: quem autentica é o worker) por uma conexão
+keep-alive ao worker dono da conversa num anel de hash consistente.
+
+Reinício e rebalanceamento:
+* As conversas passam de um worker para outro pela camada fria em SQLite (STATE_MEMORY_COLD_PATH
+  ou, se ela não estiver configurada, SHARD_STATE_PATH): ao receber SIGTERM o worker conclui a
+  fila de turnos e grava nela as conversas residentes; o novo dono as lê no próximo turno.
+* Um worker que morre é reiniciado (com espera crescente se morrer logo ao subir). As requisições
+  da fatia dele esperam até SHARD_HOLD_SECONDS em vez de irem para outro worker, que não tem o estado
+  (as conversas que ainda não tinham ido para a camada fria voltam do último estado gravado nela).
+* SIGHUP ou `POST /admin/shards?action=restart` reinicia os workers um de cada vez: só a fatia do
+  worker que está drenando espera.
+* `POST /admin/shards?workers=M` muda o número de workers. O anel muda junto, então todos drenam
+  ao mesmo tempo (as requisições esperam) e os M novos assumem com o estado na camada fria.
+As rotas /admin/shards exigem o ADMIN_TOKEN.
+
+O /metrics junta as séries dos workers (com o label worker="i") às do repasse; /healthz,
+/api/queue e /warmup respondem por worker.
+
+Uso:
+    python sharded_server.py                          # SHARD_WORKERS workers na PORT
+    python sharded_server.py check                    # distribuição do anel e conversas movidas ao crescer
+    python sharded_server.py bench --workers 1,2,4,8  # turnos/s por número de workers (via loadtest.py)
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, UnixConnector, web
+from aiohttp.web import Request, Response, json_response
+
+from config import DefaultConfig
+from log_utils import get_logger, setup_logging
+from metrics import CONTENT_TYPE, SHARD_FORWARD_DURATION, SHARD_HELD, SHARD_REGISTRY, SHARD_RESTARTS, register_shard_server
+from tracing import admin_authorized
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - orjson é opcional
+    _loads = json.loads
+
+LOGGER = get_logger("shards")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_SCRIPT = os.path.join(BASE_DIR, "app.py")
+WORKER_URL = "http://shard"  # O host é ignorado: a conexão vai pelo socket unix do worker
+FORWARD_HEADERS = ("Content-Type", "Authorization")  # Repassados ao worker
+REPLY_HEADERS = ("Content-Type", "Retry-After")  # Devolvidos ao canal
+FAN_OUT_TIMEOUT = ClientTimeout(total=10)
+CRASH_BACKOFF_MAX = 30.0  # Espera máxima entre reinícios de um worker que morre logo ao subir
+STABLE_SECONDS = 10.0  # Um worker que viveu mais que isso volta a ser reiniciado na hora
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anel de hash consistente: de N para N+1 workers, só cerca de 1/(N+1) das conversas muda de dono."""
+
+    def __init__(self, nodes: int, vnodes: int = 128):
+        points = sorted((_hash(f"worker-{node}#{replica}"), node) for node in range(nodes) for replica in range(vnodes))
+        self.nodes = nodes
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node(self, key: str) -> int:
+        return self._owners[bisect.bisect(self._hashes, _hash(key)) % len(self._owners)]
+
+
+def conversation_id(body: bytes) -> str:
+    """conversation.id do corpo de /api/messages ("" se não for uma atividade: o worker responde o erro)."""
+    try:
+        return str(_loads(body)["conversation"]["id"])
+    except Exception:  # pylint: disable=broad-except
+        return ""
+
+
+def _add_label(sample: str, label: str) -> str:
+    brace, space = sample.find("{"), sample.find(" ")
+    if brace != -1 and (space == -1 or brace < space):
+        return f"{sample[:brace + 1]}{label},{sample[brace + 1:]}"
+    return f"{sample[:space]}{{{label}}}{sample[space:]}"
+
+
+def merge_metrics(expositions: List[Tuple[str, str]]) -> str:
+    """Junta o /metrics de cada worker numa exposição só: HELP/TYPE uma vez por família e o label worker em cada série."""
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for worker, text in expositions:
+        label = f'worker="{worker}"'
+        name = None
+        for line in text.splitlines():
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) < 3:
+                    continue
+                name = parts[2]
+                family = headers.setdefault(name, [])
+                samples.setdefault(name, [])
+                if len(family) < 2 and line not in family:
+                    family.append(line)
+            elif line and name is not None:
+                samples[name].append(_add_label(line, label))
+    lines = []
+    for name, family in headers.items():
+        lines.extend(family)
+        lines.extend(samples[name])
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class ShardWorker:
+    """Um processo do app.py escutando num socket unix, com a sua sessão HTTP keep-alive."""
+
+    def __init__(self, index: int, socket_path: str, env: Dict[str, str]):
+        self.index = index
+        self.label = str(index)
+        self.socket_path = socket_path
+        self.env = {**env, "SHARD_SOCKET": socket_path}
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.session: Optional[ClientSession] = None
+        self.ready = asyncio.Event()  # Recebendo requisições (limpo enquanto reinicia ou drena)
+        self.stopping = False
+        self.started_at = 0.0
+        self.restarts = 0
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def enter(self):
+        self.in_flight += 1
+        self._idle.clear()
+
+    def leave(self):
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._idle.set()
+
+    async def start(self, timeout: float):
+        """Sobe o processo e espera o socket aceitar conexões (a montagem do bot continua dentro do worker)."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.stopping = False
+        # Sessão própria do worker: o Ctrl+C do terminal não chega nele, quem ordena a drenagem é o processo de frente
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, APP_SCRIPT, env=self.env, cwd=BASE_DIR, start_new_session=True)
+        self.started_at = time.monotonic()
+        # Sessão nova a cada processo: conexões keep-alive para o anterior estariam mortas
+        self.session = ClientSession(connector=UnixConnector(path=self.socket_path, limit=0),
+                                     timeout=ClientTimeout(total=None, sock_connect=5))
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.returncode is not None:
+                raise RuntimeError(f"o worker {self.index} terminou com código {self.process.returncode} ao subir")
+            try:
+                async with self.session.get(f"{WORKER_URL}/healthz") as response:
+                    await response.read()  # Qualquer status serve: um worker montando o bot segura a requisição
+                break
+            except (ClientError, OSError):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"o worker {self.index} não abriu o socket em {timeout:.0f} s") from None
+                await asyncio.sleep(0.05)
+        self.ready.set()
+        LOGGER.info("Worker %s (pid %s) pronto em %s", self.index, self.process.pid, self.socket_path)
+
+    async def stop(self, timeout: float):
+        """SIGTERM: o app.py conclui a fila de turnos e grava as conversas residentes na camada fria."""
+        self.stopping = True
+        self.ready.clear()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            LOGGER.warning("Worker %s ainda tinha %s requisições em andamento ao drenar.", self.index, self.in_flight)
+        process = self.process
+        if process is not None and process.returncode is None:
+            try:
+                process.terminate()
+                await asyncio.wait_for(process.wait(), timeout)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                LOGGER.warning("Worker %s não terminou em %.0f s; enviando SIGKILL.", self.index, timeout)
+                process.kill()
+                await process.wait()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def status(self) -> Dict:
+        alive = self.process is not None and self.process.returncode is None
+        return {"worker": self.index, "pid": self.process.pid if alive else None, "ready": self.ready.is_set(),
+                "in_flight": self.in_flight, "restarts": self.restarts}
+
+
+class ShardServer:
+    """Processo de frente: anel de hash, repasse por socket unix e supervisão dos workers."""
+
+    def __init__(self, config, workers: int = 0):
+        self.config = config
+        self._own_socket_dir = not config.SHARD_SOCKET_DIR
+        self.socket_dir = config.SHARD_SOCKET_DIR or tempfile.mkdtemp(prefix="tralhobot-shards-")
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.env = self._worker_env()
+        count = max(workers or config.SHARD_WORKERS, 1)
+        self.ring = HashRing(count, config.SHARD_VNODES)
+        self.workers: List[ShardWorker] = [self._new_worker(index, count) for index in range(count)]
+        self.closing = False
+        self._admin_lock = asyncio.Lock()
+        self._tasks = set()
+        register_shard_server(self)
+
+    def _worker_env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        if (self.config.STATE_STORAGE or "memory").lower() == "memory" and not self.config.STATE_MEMORY_COLD_PATH:
+            if self.config.SHARD_STATE_PATH:
+                env["STATE_MEMORY_COLD_PATH"] = self.config.SHARD_STATE_PATH
+            else:
+                LOGGER.warning("Sem SHARD_STATE_PATH nem STATE_MEMORY_COLD_PATH: reinícios e rebalanceamentos perdem o estado das conversas.")
+        return env
+
+    def _share_limits(self, count: int) -> Dict[str, str]:
+        """
+        Os tetos globais do rate_limit.py valem por processo: cada worker recebe 1/count deles.
+        Os limites por remetente e por conversa não mudam (a conversa fica sempre no mesmo worker).
+        """
+        config = self.config
+        limits = {}
+        if config.RATE_LIMIT_MAX_CONCURRENT_TURNS > 0:
+            limits["RATE_LIMIT_MAX_CONCURRENT_TURNS"] = str(max(1, -(-config.RATE_LIMIT_MAX_CONCURRENT_TURNS // count)))
+        if config.RATE_LIMIT_CLU_PER_SECOND > 0:
+            limits["RATE_LIMIT_CLU_PER_SECOND"] = repr(config.RATE_LIMIT_CLU_PER_SECOND / count)
+            limits["RATE_LIMIT_CLU_BURST"] = repr(max(1.0, config.RATE_LIMIT_CLU_BURST / count))
+        return limits
+
+    def _new_worker(self, index: int, count: int) -> ShardWorker:
+        env = {**self.env, **self._share_limits(count)}
+        return ShardWorker(index, os.path.join(self.socket_dir, f"worker-{index}.sock"), env)
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # --------------------------------------------------
+    # Ciclo de vida dos workers
+    # --------------------------------------------------
+    async def _launch(self, worker: ShardWorker):
+        try:
+            await worker.start(self.config.SHARD_START_TIMEOUT_SECONDS)
+        except Exception as e:  # pylint: disable=broad-except
+            LOGGER.error("Falha ao subir o worker %s: %s", worker.index, e)
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.kill()
+        self._spawn(self._supervise(worker, worker.process))
+
+    async def _supervise(self, worker: ShardWorker, process):
+        """Reinicia o worker se o processo morrer fora de uma drenagem pedida."""
+        backoff = 0.5
+        while process is not None:
+            code = await process.wait()
+            if worker.stopping or self.closing or worker.process is not process:
+                return
+            worker.ready.clear()
+            if worker.session is not None:
+                await worker.session.close()
+                worker.session = None
+            backoff = 0.5 if time.monotonic() - worker.started_at > STABLE_SECONDS else min(backoff * 2, CRASH_BACKOFF_MAX)
+            LOGGER.error("Worker %s (pid %s) terminou com código %s; reiniciando em %.1f s.", worker.index, process.pid, code, backoff)
+            SHARD_RESTARTS.inc("crash")
+            worker.restarts += 1
+            await asyncio.sleep(backoff)
+            if worker.stopping or self.closing:
+                return
+            try:
+                await worker.start(self.config.SHARD_START_TIMEOUT_SECONDS)
+            except Exception as e:  # pylint: disable=broad-except
+                LOGGER.error("Falha ao reiniciar o worker %s: %s", worker.index, e)
+                if worker.process.returncode is None:
+                    worker.process.kill()
+            process = worker.process
+
+    async def start(self, app: web.Application = None):
+        """Sobe todos os workers antes de o processo de frente abrir a porta."""
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: self._spawn(self.restart()))
+        await asyncio.gather(*(self._launch(worker) for worker in self.workers))
+        LOGGER.info("%s workers prontos (sockets em %s)", len(self.workers), self.socket_dir)
+
+    async def close(self, app: web.Application = None):
+        """Drena todos os workers: conclui as requisições repassadas, a fila de turnos e grava o estado."""
+        self.closing = True
+        await asyncio.gather(*(worker.stop(self.config.SHARD_DRAIN_SECONDS) for worker in self.workers))
+        for task in list(self._tasks):
+            task.cancel()
+        if self._own_socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    async def restart(self):
+        """Reinício gradual (SIGHUP): um worker por vez; as outras fatias continuam atendendo."""
+        async with self._admin_lock:
+            for worker in list(self.workers):
+                if self.closing:
+                    return
+                LOGGER.info("Reiniciando o worker %s", worker.index)
+                await worker.stop(self.config.SHARD_DRAIN_SECONDS)
+                SHARD_RESTARTS.inc("rolling")
+                worker.restarts += 1
+                await self._launch(worker)
+
+    async def resize(self, count: int):
+        """Troca o número de workers: todos drenam para a camada fria e o anel novo passa a valer com os M novos."""
+        async with self._admin_lock:
+            if self.closing:
+                return
+            started = time.perf_counter()
+            old = self.workers
+            await asyncio.gather(*(worker.stop(self.config.SHARD_DRAIN_SECONDS) for worker in old))
+            workers = [self._new_worker(index, count) for index in range(count)]
+            await asyncio.gather(*(self._launch(worker) for worker in workers))
+            self.ring = HashRing(count, self.config.SHARD_VNODES)
+            self.workers = workers
+            SHARD_RESTARTS.inc("resize", amount=len(workers))
+            LOGGER.info("Rebalanceado de %s para %s workers em %.2f s", len(old), count, time.perf_counter() - started)
+
+    # --------------------------------------------------
+    # Roteamento
+    # --------------------------------------------------
+    async def route(self, key: str) -> Optional[ShardWorker]:
+        """Worker dono da conversa; se ele estiver reiniciando, espera até SHARD_HOLD_SECONDS (None = desistiu)."""
+        worker = self.workers[self.ring.node(key)]
+        if worker.ready.is_set():
+            return worker
+        SHARD_HELD.inc(worker.label)
+        deadline = time.monotonic() + self.config.SHARD_HOLD_SECONDS
+        while not self.closing:
+            # O anel e a lista de workers podem ter sido trocados (rebalanceamento): resolve de novo a cada espera
+            worker = self.workers[self.ring.node(key)]
+            if worker.ready.is_set():
+                return worker
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(worker.ready.wait(), min(remaining, 0.25))
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def messages(self, req: Request) -> Response:
+        """Repassa a atividade ao worker dono da conversa e devolve a resposta dele."""
+        body = await req.read()
+        worker = await self.route(conversation_id(body))
+        if worker is None:
+            return Response(status=503, headers={"Retry-After": "1"})
+        worker.enter()
+        started, outcome = time.perf_counter(), "unavailable"
+        try:
+            headers = {name: req.headers[name] for name in FORWARD_HEADERS if name in req.headers}
+            async with worker.session.post(f"{WORKER_URL}/api/messages", data=body, headers=headers) as response:
+                payload = await response.read()
+                outcome = "error" if response.status >= 500 else "ok"
+                return Response(status=response.status, body=payload,
+                                headers={name: response.headers[name] for name in REPLY_HEADERS if name in response.headers})
+        except (ClientError, OSError) as e:
+            LOGGER.warning("Falha ao repassar ao worker %s: %s", worker.index, e)
+            return Response(status=503, headers={"Retry-After": "1"})  # O canal tenta de novo; o worker está sendo reiniciado
+        finally:
+            worker.leave()
+            SHARD_FORWARD_DURATION.observe(time.perf_counter() - started, worker.label, outcome)
+
+    # --------------------------------------------------
+    # Rotas agregadas
+    # --------------------------------------------------
+    async def _get(self, worker: ShardWorker, path: str) -> Tuple[int, str]:
+        session = worker.session
+        if session is None or not worker.ready.is_set():
+            return 503, ""
+        try:
+            async with session.get(f"{WORKER_URL}{path}", timeout=FAN_OUT_TIMEOUT) as response:
+                return response.status, await response.text()
+        except (ClientError, OSError, asyncio.TimeoutError) as e:
+            return 503, json.dumps({"error": str(e)})
+
+    async def _fan_out_json(self, path: str) -> List[Dict]:
+        results = await asyncio.gather(*(self._get(worker, path) for worker in self.workers))
+        report = []
+        for worker, (status, text) in zip(self.workers, results):
+            try:
+                body = json.loads(text) if text else {}
+            except ValueError:
+                body = {"error": text}
+            report.append({**worker.status(), "status_code": status, "body": body})
+        return report
+
+    async def healthz(self, req: Request) -> Response:
+        """200 enquanto houver worker atendendo ("degraded" se algum estiver reiniciando); 503 sem nenhum."""
+        workers = await self._fan_out_json("/healthz")
+        healthy = sum(1 for worker in workers if worker["status_code"] == 200)
+        status = "ok" if healthy == len(workers) else "degraded" if healthy else "starting"
+        return json_response(data={"status": status, "workers": workers}, status=200 if healthy else 503)
+
+    async def queue_stats(self, req: Request) -> Response:
+        return json_response(data={"workers": await self._fan_out_json("/api/queue")})
+
+    async def warmup(self, req: Request) -> Response:
+        return json_response(data={"workers": await self._fan_out_json("/warmup")})
+
+    async def metrics(self, req: Request) -> Response:
+        results = await asyncio.gather(*(self._get(worker, "/metrics") for worker in self.workers))
+        texts = [(worker.label, text) for worker, (status, text) in zip(self.workers, results) if status == 200]
+        body = SHARD_REGISTRY.render() + merge_metrics(texts)
+        return Response(body=body.encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def admin_profile(self, req: Request) -> Response:
+        """Perfil dos próximos turnos de um worker (?worker=i, padrão 0); o worker confere o ADMIN_TOKEN."""
+        try:
+            worker = self.workers[int(req.query.get("worker", 0))]
+        except (ValueError, IndexError):
+            return Response(status=400, text="worker inválido")
+        if worker.session is None:
+            return Response(status=503, headers={"Retry-After": "1"})
+        query = {name: value for name, value in req.query.items() if name != "worker"}
+        headers = {"Authorization": req.headers.get("Authorization", "")}
+        async with worker.session.post(f"{WORKER_URL}/admin/profile", params=query, headers=headers) as response:
+            return Response(status=response.status, text=await response.text(), content_type="text/plain")
+
+    async def admin_shards(self, req: Request) -> Response:
+        """GET: estado dos workers. POST ?action=restart: reinício gradual. POST ?workers=M: rebalanceamento."""
+        if not self.config.ADMIN_TOKEN:
+            return Response(status=404)
+        if not admin_authorized(self.config, req.headers.get("Authorization", "")):
+            return Response(status=401)
+        if req.method == "POST":
+            if self._admin_lock.locked():
+                return Response(status=409, text="Já existe um reinício ou rebalanceamento em andamento")
+            if "workers" in req.query:
+                try:
+                    count = int(req.query["workers"])
+                    if count < 1:
+                        raise ValueError
+                except ValueError:
+                    return Response(status=400, text="workers deve ser um inteiro positivo")
+                await self.resize(count)
+            elif req.query.get("action") == "restart":
+                await self.restart()
+            else:
+                return Response(status=400, text="Use ?action=restart ou ?workers=M")
+        return json_response(data={"workers": [worker.status() for worker in self.workers], "state_path": self.env.get("STATE_MEMORY_COLD_PATH", "")})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/messages", self.messages)
+        app.router.add_get("/api/queue", self.queue_stats)
+        app.router.add_get("/metrics", self.metrics)
+        app.router.add_get("/healthz", self.healthz)
+        app.router.add_get("/warmup", self.warmup)
+        app.router.add_post("/admin/profile", self.admin_profile)
+        app.router.add_route("*", "/admin/shards", self.admin_shards)
+        app.on_startup.append(self.start)
+        app.on_shutdown.append(self.close)  # Antes do cleanup: as requisições em andamento ainda são concluídas
+        return app
+
+
+def serve(config=None):
+    config = config or DefaultConfig()
+    setup_logging(config)
+    server = ShardServer(config)
+    LOGGER.info("Processo de frente em http://%s:%s com %s workers", config.HOST, config.PORT, len(server.workers))
+    web.run_app(server.create_app(), host=config.HOST, port=config.PORT, print=None)
+
+
+# --------------------------------------------------
+# Verificação do anel e benchmark de escala
+# --------------------------------------------------
+def check(keys: int = 100000):
+    """Distribuição das conversas no anel, conversas movidas ao crescer e custo do roteamento."""
+    conversations = [f"19:conv-{index}@thread.skype" for index in range(keys)]
+    print(f"{'workers':>8}{'menor fatia':>13}{'maior fatia':>13}{'movidas p/ N+1':>16}{'ideal':>8}")
+    for nodes in (1, 2, 4, 8):
+        ring, grown = HashRing(nodes), HashRing(nodes + 1)
+        owners = [ring.node(key) for key in conversations]
+        shares = [owners.count(node) / keys * nodes for node in range(nodes)]
+        moved = sum(1 for key, owner in zip(conversations, owners) if grown.node(key) != owner) / keys
+        print(f"{nodes:>8}{min(shares):>13.2f}{max(shares):>13.2f}{moved:>16.1%}{1 / (nodes + 1):>8.1%}")
+        assert max(shares) < 1.35, "anel desbalanceado"
+        assert moved < 1.5 / (nodes + 1), "crescer o anel moveu conversas demais"
+        rebuilt = HashRing(nodes)
+        assert owners == [rebuilt.node(key) for key in conversations], "o dono da conversa não é determinístico"
+
+    merged = merge_metrics([("0", "# HELP a x\n# TYPE a counter\na_total 1\n# HELP b y\n# TYPE b histogram\nb_bucket{le=\"1\"} 2\n"),
+                            ("1", "# HELP a x\n# TYPE a counter\na_total 3\n")])
+    assert merged.splitlines() == ["# HELP a x", "# TYPE a counter", 'a_total{worker="0"} 1', 'a_total{worker="1"} 3',
+                                   "# HELP b y", "# TYPE b histogram", 'b_bucket{worker="0",le="1"} 2'], merged
+
+    body = json.dumps({"type": "message", "conversation": {"id": conversations[0]}, "text": "Olá" * 50}).encode("utf-8")
+    ring, runs = HashRing(8), 100000
+    started = time.perf_counter()
+    for _ in range(runs):
+        ring.node(conversation_id(body))
+    print(f"Roteamento (conversation.id do corpo + anel de 8 workers): {(time.perf_counter() - started) / runs * 1e6:.1f} µs/requisição")
+    print("OK")
+
+
+def bench(worker_counts: List[int], conversations: int, concurrency: int, clu_latency_ms: float):
+    """Turnos/s do app.py sozinho e do sharded_server.py com cada número de workers, medidos pelo loadtest.py."""
+    targets = [("app.py", "app.py", [])] + [
+        (f"{count} workers", "sharded_server.py", ["--bot-env", f"SHARD_WORKERS={count}"]) for count in worker_counts]
+    print(f"{os.cpu_count()} CPUs | {conversations} conversas, concorrência {concurrency}, CLU falso com {clu_latency_ms:.0f} ms")
+    print(f"{'alvo':<12}{'turnos/s':>10}{'x 1 worker':>12}{'p99 máx ms':>12}{'erros HTTP':>12}{'erros do bot':>14}")
+    baseline = None
+    for name, script, extra in targets:
+        with tempfile.TemporaryDirectory(prefix="shard_bench_") as tmp:
+            out = os.path.join(tmp, "result.json")
+            command = [sys.executable, os.path.join(BASE_DIR, "loadtest.py"), "--spawn", script,
+                       "--bot-env", f"SHARD_STATE_PATH={os.path.join(tmp, 'state.sqlite')}", *extra,
+                       "--conversations", str(conversations), "--concurrency", str(concurrency),
+                       "--clu-latency-ms", str(clu_latency_ms), "--out", out]
+            subprocess.run(command, check=True, cwd=BASE_DIR, stdout=subprocess.DEVNULL)
+            with open(out, encoding="utf-8") as result_file:
+                report = json.load(result_file)
+        throughput = report["throughput_turns_per_s"]
+        if name == "1 workers" or (baseline is None and script != "app.py"):
+            baseline = throughput
+        speedup = f"{throughput / baseline:.2f}" if baseline and script != "app.py" else "-"
+        p99 = max(step["p99_ms"] for step in report["steps"].values())
+        print(f"{name:<12}{throughput:>10}{speedup:>12}{p99:>12}{report['http_error_rate'] * 100:>11.2f}%{report['bot_error_replies']:>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tralhobot com afinidade de conversa entre vários processos")
+    parser.add_argument("command", nargs="?", default="serve", choices=("serve", "check", "bench"))
+    parser.add_argument("--workers", default="1,2,4,8", help="bench: números de workers separados por vírgula")
+    parser.add_argument("--conversations", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--clu-latency-ms", type=float, default=20)
+    args = parser.parse_args()
+    if args.command == "check":
+        check()
+    elif args.command == "bench":
+        bench([int(count) for count in args.workers.split(",")], args.conversations, args.concurrency, args.clu_latency_ms)
+    else:
+        serve()
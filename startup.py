@@ -0,0 +1,361 @@
+"""
+Subida rápida do worker para a partida a frio no Render.
+
+O Render desliga a instância ociosa, e a requisição que a acorda espera o processo subir: importar
+botbuilder, msrest e o SDK do Azure leva meio segundo, e depois o primeiro turno ainda abria, uma
+depois da outra, as conexões com o login (token do app e chaves de assinatura), com o CLU e com o canal.
+
+Com STARTUP_LAZY=true, app.py e app_flask.py abrem a porta importando só o servidor web, e o
+BotRuntime é montado em uma thread. Cada cliente de rede começa a aquecer (conexão aberta, token e
+chaves em cache) assim que é criado, em paralelo com o resto das importações (STARTUP_WARMUP).
+As requisições que chegam antes esperam a montagem terminar.
+
+    GET /healthz  200 com o bot pronto, 503 enquanto ele é montado; traz o tempo de cada etapa
+    GET /warmup   conclui a montagem e o aquecimento e devolve o resultado de cada um
+
+Perfil de importação antes de abrir a porta, com e sem STARTUP_LAZY: python startup.py [módulo]
+Tempo até a primeira resposta: python loadtest.py --spawn app.py --cold-start 10 --connect-latency-ms 150
+"""
+import asyncio
+import concurrent.futures
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from log_utils import get_logger
+from metrics import (STARTUP_SECONDS, register_clu_client, register_lead_sink, register_rate_limiter, register_state_storage,
+                     register_turn_queue)
+
+LOGGER = get_logger("startup")
+
+# Frase usada para preparar o classificador local no /warmup
+_WARMUP_UTTERANCE = "olá, quero falar com um especialista"
+
+
+def _process_started() -> float:
+    """Hora (time.time()) em que o processo começou, lida do /proc; fora do Linux, a importação deste módulo."""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as stat_file:
+            started_ticks = float(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", encoding="ascii") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return time.time() - uptime + started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupProfile:
+    """
+    Marcos da subida, em segundos desde o início do processo (server, ready, warm), e duração de
+    cada etapa da montagem do bot. Os marcos também vão para /metrics (tralhobot_startup_seconds).
+    """
+
+    def __init__(self):
+        self.process_started = _process_started()
+        self.marks: Dict[str, float] = {}
+        self.stages: Dict[str, float] = {}
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = round(time.time() - self.process_started, 3)
+            STARTUP_SECONDS.set(self.marks[name], name)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - started, 4)
+
+    def report(self) -> Dict:
+        return {"marks": dict(self.marks), "stages": dict(self.stages)}
+
+
+class BotRuntime:
+    """
+    Componentes do bot em um worker: adaptador, CLU, storage, bot e fila de turnos.
+
+    build() importa o SDK e monta tudo, na importação do app (STARTUP_LAZY=false) ou em uma thread
+    disparada por start(). Os métodos parse/can_defer/submit/process são o que as rotas usam, depois
+    de esperar por wait_ready() (aiohttp) ou wait_ready_sync() (Flask).
+    """
+
+    def __init__(self, config, profile: StartupProfile = None):
+        self.config = config
+        self.profile = profile or StartupProfile()
+        self.adapter = None
+        self.clu_client = None
+        self.storage = None
+        self.bot = None
+        self.lead_sink = None
+        self.turn_queue = None
+        self.rate_limiter = None
+        self.warmup_results: Dict[str, Dict] = {}
+        self._built: concurrent.futures.Future = concurrent.futures.Future()
+        self._building = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._warmups: Dict[str, Callable] = {}  # nome -> função que devolve a corrotina de aquecimento
+        self._warming: Dict[str, concurrent.futures.Future] = {}
+
+    # --------------------------------------------------
+    # Montagem
+    # --------------------------------------------------
+    def build(self):
+        """Importa o SDK e monta os componentes. Os clientes de rede são criados primeiro, para aquecerem durante o resto."""
+        self._building = True
+        config = self.config
+        try:
+            with self.profile.stage("outbound"):
+                from connector_client import create_outbound_connector
+                outbound = create_outbound_connector(config)
+            if outbound is not None:
+                service_urls = [url.strip() for url in config.STARTUP_PRECONNECT_URLS.split(",") if url.strip()]
+                self._add_warmup("outbound", lambda: outbound.warmup(service_urls))
+
+            with self.profile.stage("clu"):
+                from clu_utils import create_clu_client
+                self.clu_client = create_clu_client(config, use_async=True)
+            if self.clu_client is not None:
+                self._add_warmup("clu", self.clu_client.warmup)
+                register_clu_client(self.clu_client)
+
+            with self.profile.stage("auth"):
+                from auth_cache import create_channel_authenticator
+                authenticator = create_channel_authenticator(config)
+            if authenticator is not None:
+                self._add_warmup("auth", authenticator.warmup)
+
+            with self.profile.stage("adapter"):
+                from bot_adapter import create_adapter
+                self.adapter = create_adapter(config, outbound, authenticator)
+
+            with self.profile.stage("storage"):
+                from state_storage import create_storage
+                self.storage = create_storage(config)
+                register_state_storage(self.storage)
+
+            with self.profile.stage("bot"):
+                from botbuilder.core import ConversationState, UserState
+                from bots.tralhobot import Tralhobot
+                from intent_classifier import load_intent_classifier
+                from knowledge_base import create_knowledge_base
+                from lead_sink import create_lead_sink
+                from nlu_cache import create_nlu_cache
+                self.lead_sink = create_lead_sink(config)
+                register_lead_sink(self.lead_sink)
+                self.bot = Tralhobot(
+                    ConversationState(self.storage),
+                    UserState(self.storage),
+                    self.clu_client,
+                    config.CLU_PROJECT_NAME,
+                    config.CLU_DEPLOYMENT_NAME,
+                    create_nlu_cache(config, self.storage),
+                    load_intent_classifier(config),
+                    self.lead_sink,
+                    create_knowledge_base(config),
+                )
+
+            with self.profile.stage("ingress"):
+                from activity_parser import parse_activity
+                from turn_queue import REJECTED, can_defer, create_turn_queue, submit_activity
+                self._parse_activity, self._can_defer, self._submit_activity, self._rejected = (
+                    parse_activity, can_defer, submit_activity, REJECTED)
+                self.turn_queue = create_turn_queue(config)
+                register_turn_queue(self.turn_queue)
+                from rate_limit import create_rate_limiter
+                self.rate_limiter = create_rate_limiter(config)
+                register_rate_limiter(self.rate_limiter)
+        except BaseException as e:
+            self._built.set_exception(e)
+            raise
+
+        self.profile.mark("ready")
+        self._built.set_result(self)
+        LOGGER.info("Bot pronto %.0f ms após o início do processo (montagem: %s).", self.profile.marks["ready"] * 1000,
+                    ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.profile.stages.items()))
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except BaseException as e:  # pylint: disable=broad-except
+            LOGGER.exception("Falha ao montar o bot: %s", e)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """
+        Liga o runtime ao loop de eventos do worker (on_startup do aiohttp ou o LOOP do app_flask):
+        agenda os aquecimentos pendentes e, se o bot ainda não foi montado, monta em uma thread.
+        """
+        self.profile.mark("server")
+        with self._lock:
+            self._loop = loop
+        if self.config.STARTUP_WARMUP:
+            for name in list(self._warmups):
+                self._schedule(name)
+        if not self._building:
+            self._building = True
+            threading.Thread(target=self._build_in_background, name="bot-startup", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._built.done() and self._built.exception() is None
+
+    async def wait_ready(self) -> "BotRuntime":
+        """Espera a montagem (no máximo STARTUP_READY_TIMEOUT_SECONDS). Lança a exceção da montagem, se houve."""
+        if not self._built.done():
+            # shield: o timeout de uma requisição não pode cancelar a montagem
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._built)), self.config.STARTUP_READY_TIMEOUT_SECONDS)
+        return self._built.result()
+
+    def wait_ready_sync(self) -> "BotRuntime":
+        """Mesmo que wait_ready(), para as threads de requisição do Flask."""
+        return self._built.result(timeout=self.config.STARTUP_READY_TIMEOUT_SECONDS)
+
+    # --------------------------------------------------
+    # Aquecimento
+    # --------------------------------------------------
+    def _add_warmup(self, name: str, factory: Callable):
+        self._warmups[name] = factory
+        if self.config.STARTUP_WARMUP:
+            self._schedule(name)
+
+    def _schedule(self, name: str):
+        # Chamado da thread de montagem ou do loop; a corrotina sempre roda no loop do worker
+        with self._lock:
+            if self._loop is None or name in self._warming:
+                return
+            self._warming[name] = asyncio.run_coroutine_threadsafe(self._run_warmup(name), self._loop)
+
+    async def _run_warmup(self, name: str) -> Dict:
+        started = time.perf_counter()
+        try:
+            await self._warmups[name]()
+            result = {"ok": True}
+        except Exception as e:  # pylint: disable=broad-except
+            # Só adianta trabalho: se falhar, o primeiro turno faz a mesma coisa (e reporta o erro)
+            LOGGER.warning("Aquecimento de %s falhou: %s", name, e)
+            result = {"ok": False, "error": str(e)}
+        result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.warmup_results[name] = result
+        if self._built.done() and len(self.warmup_results) == len(self._warmups):
+            self.profile.mark("warm")
+        return result
+
+    async def warmup(self) -> Dict:
+        """
+        GET /warmup: conclui a montagem e todos os aquecimentos (também com STARTUP_WARMUP=false) e
+        prepara o classificador local. Repetir é barato: cada aquecimento roda uma vez por worker.
+        """
+        await self.wait_ready()
+        for name in list(self._warmups):
+            self._schedule(name)
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in list(self._warming.values())))
+        if self.bot.intent_classifier is not None:
+            self.bot.intent_classifier.predict(_WARMUP_UTTERANCE)
+        self.profile.mark("warm")
+        return self.report()
+
+    def health(self) -> Tuple[int, Dict]:
+        """Status HTTP e corpo do GET /healthz."""
+        if not self._built.done():
+            status, code = "starting", 503
+        elif self._built.exception() is not None:
+            status, code = "error", 500
+        else:
+            status, code = "ok", 200
+        return code, {"status": status, **self.report()}
+
+    def report(self) -> Dict:
+        return {"startup": self.profile.report(), "warmup": dict(self.warmup_results)}
+
+    # --------------------------------------------------
+    # Uso pelas rotas
+    # --------------------------------------------------
+    def parse(self, body: bytes):
+        """Corpo de /api/messages -> Activity (ver activity_parser.py). Lança ValueError se não for um objeto JSON."""
+        return self._parse_activity(body, self.config.ACTIVITY_FAST_PARSE)
+
+    def can_defer(self, activity) -> bool:
+        return self.turn_queue is not None and self._can_defer(activity)
+
+    async def submit(self, activity, auth_header: str) -> bool:
+        """
+        Confirmação imediata: autentica e enfileira o turno. False = fila cheia; PermissionError = não
+        autorizado; RateLimited = acima dos limites de uso (429).
+        """
+        admit = self.rate_limiter.admit if self.rate_limiter is not None else None
+        result = await self._submit_activity(self.turn_queue, self.adapter, activity, auth_header, self.bot.on_turn, admit)
+        return result != self._rejected
+
+    async def process(self, activity, auth_header: str):
+        """Autentica e processa o turno na própria requisição. Lança RateLimited acima dos limites de uso (429)."""
+        admit = self.rate_limiter.admit if self.rate_limiter is not None else None
+        return await self.adapter.process_activity(activity, auth_header, self.bot.on_turn, admit)
+
+    # --------------------------------------------------
+    # Encerramento
+    # --------------------------------------------------
+    async def drain(self):
+        """Antes de desligar, conclui os turnos que já foram confirmados com 202."""
+        if self.ready and self.turn_queue is not None:
+            await self.turn_queue.close(self.config.TURN_QUEUE_DRAIN_SECONDS)
+
+    async def close(self):
+        """Fecha os clientes de rede e o storage (se a montagem ainda estiver em andamento, espera ela terminar)."""
+        if not self._building:
+            return
+        try:
+            await self.wait_ready()
+        except Exception:  # pylint: disable=broad-except
+            return
+        if self.clu_client is not None:
+            await self.clu_client.close()
+        if self.adapter.outbound is not None:
+            await self.adapter.outbound.close()
+        if self.adapter.authenticator is not None:
+            await self.adapter.authenticator.close()
+        # Com STATE_MEMORY_COLD_PATH, grava as conversas residentes no arquivo
+        await self.storage.close()
+        if self.lead_sink is not None:
+            await asyncio.to_thread(self.lead_sink.close)
+        if self.bot.knowledge_base is not None:
+            self.bot.knowledge_base.close()
+
+
+def import_profile(module: str, env: Dict[str, str] = None) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Importa `module` em um processo novo com `python -X importtime` e soma o tempo próprio de cada
+    módulo importado por pacote de primeiro nível. Devolve o total e os pacotes, do mais caro ao
+    mais barato, em segundos.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env={**os.environ, **(env or {})}, capture_output=True, text=True, check=True)
+    packages = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(own) / 1e6
+    return sum(packages.values()), sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+# O que é importado antes de o servidor abrir a porta, com a montagem na importação (como era)
+# e com STARTUP_LAZY=true. Uso: python startup.py [módulo] [pacotes]
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "app"
+    shown = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+
+    profiles = {mode: import_profile(target, {"STARTUP_LAZY": mode, "LOG_LEVEL": "ERROR"}) for mode in ("false", "true")}
+    eager_total, eager_packages = profiles["false"]
+    lazy_total, lazy_packages = profiles["true"]
+    lazy_by_package = dict(lazy_packages)
+    print(f"import {target}: {eager_total * 1000:.0f} ms com STARTUP_LAZY=false, {lazy_total * 1000:.0f} ms com STARTUP_LAZY=true")
+    print(f"{'pacote':<28} {'LAZY=false ms':>14} {'LAZY=true ms':>13}")
+    for package, seconds in eager_packages[:shown]:
+        print(f"{package:<28} {seconds * 1000:>14.1f} {lazy_by_package.get(package, 0.0) * 1000:>13.1f}")
@@ -0,0 +1,612 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from botbuilder.core import BotState, Storage, TurnContext
+
+from log_utils import get_logger
+from metrics import STATE_COLD_READS, STATE_EVICTIONS, STORAGE_DURATION
+
+LOGGER = get_logger("storage")
+
+
+def _new_etag() -> str:
+    return uuid.uuid4().hex
+
+
+def _etag_of(value) -> str:
+    if isinstance(value, dict):
+        return value.get("e_tag")
+    return getattr(value, "e_tag", None)
+
+
+def _etag_conflict(key: str, expected: str, current: str) -> KeyError:
+    # Mesmo tipo de erro e formato de mensagem usados pelo MemoryStorage do botbuilder
+    return KeyError(f"Etag conflict on '{key}'.\nOriginal: {expected}\r\nCurrent: {current}")
+
+
+def _must_check_etag(expected: str) -> bool:
+    return expected is not None and expected != "*"
+
+
+class SqliteStorage(Storage):
+    """
+    Storage persistente em arquivo SQLite, indicado para um único nó.
+
+    Vários workers do gunicorn podem compartilhar o mesmo arquivo (modo WAL). Cada
+    escrita verifica o eTag gravado dentro de uma transação, então turnos concorrentes
+    da mesma conversa não sobrescrevem o estado um do outro.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        # Uma única thread por instância: a conexão SQLite só é usada por ela
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, e_tag TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _read_sync(self, keys: List[str]) -> Dict[str, object]:
+        placeholders = ",".join("?" for _ in keys)
+        rows = self._connection().execute(
+            f"SELECT key, e_tag, value FROM bot_state WHERE key IN ({placeholders})", list(keys)
+        ).fetchall()
+        data = {}
+        for key, e_tag, value in rows:
+            item = json.loads(value)
+            if isinstance(item, dict):
+                item["e_tag"] = e_tag
+            data[key] = item
+        return data
+
+    def _write_sync(self, changes: Dict[str, object]) -> Dict[str, str]:
+        conn = self._connection()
+        new_etags = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, change in changes.items():
+                expected = _etag_of(change)
+                if _must_check_etag(expected):
+                    row = conn.execute("SELECT e_tag FROM bot_state WHERE key = ?", (key,)).fetchone()
+                    if row is not None and row[0] != expected:
+                        raise _etag_conflict(key, expected, row[0])
+                new_etags[key] = _new_etag()
+                conn.execute(
+                    "INSERT OR REPLACE INTO bot_state (key, e_tag, value) VALUES (?, ?, ?)",
+                    (key, new_etags[key], json.dumps(change, ensure_ascii=False)),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return new_etags
+
+    def _delete_sync(self, keys: List[str]):
+        placeholders = ",".join("?" for _ in keys)
+        self._connection().execute(f"DELETE FROM bot_state WHERE key IN ({placeholders})", list(keys))
+
+    async def read(self, keys: List[str]):
+        if not keys:
+            return {}
+        return await self._run(self._read_sync, list(keys))
+
+    async def write(self, changes: Dict[str, object]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        new_etags = await self._run(self._write_sync, changes)
+        # Atualiza o eTag no objeto em cache para que a próxima escrita do mesmo turno seja aceita
+        for key, e_tag in new_etags.items():
+            if isinstance(changes[key], dict):
+                changes[key]["e_tag"] = e_tag
+
+    async def delete(self, keys: List[str]):
+        if keys:
+            await self._run(self._delete_sync, list(keys))
+
+    def _read_rows_sync(self, keys: List[str]) -> List[Tuple[str, str, str]]:
+        placeholders = ",".join("?" for _ in keys)
+        return self._connection().execute(
+            f"SELECT key, e_tag, value FROM bot_state WHERE key IN ({placeholders})", list(keys)
+        ).fetchall()
+
+    def _write_rows_sync(self, rows: List[Tuple[str, str, str]]):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO bot_state (key, e_tag, value) VALUES (?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def read_rows(self, keys: List[str]) -> List[Tuple[str, str, str]]:
+        """Linhas (chave, eTag, JSON) sem decodificar; usado pelo BoundedMemoryStorage como camada fria."""
+        if not keys:
+            return []
+        return await self._run(self._read_rows_sync, list(keys))
+
+    async def write_rows(self, rows: List[Tuple[str, str, str]]):
+        """Grava linhas já serializadas, mantendo o eTag, sem verificação (o dono da chave é quem despeja)."""
+        if rows:
+            await self._run(self._write_rows_sync, rows)
+
+    async def close(self):
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=False)
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# Compare-and-set atômico de várias chaves: todas as escritas do turno em uma única ida ao Redis.
+# ARGV traz, para cada chave, a trinca (eTag esperado, novo eTag, valor JSON).
+_REDIS_CAS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local expected = ARGV[(i - 1) * 3 + 1]
+    if expected ~= '' and expected ~= '*' then
+        local current = redis.call('HGET', key, 'e_tag')
+        if current and current ~= expected then
+            return redis.error_reply('ETAG_CONFLICT ' .. key)
+        end
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'e_tag', ARGV[(i - 1) * 3 + 2], 'value', ARGV[(i - 1) * 3 + 3])
+end
+return #KEYS
+"""
+
+
+class RedisStorage(Storage):
+    """
+    Storage compartilhado entre workers e instâncias, usando o protocolo Redis.
+
+    Funciona com qualquer servidor compatível (Redis, Valkey, KeyDB ou um substituto local).
+    """
+
+    def __init__(self, url: str, key_prefix: str = "tralhobot:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise ImportError("O backend 'redis' requer o pacote 'redis' (pip install redis).") from e
+        self.key_prefix = key_prefix
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+        self._cas = self._client.register_script(_REDIS_CAS_SCRIPT)
+
+    def _key(self, key: str) -> str:
+        return f"{self.key_prefix}{key}"
+
+    async def read(self, keys: List[str]):
+        if not keys:
+            return {}
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(self._key(key), "e_tag", "value")
+        results = await pipe.execute()
+
+        data = {}
+        for key, (e_tag, value) in zip(keys, results):
+            if value is None:
+                continue
+            item = json.loads(value)
+            if isinstance(item, dict):
+                item["e_tag"] = e_tag
+            data[key] = item
+        return data
+
+    async def write(self, changes: Dict[str, object]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+
+        from redis.exceptions import ResponseError
+
+        keys, args, new_etags = [], [], {}
+        for key, change in changes.items():
+            expected = _etag_of(change)
+            new_etags[key] = _new_etag()
+            keys.append(self._key(key))
+            args.extend([expected or "", new_etags[key], json.dumps(change, ensure_ascii=False)])
+
+        try:
+            await self._cas(keys=keys, args=args)
+        except ResponseError as e:
+            if "ETAG_CONFLICT" in str(e):
+                raise KeyError(f"Etag conflict: {e}") from e
+            raise
+
+        for key, e_tag in new_etags.items():
+            if isinstance(changes[key], dict):
+                changes[key]["e_tag"] = e_tag
+
+    async def delete(self, keys: List[str]):
+        if keys:
+            await self._client.delete(*[self._key(key) for key in keys])
+
+    async def expire(self, keys: List[str], ttl_seconds: float) -> bool:
+        """Faz o próprio Redis apagar as chaves após `ttl_seconds` (PEXPIRE); usado pelo cache do CLU."""
+        if keys:
+            pipe = self._client.pipeline(transaction=False)
+            for key in keys:
+                pipe.pexpire(self._key(key), max(1, int(ttl_seconds * 1000)))
+            await pipe.execute()
+        return True
+
+    async def close(self):
+        await self._client.aclose()
+
+
+# Estimativa por conversa residente além do JSON e da chave: nó do OrderedDict, _Entry e cabeçalhos
+# das strings (medido com tracemalloc no teste de resistência abaixo)
+_ENTRY_OVERHEAD = 250
+
+
+class _Entry:
+    __slots__ = ("e_tag", "text", "last_access")
+
+    def __init__(self, e_tag: str, text: str, last_access: float):
+        self.e_tag = e_tag
+        self.text = text
+        self.last_access = last_access
+
+
+class BoundedMemoryStorage(Storage):
+    """
+    Storage em memória do processo com limites, para substituir o MemoryStorage (que nunca
+    libera conversas abandonadas).
+
+    - Cada conversa fica guardada como JSON compacto, em ordem LRU (a última acessada no fim).
+    - Acima de `max_bytes` (estimativa), as menos recentes são despejadas na hora da escrita.
+    - Uma tarefa em segundo plano despeja, a cada `sweep_seconds`, as ociosas há mais de `idle_seconds`.
+    - Com uma camada fria (SqliteStorage), as despejadas vão para o arquivo e voltam à memória
+      na próxima leitura; sem ela, são descartadas (a conversa recomeça do zero).
+    """
+
+    def __init__(self, max_bytes: int, idle_seconds: float, sweep_seconds: float = 60,
+                 cold: Optional[SqliteStorage] = None, clock=time.monotonic):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.sweep_seconds = sweep_seconds
+        self.cold = cold
+        self._clock = clock
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Despejadas cuja gravação na camada fria ainda não terminou: continuam legíveis daqui
+        self._flushing: Dict[str, Tuple[str, str]] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.memory_bytes = 0
+        self.evictions = {"idle": 0, "budget": 0}
+        self.cold_reads = 0
+
+    @staticmethod
+    def _size(key: str, text: str) -> int:
+        return len(key) + len(text) + _ENTRY_OVERHEAD
+
+    @property
+    def resident(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "resident": self.resident,
+            "memory_bytes": self.memory_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions_idle": self.evictions["idle"],
+            "evictions_budget": self.evictions["budget"],
+            "cold_reads": self.cold_reads,
+        }
+
+    def _put(self, key: str, e_tag: str, text: str):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= self._size(key, old.text)
+        self._entries[key] = _Entry(e_tag, text, self._clock())
+        self.memory_bytes += self._size(key, text)
+
+    def _pop(self, key: str, reason: str) -> Tuple[str, str, str]:
+        entry = self._entries.pop(key)
+        self.memory_bytes -= self._size(key, entry.text)
+        self.evictions[reason] += 1
+        STATE_EVICTIONS.inc(reason)
+        return key, entry.e_tag, entry.text
+
+    def _evict_over_budget(self) -> List[Tuple[str, str, str]]:
+        evicted = []
+        # Nunca despeja a conversa que acabou de ser gravada (a última da fila)
+        while self.memory_bytes > self.max_bytes and len(self._entries) > 1:
+            evicted.append(self._pop(next(iter(self._entries)), "budget"))
+        return evicted
+
+    def _evict_idle(self) -> List[Tuple[str, str, str]]:
+        evicted = []
+        deadline = self._clock() - self.idle_seconds
+        # Em ordem LRU: a primeira conversa ainda ativa encerra a varredura
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_access > deadline:
+                break
+            evicted.append(self._pop(key, "idle"))
+        return evicted
+
+    async def _flush(self, evicted: List[Tuple[str, str, str]]):
+        if self.cold is None or not evicted:
+            return
+        for key, e_tag, text in evicted:
+            self._flushing[key] = (e_tag, text)
+        try:
+            await self.cold.write_rows(evicted)
+        finally:
+            for key, e_tag, text in evicted:
+                if self._flushing.get(key) == (e_tag, text):
+                    del self._flushing[key]
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None and self.sweep_seconds > 0:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                evicted = self._evict_idle()
+                await self._flush(evicted)
+                if evicted:
+                    LOGGER.debug("%d conversas ociosas despejadas (%d residentes).", len(evicted), len(self._entries))
+            except Exception:
+                LOGGER.exception("Falha ao despejar conversas ociosas.")
+
+    async def read(self, keys: List[str]):
+        self._ensure_sweeper()
+        data, missing = {}, []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                pending = self._flushing.get(key)
+                if pending is None:
+                    missing.append(key)
+                    continue
+                self._put(key, *pending)
+                entry = self._entries[key]
+            else:
+                self._entries.move_to_end(key)
+                entry.last_access = self._clock()
+            data[key] = entry
+
+        if missing and self.cold is not None:
+            for key, e_tag, text in await self.cold.read_rows(missing):
+                if key not in self._entries:  # Outra leitura pode ter trazido a chave enquanto esperávamos
+                    self._put(key, e_tag, text)
+                    self.cold_reads += 1
+                    STATE_COLD_READS.inc()
+                data[key] = self._entries[key]
+            await self._flush(self._evict_over_budget())
+
+        result = {}
+        for key, entry in data.items():
+            item = json.loads(entry.text)
+            if isinstance(item, dict):
+                item["e_tag"] = entry.e_tag
+            result[key] = item
+        return result
+
+    async def write(self, changes: Dict[str, object]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        self._ensure_sweeper()
+        # O eTag de uma conversa despejada está na camada fria: traz de volta antes de conferir
+        unknown = [key for key, change in changes.items()
+                   if key not in self._entries and _must_check_etag(_etag_of(change))]
+        if unknown:
+            await self.read(unknown)
+
+        for key, change in changes.items():
+            expected = _etag_of(change)
+            entry = self._entries.get(key)
+            if _must_check_etag(expected) and entry is not None and entry.e_tag != expected:
+                raise _etag_conflict(key, expected, entry.e_tag)
+
+        for key, change in changes.items():
+            e_tag = _new_etag()
+            value = {k: v for k, v in change.items() if k != "e_tag"} if isinstance(change, dict) else change
+            self._put(key, e_tag, json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+            if isinstance(change, dict):
+                change["e_tag"] = e_tag
+        await self._flush(self._evict_over_budget())
+
+    async def delete(self, keys: List[str]):
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.memory_bytes -= self._size(key, entry.text)
+            self._flushing.pop(key, None)
+        if self.cold is not None:
+            await self.cold.delete(keys)
+
+    async def close(self):
+        """Para o despejo periódico e, com camada fria, grava nela as conversas residentes."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self.cold is not None:
+            await self.cold.write_rows([(key, entry.e_tag, entry.text) for key, entry in self._entries.items()])
+            await self.cold.close()
+
+
+class MeteredStorage(Storage):
+    """Repassa as operações para outro Storage, medindo a duração de cada uma (tralhobot_storage_duration_seconds)."""
+
+    def __init__(self, storage: Storage):
+        super().__init__()
+        self.storage = storage
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        with STORAGE_DURATION.time("read"):
+            return await self.storage.read(keys)
+
+    async def write(self, changes: Dict[str, object]):
+        with STORAGE_DURATION.time("write"):
+            await self.storage.write(changes)
+
+    async def delete(self, keys: List[str]):
+        with STORAGE_DURATION.time("delete"):
+            await self.storage.delete(keys)
+
+    async def expire(self, keys: List[str], ttl_seconds: float) -> bool:
+        """Expiração nativa, se o Storage interno tiver (Redis). False: quem chamou precisa apagar as chaves."""
+        expire = getattr(self.storage, "expire", None)
+        if expire is None:
+            return False
+        with STORAGE_DURATION.time("expire"):
+            return await expire(keys, ttl_seconds)
+
+    async def close(self):
+        if hasattr(self.storage, "close"):
+            await self.storage.close()
+
+
+def create_storage(config) -> Storage:
+    """Cria o Storage de estado escolhido em DefaultConfig.STATE_STORAGE (com métricas de duração)."""
+    kind = (config.STATE_STORAGE or "memory").lower()
+    if kind == "sqlite":
+        LOGGER.info("Usando SQLite em '%s'.", config.STATE_SQLITE_PATH)
+        return MeteredStorage(SqliteStorage(config.STATE_SQLITE_PATH))
+    if kind == "redis":
+        LOGGER.info("Usando Redis.")
+        return MeteredStorage(RedisStorage(config.STATE_REDIS_URL, config.STATE_REDIS_KEY_PREFIX))
+    if kind != "memory":
+        LOGGER.warning("STATE_STORAGE '%s' desconhecido. Usando a memória do processo (volátil).", kind)
+    cold = SqliteStorage(config.STATE_MEMORY_COLD_PATH) if config.STATE_MEMORY_COLD_PATH else None
+    return MeteredStorage(BoundedMemoryStorage(
+        config.STATE_MEMORY_MAX_MB * 1024 * 1024, config.STATE_MEMORY_IDLE_SECONDS,
+        config.STATE_MEMORY_SWEEP_SECONDS, cold,
+    ))
+
+
+async def save_all_changes(turn_context: TurnContext, *bot_states: BotState):
+    """
+    Salva as alterações de vários BotState (ex: ConversationState e UserState) com uma
+    única escrita por Storage, em vez de uma escrita por estado.
+    """
+    pending = {}  # id(storage) -> (storage, changes, cached_states)
+    for bot_state in bot_states:
+        cached_state = bot_state.get_cached_state(turn_context)
+        if cached_state is None or not cached_state.is_changed:
+            continue
+        storage = bot_state._storage  # pylint: disable=protected-access
+        _, changes, cached_states = pending.setdefault(id(storage), (storage, {}, []))
+        changes[bot_state.get_storage_key(turn_context)] = cached_state.state
+        cached_states.append(cached_state)
+
+    for storage, changes, cached_states in pending.values():
+        await storage.write(changes)
+        for cached_state in cached_states:
+            cached_state.hash = cached_state.compute_hash(cached_state.state)
+
+
+# Benchmark simples de turnos/segundo por backend (um turno = 1 leitura + 1 escrita coalescida).
+# Uso: python state_storage.py [memory|sqlite|redis] [turnos]
+#
+# Teste de resistência do storage em memória: um milhão de conversas sintéticas (cada uma com um
+# turno e 1 a 3 KB de estado), relógio simulado de 10 ms por turno, orçamento de 32 MB e ociosidade
+# de 2 minutos simulados. A cada 10 turnos, uma conversa antiga (já despejada) volta e precisa ser
+# lida da camada fria com o conteúdo intacto. Falha se o RSS crescer mais de 10% depois do aquecimento.
+# Uso: python state_storage.py soak [conversas] [arquivo_da_camada_fria]
+if __name__ == "__main__":
+    import os
+    import random
+    import sys
+    import tempfile
+
+    from config import DefaultConfig
+
+    async def _benchmark(kind: str, turns: int):
+        config = DefaultConfig()
+        config.STATE_STORAGE = kind
+        storage = create_storage(config)
+        keys = [(f"emulator/conversations/bench-{i % 100}/", f"emulator/users/bench-{i % 100}/") for i in range(turns)]
+
+        start = time.perf_counter()
+        for conversation_key, user_key in keys:
+            items = await storage.read([conversation_key, user_key])
+            conversation = items.get(conversation_key, {"SDRState": [1, "none"], "ConversationLog": ""})
+            conversation["ConversationLog"] = conversation["ConversationLog"][-500:] + "User: olá\n"
+            await storage.write({conversation_key: conversation, user_key: items.get(user_key, {})})
+        elapsed = time.perf_counter() - start
+        print(f"{kind}: {turns / elapsed:.0f} turnos/s ({turns} turnos em {elapsed:.2f}s)")
+
+    def _rss_mb() -> float:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+    async def _soak(conversations: int, cold_path: str):
+        now = [0.0]
+        storage = BoundedMemoryStorage(32 * 1024 * 1024, idle_seconds=120, sweep_seconds=0,
+                                       cold=SqliteStorage(cold_path), clock=lambda: now[0])
+        rng = random.Random(42)
+        warmup, baseline, peak, revisits = conversations // 5, None, 0.0, 0
+        start = time.perf_counter()
+        print(f"{'conversas':>10} {'residentes':>11} {'MB estimados':>13} {'RSS MB':>8} {'despejos idle/budget':>21} {'leituras frias':>15}")
+        for i in range(conversations):
+            now[0] += 0.01
+            key = f"msteams/conversations/soak-{i}/"
+            items = await storage.read([key])
+            document = items.get(key, {"SupportState": [1, "none"], "SDRState": [1, "awaiting_company", f"Pessoa {i}"]})
+            document["ConversationLog"] = {"v": 1, "total": 1, "spilled": 0,
+                                           "entries": [["u", int(now[0]), "x" * rng.randint(1000, 3000)]]}
+            await storage.write({key: document})
+
+            if i % 10 == 0 and i > 50000:
+                old = rng.randrange(0, i - 50000)
+                old_key = f"msteams/conversations/soak-{old}/"
+                item = (await storage.read([old_key]))[old_key]
+                assert item["SDRState"][2] == f"Pessoa {old}", (old, item["SDRState"])
+                revisits += 1
+
+            if i % 1000 == 0:  # Varredura de ociosas, como a tarefa periódica faria
+                await storage._flush(storage._evict_idle())  # pylint: disable=protected-access
+            if (i + 1) % (conversations // 10) == 0:
+                rss = _rss_mb()
+                if i + 1 >= warmup:
+                    baseline = baseline or rss
+                    peak = max(peak, rss)
+                stats = storage.stats()
+                print(f"{i + 1:>10} {stats['resident']:>11} {stats['memory_bytes'] / 1024 / 1024:>13.1f} {rss:>8.1f} "
+                      f"{stats['evictions_idle']:>10}/{stats['evictions_budget']:<10} {stats['cold_reads']:>15}")
+
+        elapsed = time.perf_counter() - start
+        await storage.close()
+        growth = (peak - baseline) / baseline
+        print(f"{conversations} conversas em {elapsed:.0f}s ({conversations / elapsed:.0f} turnos/s); "
+              f"{revisits} conversas antigas recuperadas da camada fria; RSS após aquecimento: +{growth:.1%}")
+        assert growth < 0.10, "O RSS continuou crescendo depois do aquecimento."
+
+    if len(sys.argv) > 1 and sys.argv[1] == "soak":
+        total = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(_soak(total, sys.argv[3] if len(sys.argv) > 3 else os.path.join(tmp, "cold.db")))
+    else:
+        asyncio.run(_benchmark(sys.argv[1] if len(sys.argv) > 1 else "sqlite", int(sys.argv[2]) if len(sys.argv) > 2 else 5000))
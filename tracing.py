@@ -0,0 +1,498 @@
+"""
+Spans por fase do turno (adaptador, autenticação, estado, classificador/CLU, fluxos, envio) e
+perfil sob demanda de N turnos.
+
+Os spans seguem o modelo do OpenTelemetry (trace id, span id, pai, início/fim em ns, atributos,
+status) e são exportados em OTLP/JSON, o mesmo corpo que um coletor recebe em POST /v1/traces:
+TRACE_EXPORTER=file grava um lote por linha em TRACE_FILE_PATH; TRACE_EXPORTER=otlp envia para
+TRACE_OTLP_ENDPOINT. A exportação roda em uma thread própria, como os logs (ver log_utils.py).
+Sem exportador, span() devolve sempre o mesmo objeto vazio: o custo é um `with` sem efeito.
+
+O span atual fica em um ContextVar, então cada turno (task do asyncio) tem a sua árvore.
+
+Coletor local para testes:  python tracing.py collector [porta]
+Custo por turno, com e sem exportador:  python tracing.py [turnos]
+"""
+import asyncio
+import atexit
+import contextvars
+import hmac
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+from typing import Dict, List, Optional, Tuple
+
+from log_utils import get_logger
+from metrics import TRACE_SPANS_DROPPED
+
+LOGGER = get_logger("tracing")
+
+# Códigos do OTLP (opentelemetry/proto/trace/v1/trace.proto)
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+_STATUS_ERROR = 2
+
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+_processor: Optional["_ExportThread"] = None
+_sample_rate = 1.0
+_resource: Dict[str, str] = {"service.name": "tralhobot"}
+
+
+class _NoopSpan:
+    """Span de quem não está sendo rastreado: entrar, sair e anotar não fazem nada."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+
+class _UnsampledRoot(_NoopSpan):
+    """Raiz de um turno fora da amostragem: marca o contexto para que os filhos também não sejam gravados."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        _CURRENT_SPAN.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _CURRENT_SPAN.set(None)  # Só é usada quando não havia span no contexto
+        return False
+
+
+_NOOP = _NoopSpan()
+_UNSAMPLED = _UnsampledRoot()
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes",
+                 "error", "_token")
+
+    def __init__(self, name: str, kind: int, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.error = None
+        self.end_ns = 0
+
+    def __enter__(self):
+        self._token = _CURRENT_SPAN.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end_ns = time.time_ns()
+        _CURRENT_SPAN.reset(self._token)
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _processor.submit(self)
+        return False
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """
+    `with span("nlu.clu", cache=True): ...`. Filho do span atual; sem span atual, começa um trace
+    novo (sujeito a TRACE_SAMPLE_RATE). Sem exportador configurado, não faz nada.
+    """
+    if _processor is None:
+        return _NOOP
+    parent = _CURRENT_SPAN.get()
+    if parent is None:
+        if _sample_rate < 1.0 and random.random() >= _sample_rate:
+            return _UNSAMPLED
+    elif parent.__class__ is _UnsampledRoot:
+        return _NOOP
+    return Span(name, kind, parent, attributes)
+
+
+def current_span():
+    """Span atual (ou o objeto vazio), para anotar atributos descobertos no meio da fase."""
+    return _CURRENT_SPAN.get() or _NOOP
+
+
+# --------------------------------------------------
+# Exportação OTLP/JSON
+# --------------------------------------------------
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _otlp_span(finished: Span) -> Dict:
+    data = {
+        "traceId": finished.trace_id,
+        "spanId": finished.span_id,
+        "name": finished.name,
+        "kind": finished.kind,
+        "startTimeUnixNano": str(finished.start_ns),
+        "endTimeUnixNano": str(finished.end_ns),
+        "attributes": _otlp_attributes(finished.attributes),
+        "status": {"code": _STATUS_ERROR, "message": finished.error} if finished.error else {},
+    }
+    if finished.parent_id:
+        data["parentSpanId"] = finished.parent_id
+    return data
+
+
+def otlp_payload(spans: List[Span]) -> Dict:
+    """Corpo de um ExportTraceServiceRequest (OTLP/HTTP com JSON)."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes(_resource)},
+        "scopeSpans": [{"scope": {"name": "tralhobot"}, "spans": [_otlp_span(finished) for finished in spans]}],
+    }]}
+
+
+class FileExporter:
+    """Um lote OTLP/JSON por linha, anexado ao arquivo."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, payload: Dict):
+        with open(self.path, "a", encoding="utf-8") as trace_file:
+            trace_file.write(json.dumps(payload, ensure_ascii=False) + "\n")
+
+
+class OtlpHttpExporter:
+    """POST do lote para um coletor OpenTelemetry (ex: http://127.0.0.1:4318/v1/traces)."""
+
+    def __init__(self, endpoint: str, timeout_seconds: float = 5.0):
+        import urllib.request
+        self._urllib = urllib.request
+        self.endpoint = endpoint
+        self.timeout_seconds = timeout_seconds
+
+    def export(self, payload: Dict):
+        request = self._urllib.Request(self.endpoint, data=json.dumps(payload).encode("utf-8"),
+                                       headers={"Content-Type": "application/json"}, method="POST")
+        with self._urllib.urlopen(request, timeout=self.timeout_seconds) as response:
+            response.read()
+
+
+class _ExportThread:
+    """
+    Recebe os spans terminados sem bloquear o turno (fila sem locks, descarte contado acima de
+    `max_queue`) e exporta em lotes de até `batch_size`, no máximo a cada `interval` segundos.
+    """
+
+    def __init__(self, exporter, max_queue: int = 10000, batch_size: int = 512, interval: float = 1.0):
+        self.exporter = exporter
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def submit(self, finished: Span):
+        if self._queue.qsize() >= self.max_queue:
+            TRACE_SPANS_DROPPED.inc()
+            return
+        self._queue.put_nowait(finished)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._export_batch(self._next_batch(self.interval))
+
+    def _next_batch(self, wait: float) -> List[Span]:
+        batch = []
+        deadline = time.monotonic() + wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export_batch(self, batch: List[Span]):
+        if not batch:
+            return
+        try:
+            self.exporter.export(otlp_payload(batch))
+        except Exception as e:  # pylint: disable=broad-except
+            LOGGER.warning("Falha ao exportar %d spans: %s", len(batch), e)
+
+    def shutdown(self):
+        """Para a thread e exporta o que ainda estiver na fila."""
+        self._stopped.set()
+        self._thread.join(timeout=self.interval + 1)
+        while True:
+            batch = self._next_batch(0)
+            if not batch:
+                break
+            self._export_batch(batch)
+
+
+def setup_tracing(config):
+    """
+    Liga a exportação conforme o DefaultConfig (TRACE_EXPORTER, TRACE_FILE_PATH, TRACE_OTLP_ENDPOINT,
+    TRACE_SAMPLE_RATE, TRACE_QUEUE_SIZE). Com TRACE_EXPORTER vazio, não faz nada.
+    """
+    global _processor, _sample_rate
+    if _processor is not None or not config.TRACE_EXPORTER:
+        return
+    if config.TRACE_EXPORTER == "file":
+        exporter = FileExporter(config.TRACE_FILE_PATH)
+    elif config.TRACE_EXPORTER == "otlp":
+        exporter = OtlpHttpExporter(config.TRACE_OTLP_ENDPOINT)
+    else:
+        LOGGER.warning("TRACE_EXPORTER desconhecido: %s. Rastreamento desligado.", config.TRACE_EXPORTER)
+        return
+    _sample_rate = config.TRACE_SAMPLE_RATE
+    _processor = _ExportThread(exporter, config.TRACE_QUEUE_SIZE)
+    atexit.register(_processor.shutdown)
+    LOGGER.info("Rastreamento ligado (%s, amostragem %.0f%%).", config.TRACE_EXPORTER, _sample_rate * 100)
+
+
+# --------------------------------------------------
+# Perfil sob demanda (POST /admin/profile)
+# --------------------------------------------------
+# Marca, no contexto do turno, que ele foi contado pelo perfil em andamento
+_PROFILED_TURN = contextvars.ContextVar("profiled_turn", default=False)
+
+
+class _ProfileSession:
+    def __init__(self, turns: int, mode: str, interval: float, done: asyncio.Future):
+        self.turns = turns
+        self.mode = mode
+        self.interval = interval
+        self.done = done
+        self.started_turns = 0
+        self.finished_turns = 0
+        self.thread_id = None
+        self._profile = None
+        self._stacks: _Counter = _Counter()
+        self._samples = 0
+        self._sampler: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def turn_started(self) -> bool:
+        """True se o turno entra na conta dos N turnos."""
+        if self.started_turns >= self.turns:
+            return False
+        self.started_turns += 1
+        if self.thread_id is not None:
+            return True
+        # Primeiro turno: liga o perfil na thread do loop de eventos (cProfile vale só para a thread que o liga)
+        self.thread_id = threading.get_ident()
+        if self.mode == "cprofile":
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+            self._sampler.start()
+        return True
+
+    def turn_finished(self):
+        if self.finished_turns >= self.started_turns:
+            return
+        self.finished_turns += 1
+        if self.finished_turns >= self.turns and not self.done.done():
+            self.stop()
+            self.done.set_result(None)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self._samples += 1
+
+    def stop(self):
+        """Desliga o perfil. Chamado na thread do loop (a mesma que ligou o cProfile)."""
+        if self._profile is not None:
+            self._profile.disable()
+        self._stopped.set()
+
+    def report(self, top: int) -> str:
+        header = f"# {self.mode}: {self.finished_turns} de {self.turns} turnos concluídos"
+        if self._profile is not None:
+            import io
+            import pstats
+            output = io.StringIO()
+            pstats.Stats(self._profile, stream=output).sort_stats("cumulative").print_stats(top)
+            return f"{header}\n{output.getvalue()}"
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+        lines = [f"{header}, {self._samples} amostras a cada {self.interval * 1000:.0f} ms (formato folded: pilha contagem)"]
+        lines.extend(f"{stack} {count}" for stack, count in self._stacks.most_common(top))
+        return "\n".join(lines) + "\n"
+
+
+class TurnProfiler:
+    """
+    Perfil dos próximos N turnos, ligado sob demanda. Com mode="cprofile", o cProfile fica ligado
+    na thread do loop do início do primeiro turno ao fim do N-ésimo (pega também o que rodar em
+    paralelo nesse intervalo). Com mode="stack", uma thread amostra a pilha da thread do loop a cada
+    `interval` segundos, com custo bem menor. Sem perfil em andamento, turn_started/turn_finished
+    só leem um atributo.
+    """
+
+    MODES = ("cprofile", "stack")
+
+    def __init__(self):
+        self._session: Optional[_ProfileSession] = None
+
+    def turn_started(self):
+        if self._session is not None:
+            _PROFILED_TURN.set(self._session.turn_started())
+
+    def turn_finished(self):
+        # Só contam os turnos que começaram com o perfil ligado (não os que já estavam em andamento)
+        if self._session is not None and _PROFILED_TURN.get():
+            _PROFILED_TURN.set(False)
+            self._session.turn_finished()
+
+    async def run(self, turns: int, mode: str = "cprofile", timeout: float = 60.0, interval: float = 0.005,
+                  top: int = 40) -> str:
+        """
+        Liga o perfil, espera N turnos (ou `timeout`) e devolve o resultado em texto. Deve rodar no
+        loop de eventos dos turnos. Lança RuntimeError se já houver um perfil em andamento.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"mode deve ser um de {self.MODES}")
+        if self._session is not None:
+            raise RuntimeError("Já existe um perfil em andamento.")
+        session = self._session = _ProfileSession(turns, mode, interval, asyncio.get_running_loop().create_future())
+        try:
+            await asyncio.wait_for(asyncio.shield(session.done), timeout)
+        except asyncio.TimeoutError:
+            pass  # Devolve o que foi coletado até aqui
+        finally:
+            session.stop()
+            self._session = None
+        return session.report(top)
+
+
+PROFILER = TurnProfiler()
+
+
+def admin_authorized(config, auth_header: str) -> bool:
+    """`Authorization: Bearer <ADMIN_TOKEN>`, comparado em tempo constante. Sem ADMIN_TOKEN ninguém é admin."""
+    return bool(config.ADMIN_TOKEN) and hmac.compare_digest(auth_header or "", f"Bearer {config.ADMIN_TOKEN}")
+
+
+def profile_request(params, config) -> Tuple[int, str, float]:
+    """Parâmetros de POST /admin/profile (?turns=50&mode=stack&timeout=60). Lança ValueError se inválidos."""
+    turns = min(max(int(params.get("turns", 50)), 1), config.PROFILE_MAX_TURNS)
+    mode = params.get("mode", "cprofile")
+    if mode not in TurnProfiler.MODES:
+        raise ValueError(f"mode deve ser um de {TurnProfiler.MODES}")
+    return turns, mode, float(params.get("timeout", 60))
+
+
+# Uso: python tracing.py [turnos]       custo por turno (10 spans) sem e com exportador
+#      python tracing.py collector [porta]   coletor OTLP/HTTP local que resume os spans recebidos
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "collector":
+        from aiohttp import web
+
+        durations: Dict[str, List[float]] = {}
+
+        async def receive(request: web.Request) -> web.Response:
+            payload = await request.json()
+            for resource_spans in payload.get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for received in scope_spans.get("spans", []):
+                        elapsed = (int(received["endTimeUnixNano"]) - int(received["startTimeUnixNano"])) / 1e6
+                        durations.setdefault(received["name"], []).append(elapsed)
+            print(f"{'span':<28} {'qtd':>7} {'média ms':>9} {'máx ms':>9}")
+            for name, values in sorted(durations.items()):
+                print(f"{name:<28} {len(values):>7} {sum(values) / len(values):>9.2f} {max(values):>9.2f}")
+            return web.json_response({})
+
+        collector = web.Application()
+        collector.router.add_post("/v1/traces", receive)
+        web.run_app(collector, host="127.0.0.1", port=int(sys.argv[2]) if len(sys.argv) > 2 else 4318)
+        sys.exit(0)
+
+    import os
+    import tempfile
+
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    def turn():
+        # Mesma forma de um turno de mensagem: raiz, autenticação, turno, estado, NLU, envio e gravação
+        with span("adapter.process_activity", SPAN_KIND_SERVER, channel_id="msteams"):
+            with span("adapter.authenticate"):
+                pass
+            with span("bot.on_turn", activity_type="message"):
+                with span("state.load"):
+                    pass
+                with span("bot.on_message_activity"):
+                    with span("nlu.classifier"):
+                        pass
+                    with span("nlu.clu", cache=False):
+                        pass
+                    with span("adapter.send_activities", count=1):
+                        pass
+                with span("state.save"):
+                    pass
+
+    def bare_turn():
+        pass
+
+    def measure(run_turn=turn) -> float:
+        started = time.perf_counter()
+        for _ in range(turns):
+            run_turn()
+        return (time.perf_counter() - started) / turns * 1e6
+
+    class _BenchConfig:
+        TRACE_EXPORTER = "file"
+        TRACE_FILE_PATH = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+        TRACE_OTLP_ENDPOINT = ""
+        TRACE_SAMPLE_RATE = 1.0
+        TRACE_QUEUE_SIZE = turns * 10
+
+    print(f"{turns} turnos com 10 spans cada")
+    print(f"{'modo':<34} {'us/turno':>9}")
+    print(f"{'sem spans (referência)':<34} {measure(bare_turn):>9.2f}")
+    print(f"{'sem exportador':<34} {measure():>9.2f}")
+    setup_tracing(_BenchConfig)
+    print(f"{'exportador de arquivo':<34} {measure():>9.2f}")
+    _sample_rate = 0.1
+    print(f"{'exportador de arquivo, 10% amostrado':<34} {measure():>9.2f}")
+    _processor.shutdown()
+    with open(_BenchConfig.TRACE_FILE_PATH, encoding="utf-8") as trace_file:
+        exported = [json.loads(line) for line in trace_file]
+    spans = [item for batch in exported for item in batch["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    traces = {item["traceId"] for item in spans}
+    roots = [item for item in spans if "parentSpanId" not in item]
+    assert len(roots) == len(traces) and all(item["name"] == "adapter.process_activity" for item in roots)
+    print(f"{len(spans)} spans exportados em {len(exported)} lotes, {len(traces)} traces; descartados: "
+          f"{int(sum(TRACE_SPANS_DROPPED._values.values()))}")  # pylint: disable=protected-access
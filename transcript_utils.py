@@ -0,0 +1,191 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from log_utils import get_logger
+
+LOGGER = get_logger("transcript")
+
+# Papéis compactos gravados em cada entrada
+ROLE_USER = "u"
+ROLE_BOT = "b"
+_ROLE_PREFIX = {ROLE_USER: "User:", ROLE_BOT: "Tralhobot:"}
+
+
+def new_transcript() -> Dict:
+    """
+    Transcrição vazia, no formato guardado na propriedade 'ConversationLog'.
+
+    - entries: lista append-only de [papel, timestamp, texto], limitada a um número máximo de entradas
+    - total: quantidade de mensagens já registradas na conversa (inclusive as descartadas)
+    - spilled: quantas entradas antigas foram movidas para o arquivo de segmento em disco
+    """
+    return {"v": 1, "entries": [], "total": 0, "spilled": 0}
+
+
+def migrate_transcript(value) -> Dict:
+    """Converte o log antigo (uma única string 'User: ...\\nTralhobot: ...') para o formato estruturado."""
+    if isinstance(value, dict) and "entries" in value:
+        return value
+    transcript = new_transcript()
+    if isinstance(value, str):
+        for line in value.splitlines():
+            role = ROLE_BOT if line.startswith("Tralhobot:") else ROLE_USER
+            text = line.split(":", 1)[1].strip() if ":" in line else line
+            transcript["entries"].append([role, 0, text])
+        transcript["total"] = len(transcript["entries"])
+    return transcript
+
+
+def _segment_path(spill_dir: str, conversation_id: str) -> str:
+    # Hash do id: ids que só diferem em caracteres especiais não caem no mesmo arquivo
+    digest = hashlib.blake2b((conversation_id or "unknown").encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(spill_dir, f"{digest}.jsonl")
+
+
+class _SpillWriter:
+    """
+    Grava os segmentos em uma thread: append_entry só enfileira as linhas, sem I/O no loop do bot.
+    Falhas de disco são registradas no log e as linhas do lote são descartadas (a transcrição no
+    estado continua completa até max_entries).
+    """
+
+    def __init__(self):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._submitted = 0
+        self._done = 0
+        self._done_changed = threading.Condition()
+
+    def submit(self, path: str, lines: str):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="transcript-spill", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush, 5.0)
+        self._submitted += 1
+        self._queue.put_nowait((path, lines))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Espera até que todos os segmentos já enfileirados estejam em disco."""
+        target = self._submitted
+        with self._done_changed:
+            return self._done_changed.wait_for(lambda: self._done >= target, timeout)
+
+    def _run(self):
+        created = set()
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            by_path: Dict[str, List[str]] = {}
+            for path, lines in batch:
+                by_path.setdefault(path, []).append(lines)
+            for path, chunks in by_path.items():
+                try:
+                    directory = os.path.dirname(path)
+                    if directory not in created:
+                        os.makedirs(directory, exist_ok=True)
+                        created.add(directory)
+                    with open(path, "a", encoding="utf-8") as segment:
+                        segment.write("".join(chunks))
+                except OSError as e:
+                    LOGGER.error("Falha ao gravar o segmento da transcrição %s: %s", path, e)
+            with self._done_changed:
+                self._done += len(batch)
+                self._done_changed.notify_all()
+
+
+_SPILL_WRITER = _SpillWriter()
+
+
+def append_entry(
+    transcript: Dict,
+    role: str,
+    text: str,
+    max_entries: int,
+    spill_dir: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+) -> Dict:
+    """
+    Acrescenta uma entrada à transcrição. Ao passar de max_entries, as entradas mais antigas
+    são descartadas (buffer circular) ou, se spill_dir estiver configurado, gravadas no
+    arquivo de segmento da conversa antes de saírem do estado (a gravação é feita por uma thread).
+    """
+    entries = transcript["entries"]
+    entries.append([role, int(time.time()), text or ""])
+    transcript["total"] += 1
+
+    overflow = len(entries) - max_entries
+    if max_entries > 0 and overflow > 0:
+        evicted = entries[:overflow]
+        del entries[:overflow]
+        if spill_dir:
+            lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in evicted)
+            _SPILL_WRITER.submit(_segment_path(spill_dir, conversation_id), lines)
+            transcript["spilled"] += overflow
+    return transcript
+
+
+def _read_segment(spill_dir: str, conversation_id: str) -> List[list]:
+    path = _segment_path(spill_dir, conversation_id)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as segment:
+        return [json.loads(line) for line in segment if line.strip()]
+
+
+def render_transcript(transcript, spill_dir: Optional[str] = None, conversation_id: Optional[str] = None) -> str:
+    """Gera o texto do log (ex: para o e-mail aos stakeholders), incluindo as entradas já movidas para o disco."""
+    transcript = migrate_transcript(transcript)
+    entries = transcript["entries"]
+    if spill_dir and transcript.get("spilled"):
+        _SPILL_WRITER.flush()  # Inclui as entradas que a thread ainda não gravou
+        entries = _read_segment(spill_dir, conversation_id) + entries
+    return "".join(f"{_ROLE_PREFIX.get(role, 'User:')} {text}\n" for role, _, text in entries)
+
+
+# Compara o log antigo (string crescente) com a transcrição limitada.
+# Uso: python transcript_utils.py
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    message = "Gostaria de saber mais sobre a implementação do Microsoft Teams na minha empresa."
+    max_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # Ids que só diferem em caracteres especiais ficam em segmentos separados, e a renderização
+    # inclui as entradas que a thread ainda está gravando
+    with tempfile.TemporaryDirectory() as spill_dir:
+        for conversation_id in ("a:b", "a/b"):
+            transcript = new_transcript()
+            for i in range(5):
+                append_entry(transcript, ROLE_USER, f"{conversation_id} {i}", 2, spill_dir, conversation_id)
+            assert render_transcript(transcript, spill_dir, conversation_id) == "".join(
+                f"User: {conversation_id} {i}\n" for i in range(5))
+    print("Segmentos verificados.")
+
+    for turns in (10, 100, 1000):
+        legacy_log, legacy_written = "", 0
+        transcript, written = new_transcript(), 0
+        with tempfile.TemporaryDirectory() as spill_dir:
+            for _ in range(turns):
+                legacy_log += f"User: {message}\n"
+                legacy_written += len(json.dumps({"ConversationLog": legacy_log}).encode())
+                append_entry(transcript, ROLE_USER, message, max_entries, spill_dir, "bench")
+                written += len(json.dumps({"ConversationLog": transcript}).encode())
+            _SPILL_WRITER.flush()
+        print(
+            f"{turns:>5} turnos | string: {len(legacy_log.encode()):>8} B em memória, {legacy_written // turns:>7} B/turno gravados"
+            f" | limitada ({max_entries}): {len(json.dumps(transcript).encode()):>6} B em memória, {written // turns:>6} B/turno gravados"
+        )
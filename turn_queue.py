@@ -0,0 +1,173 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict
+
+from botbuilder.schema import Activity, ActivityTypes, DeliveryModes
+
+from log_utils import get_logger
+
+LOGGER = get_logger("queue")
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+
+class TurnQueue:
+    """
+    Fila de turnos em processo, processada por um pool de workers assíncronos.
+
+    - Ordem por conversa: os turnos de uma mesma conversa rodam um de cada vez, na ordem
+      de chegada; conversas diferentes são processadas em paralelo.
+    - Deduplicação: um activity id já recebido (retentativa do canal) não é processado de novo.
+    - Backpressure: acima de max_depth turnos pendentes, novos turnos são recusados.
+
+    Deve ser usada a partir do loop de eventos do worker (os workers nascem no primeiro submit).
+    """
+
+    def __init__(self, workers: int = 16, max_depth: int = 1000, dedup_size: int = 10000):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.dedup_size = dedup_size
+        self._pending: Dict[str, deque] = {}  # conversa -> turnos aguardando (enfileirado_em, job)
+        self._ready = None  # asyncio.Queue de conversas com turno pronto para rodar
+        self._seen_ids = OrderedDict()
+        self._tasks = []
+        self.depth = 0
+        self.in_progress = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        if not self._tasks:
+            self._ready = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def is_duplicate(self, activity_id: str) -> bool:
+        """True (e conta a duplicata) se o activity id já foi recebido; não registra o id."""
+        if activity_id and activity_id in self._seen_ids:
+            self.duplicates += 1
+            return True
+        return False
+
+    def submit(self, conversation_id: str, activity_id: str, job: Callable[[], Awaitable]) -> str:
+        """Enfileira o turno. Retorna ACCEPTED, DUPLICATE (já recebido) ou REJECTED (fila cheia)."""
+        self._ensure_started()
+
+        if self.is_duplicate(activity_id):
+            return DUPLICATE
+        if self.depth >= self.max_depth:
+            self.rejected += 1
+            return REJECTED
+        if activity_id:
+            self._seen_ids[activity_id] = None
+            if len(self._seen_ids) > self.dedup_size:
+                self._seen_ids.popitem(last=False)
+
+        conversation_id = conversation_id or ""
+        pending = self._pending.get(conversation_id)
+        if pending is None:
+            # Conversa sem turno pendente nem em execução: agenda para um worker
+            pending = self._pending[conversation_id] = deque()
+            self._ready.put_nowait(conversation_id)
+        pending.append((time.monotonic(), job))
+        self.depth += 1
+        return ACCEPTED
+
+    async def _worker(self):
+        while True:
+            conversation_id = await self._ready.get()
+            pending = self._pending[conversation_id]
+            enqueued_at, job = pending.popleft()
+            self.depth -= 1
+            self.in_progress += 1
+
+            wait = time.monotonic() - enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            try:
+                await job()
+            except Exception as e:
+                self.failed += 1
+                LOGGER.exception("Erro ao processar turno: %s", e, extra={"fields": {"conversation_id": conversation_id}})
+            finally:
+                self.in_progress -= 1
+                self.processed += 1
+
+            # O próximo turno da mesma conversa volta para o fim da fila (justiça entre conversas)
+            if pending:
+                self._ready.put_nowait(conversation_id)
+            else:
+                del self._pending[conversation_id]
+
+    def stats(self) -> Dict:
+        started = self.processed + self.in_progress
+        return {
+            "depth": self.depth,
+            "in_progress": self.in_progress,
+            "conversations_pending": len(self._pending),
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "wait_avg_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 2),
+            "max_depth": self.max_depth,
+        }
+
+    async def drain(self, timeout: float = 10.0) -> bool:
+        """Aguarda os turnos pendentes terminarem (encerramento gracioso). Retorna False se o tempo acabar."""
+        deadline = time.monotonic() + timeout
+        while self.depth or self.in_progress:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def close(self, timeout: float = 10.0):
+        """Processa o que já foi aceito (até timeout segundos) e encerra os workers."""
+        if not await self.drain(timeout):
+            LOGGER.warning("Encerrando com %d turnos não concluídos.", self.depth + self.in_progress)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def can_defer(activity: Activity) -> bool:
+    """Invoke e ExpectReplies precisam da resposta do bot no corpo HTTP, então não podem ser adiados."""
+    return activity.type != ActivityTypes.invoke and activity.delivery_mode != DeliveryModes.expect_replies
+
+
+async def submit_activity(turn_queue: TurnQueue, adapter, activity: Activity, auth_header: str, logic, admit=None) -> str:
+    """
+    Autentica a requisição e enfileira o turno para processamento posterior.
+    Lança PermissionError se a autenticação falhar (o chamador responde 401). Com `admit`
+    (ver rate_limit.py), a lógica enfileirada é a que ele devolver, ou RateLimited é lançada.
+    """
+    identity = await adapter._authenticate_request(activity, auth_header or "")  # pylint: disable=protected-access
+    # Retentativa do canal: responde 202 de novo sem gastar os limites de admissão
+    if turn_queue.is_duplicate(activity.id):
+        return DUPLICATE
+    if admit is not None:
+        logic = admit(activity, logic)
+
+    async def job():
+        await adapter.process_activity_with_identity(activity, identity, logic)
+
+    conversation_id = activity.conversation.id if activity.conversation else ""
+    return turn_queue.submit(conversation_id, activity.id, job)
+
+
+def create_turn_queue(config):
+    """Cria a fila de turnos se TURN_QUEUE_ENABLED estiver ligado no DefaultConfig; senão None."""
+    if not config.TURN_QUEUE_ENABLED:
+        return None
+    LOGGER.info("Confirmação imediata ativada (%d workers, limite %d).", config.TURN_QUEUE_WORKERS, config.TURN_QUEUE_MAX_DEPTH)
+    return TurnQueue(config.TURN_QUEUE_WORKERS, config.TURN_QUEUE_MAX_DEPTH, config.TURN_QUEUE_DEDUP_SIZE)